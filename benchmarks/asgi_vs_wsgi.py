@@ -0,0 +1,107 @@
+"""
+Concurrent-connection throughput of the read endpoints: sync stack (gunicorn + Flask +
+Flask-SQLAlchemy, src/wsgi.py) against the async stack (uvicorn + src/asgi.py).
+Both servers are started with the same number of workers against the database in
+DB_CONNECTION_STRING (load some data first: flask load-data ...), then every path is
+requested by N concurrent keep-alive connections.
+
+    $ pipenv run python benchmarks/asgi_vs_wsgi.py --workers 2 --concurrency 10 50 200
+    $ pipenv run python benchmarks/asgi_vs_wsgi.py --path "/planet?limit=100" --path /character/1
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import http.client
+import threading
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+SERVERS = {
+    "wsgi (gunicorn sync)": ["gunicorn", "wsgi", "--chdir", SRC, "--workers", "{workers}", "--bind", "127.0.0.1:{port}", "--log-level", "warning"],
+    "asgi (uvicorn async)": ["uvicorn", "asgi:app", "--app-dir", SRC, "--workers", "{workers}", "--port", "{port}", "--log-level", "warning"],
+}
+
+
+def wait_until_up(port, timeout=30):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/planet?limit=1")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server on port %d did not start" % port)
+
+def run_load(port, path, concurrency, seconds):
+    # every thread keeps one connection open and sends requests back to back
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine = []
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors[0] += 1
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                continue
+            mine.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    count = len(latencies)
+    percentile = lambda p: latencies[min(count - 1, int(count * p))] * 1000 if count else float("nan")
+    return count / seconds, percentile(0.50), percentile(0.99), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--path", action="append", help="paths to request (default: /planet?limit=100 and /character/1)")
+    parser.add_argument("--port", type=int, default=8900)
+    args = parser.parse_args()
+    paths = args.path or ["/planet?limit=100", "/character/1"]
+
+    print("%-22s %-22s %6s %10s %9s %9s %7s" % ("server", "path", "conns", "req/s", "p50 ms", "p99 ms", "errors"))
+    for offset, (name, command) in enumerate(SERVERS.items()):
+        port = args.port + offset
+        command = [part.format(workers=args.workers, port=port) for part in command]
+        # the rate limiter (ratelimit.py) would answer most of these requests with a 429
+        env = dict(os.environ, LOG_LEVEL="WARNING")
+        env.setdefault("RATE_LIMIT_ENABLED", "0")
+        server = subprocess.Popen(command, env=env)
+        try:
+            wait_until_up(port)
+            for path in paths:
+                for concurrency in args.concurrency:
+                    rate, p50, p99, errors = run_load(port, path, concurrency, args.seconds)
+                    print("%-22s %-22s %6d %10.1f %9.2f %9.2f %7d" % (name, path, concurrency, rate, p50, p99, errors))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""
+Login cost benchmark: how many /token password checks per second one core can do
+at each PASSWORD_HASH_ITERATIONS value, and the total with the password pool.
+Use it to pick the work factor and to size the /token tier.
+
+    $ pipenv run python benchmarks/login_bench.py
+    $ pipenv run python benchmarks/login_bench.py --iterations 100000 260000 600000 --seconds 3
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from passwords import hash_password, verify_password  # noqa: E402
+
+
+def measure(fn, seconds):
+    # calls fn until "seconds" have passed, returns calls per second
+    count = 0
+    started = time.perf_counter()
+    while True:
+        fn()
+        count += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return count / elapsed
+
+def measure_pool(fn, seconds, workers):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        rates = list(pool.map(lambda _: measure(fn, seconds), range(workers)))
+    return sum(rates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, nargs="+", default=[50000, 150000, 260000, 600000])
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent on each measure")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="threads for the pool measure")
+    args = parser.parse_args()
+
+    print("%12s %14s %16s %20s" % ("iterations", "ms per login", "logins/s/core", "logins/s (%d threads)" % args.workers))
+    for iterations in args.iterations:
+        pwhash = hash_password("benchmark password", iterations)
+        check = lambda: verify_password(pwhash, "benchmark password")
+        per_core = measure(check, args.seconds)
+        pooled = measure_pool(check, args.seconds, args.workers)
+        print("%12d %14.2f %16.1f %20.1f" % (iterations, 1000.0 / per_core, per_core, pooled))
+
+
+if __name__ == "__main__":
+    main()
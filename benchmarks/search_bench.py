@@ -0,0 +1,97 @@
+"""
+Search benchmark: query latency of the /search index (src/search.py) on a catalog of
+N synthetic characters and planets (1M by default), per kind of query.
+The index is filled in memory, no database needed; GET /search adds the request and
+JSON time on top of these numbers.
+
+    $ pipenv run python benchmarks/search_bench.py
+    $ pipenv run python benchmarks/search_bench.py --entities 200000 --queries 2000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from models import Character, Planet  # noqa: E402
+from search import SearchIndex, tokenize  # noqa: E402
+
+SYLLABLES = ["ka", "lo", "vor", "th", "an", "dul", "mi", "rek", "sa", "zin", "ba", "tor",
+             "el", "qua", "ni", "gar", "ush", "ye", "po", "ran", "di", "xe", "mon", "ak"]
+GENDERS = ["male", "female", "n/a", "hermaphrodite"]
+COLORS = ["blue", "brown", "yellow", "red", "green", "black", "orange", "hazel"]
+CLIMATES = ["arid", "temperate", "tropical", "frozen", "murky", "windy", "hot"]
+TERRAINS = ["desert", "grasslands", "mountains", "jungle", "tundra", "swamp", "ocean", "cityscape", "forests"]
+
+
+def word(rnd):
+    return "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))).capitalize()
+
+def fill(index, count, seed):
+    rnd = random.Random(seed)
+    index.loading = True
+    for id in range(1, count + 1):
+        name = " ".join(word(rnd) for _ in range(rnd.randint(1, 3)))
+        if index.model is Character:
+            facets = {"gender": rnd.choice(GENDERS), "eye_color": rnd.choice(COLORS)}
+        else:
+            facets = {"climate": ", ".join(rnd.sample(CLIMATES, rnd.randint(1, 2))),
+                      "terrain": ", ".join(rnd.sample(TERRAINS, rnd.randint(1, 3)))}
+        index.add(id, name, facets)
+    index.sorted_tokens = sorted(index.postings)
+    index.loading = False
+
+def typo(token, rnd):
+    i = rnd.randrange(len(token))
+    return token[:i] + rnd.choice("aeiouxz") + token[i + 1:]
+
+def queries(index, count, rnd):
+    names = [index.names[rnd.randint(1, len(index.names))] for _ in range(count)]
+    words = [rnd.choice(tokenize(name)) for name in names]
+    return {
+        "prefix (3 letters)": [([w[:3]], {}) for w in words],
+        "whole word": [([w], {}) for w in words],
+        "full name": [(tokenize(name), {}) for name in names],
+        "one typo": [([typo(w, rnd)], {}) for w in words if len(w) >= 5],
+        "word + facet": [([w], {index.model.facet_fields[0]: index.model.facet_fields[0] == "gender" and "male" or "arid"}) for w in words],
+    }
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=1000000, help="half characters, half planets")
+    parser.add_argument("--queries", type=int, default=1000, help="per kind of query")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    indexes = [SearchIndex(Character), SearchIndex(Planet)]
+    started = time.perf_counter()
+    for seed, index in enumerate(indexes):
+        fill(index, args.entities // 2, seed)
+    print("%d entities indexed in %.1fs, %d distinct words" % (
+        args.entities, time.perf_counter() - started, sum(len(index.postings) for index in indexes)))
+
+    print("%-20s %10s %10s %10s %10s %12s" % ("query", "p50 us", "p95 us", "p99 us", "max us", "avg results"))
+    for index in indexes:
+        for name, cases in queries(index, args.queries, rnd).items():
+            times = []
+            results = 0
+            for words, filters in cases:
+                t = time.perf_counter()
+                total, hits, facets, approximate = index.search(words, filters, args.limit, True)
+                times.append((time.perf_counter() - t) * 1e6)
+                results += total
+            times.sort()
+            print("%-20s %10.0f %10.0f %10.0f %10.0f %12.1f" % (
+                index.kind + ": " + name, percentile(times, 0.5), percentile(times, 0.95),
+                percentile(times, 0.99), times[-1], results / len(cases)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Serialization benchmark: GET /character with N rows, the serialize() path
+(ORM objects + model.serialize() + json.dumps) against the fast path used by the
+list endpoints (Core rows + precompiled serializer + orjson, see src/serializers.py).
+Runs on an in-memory SQLite database, no server needed.
+
+    $ pipenv run python benchmarks/serialize_bench.py
+    $ pipenv run python benchmarks/serialize_bench.py --rows 100000 --repeat 5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from flask import Flask  # noqa: E402
+from models import db, Character  # noqa: E402
+from loader import synthetic_records, complete_rows  # noqa: E402
+import serializers  # noqa: E402
+
+
+def create_app(rows):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite://"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        records = complete_rows(Character, list(synthetic_records(Character, rows)))
+        db.session.execute(Character.__table__.insert(), records)
+        db.session.commit()
+    return app
+
+
+def serialize_path():
+    # what the endpoints did before: one ORM object per row
+    characters = Character.query.order_by(Character.id).all()
+    return json.dumps([character.serialize() for character in characters])
+
+def fast_path():
+    fields = list(Character.public_fields)
+    rows = Character.query.with_entities(*serializers.select_columns(Character, fields)).order_by(Character.id).all()
+    return serializers.dumps(serializers.serialize_rows(Character, fields, rows))
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        times.append(time.perf_counter() - started)
+        db.session.remove()
+    return min(times), len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3, help="the best time of this many runs is kept")
+    args = parser.parse_args()
+
+    app = create_app(args.rows)
+    with app.app_context():
+        print("%d rows, orjson %s" % (args.rows, "installed" if serializers.orjson else "NOT installed (json fallback)"))
+        print("%-30s %10s %12s %12s" % ("path", "ms", "rows/s", "bytes"))
+        results = {}
+        for name, fn in (("serialize() + json.dumps", serialize_path), ("compiled rows + orjson", fast_path)):
+            seconds, size = best_of(fn, args.repeat)
+            results[name] = seconds
+            print("%-30s %10.1f %12.0f %12d" % (name, seconds * 1000, args.rows / seconds, size))
+        base, fast = results.values()
+        print("speedup: %.1fx" % (base / fast))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Startup benchmark: what a worker pays before it serves its first request.
+  1. import-time profile of main.create_app(role) (python -X importtime), grouped by package
+  2. cold start (import + create_app) per APP_ROLE, median of N fresh interpreters
+  3. gunicorn with and without --preload: time until it answers and memory of the
+     workers (PSS, private = what a worker does not share with the others), Linux only
+
+    $ pipenv run python benchmarks/startup_bench.py
+    $ pipenv run python benchmarks/startup_bench.py --profile-role all --top 25 --skip-gunicorn
+
+Uses DB_CONNECTION_STRING (a throwaway SQLite database when it is not set).
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import http.client
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+ROLES = ["api", "admin", "all"]
+CREATE_APP = "from main import create_app; create_app(%r)"
+
+
+def environment():
+    env = dict(os.environ, LOG_LEVEL="WARNING", PYTHONDONTWRITEBYTECODE="0")
+    env.setdefault("DB_CONNECTION_STRING", "sqlite:////tmp/startup_bench.sqlite")
+    env.setdefault("TOKEN_KEY", "startup-bench-key")
+    return env
+
+
+### 1. import-time profile
+
+def import_profile(role, env):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", CREATE_APP % role],
+                            cwd=SRC, env=env, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us), len(name) - len(name.lstrip())))
+    return modules
+
+def print_profile(role, modules, top):
+    total = sum(self_us for name, self_us, cumulative_us, depth in modules)
+    packages = {}
+    for name, self_us, cumulative_us, depth in modules:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    print("import time of create_app(%r): %.0f ms, %d modules" % (role, total / 1000, len(modules)))
+    print("\n%-30s %10s %7s" % ("package", "self ms", "share"))
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print("%-30s %10.1f %6.1f%%" % (package, self_us / 1000, 100.0 * self_us / total))
+    # the modules imported by the app itself (depth 1 below the -c script), slowest first
+    print("\n%-30s %10s" % ("imported by src/", "cumul. ms"))
+    local = {os.path.splitext(name)[0] for name in os.listdir(SRC) if name.endswith(".py")}
+    for name, self_us, cumulative_us, depth in sorted(modules, key=lambda item: -item[2]):
+        if name in local:
+            print("%-30s %10.1f" % (name, cumulative_us / 1000))
+
+
+### 2. cold start
+
+def cold_start(role, env, runs):
+    code = "import time; started = time.perf_counter(); " + CREATE_APP % role + "; print(time.perf_counter() - started)"
+    times = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", code], cwd=SRC, env=env, capture_output=True, text=True, check=True)
+        times.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    return statistics.median(times), min(times)
+
+
+### 3. gunicorn
+
+def memory(pid):
+    # PSS and private memory (kB) from /proc/<pid>/smaps_rollup
+    values = {}
+    with open("/proc/%d/smaps_rollup" % pid) as fp:
+        for line in fp:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].rstrip(":") in ("Pss", "Private_Clean", "Private_Dirty"):
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return values.get("Pss", 0), values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+
+def children(pid):
+    with open("/proc/%d/task/%d/children" % (pid, pid)) as fp:
+        return [int(child) for child in fp.read().split()]
+
+def gunicorn_start(preload, role, workers, port, env, timeout=60):
+    command = ["gunicorn", "wsgi", "--chdir", SRC, "--workers", str(workers), "--bind", "127.0.0.1:%d" % port,
+               "--log-level", "warning"] + (["--preload"] if preload else [])
+    started = time.perf_counter()
+    server = subprocess.Popen(command, env=dict(env, APP_ROLE=role), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+                connection.request("GET", "/metrics")
+                connection.getresponse().read()
+                break
+            except OSError:
+                time.sleep(0.05)
+        ready = (time.perf_counter() - started) * 1000
+        # every worker has loaded the app once they all answered a few requests
+        for _ in range(workers * 10):
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/metrics")
+            connection.getresponse().read()
+        time.sleep(0.5)
+        pss = private = 0
+        pids = children(server.pid)
+        for pid in pids:
+            worker_pss, worker_private = memory(pid)
+            pss += worker_pss
+            private += worker_private
+        master_pss, master_private = memory(server.pid)
+        return ready, (pss + master_pss) / 1024, private / 1024 / max(1, len(pids))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile-role", default="all", choices=ROLES)
+    parser.add_argument("--top", type=int, default=15, help="packages in the import profile")
+    parser.add_argument("--runs", type=int, default=5, help="interpreters per role for the cold start")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8960)
+    parser.add_argument("--skip-gunicorn", action="store_true")
+    args = parser.parse_args()
+    env = environment()
+
+    print_profile(args.profile_role, import_profile(args.profile_role, env), args.top)
+
+    print("\n%-8s %12s %12s" % ("role", "median ms", "best ms"))
+    for role in ROLES:
+        median, best = cold_start(role, env, args.runs)
+        print("%-8s %12.1f %12.1f" % (role, median, best))
+
+    if args.skip_gunicorn or not os.path.exists("/proc/self/smaps_rollup"):
+        return 0
+    print("\n%-8s %-10s %12s %14s %18s" % ("role", "preload", "ready ms", "total PSS MB", "private/worker MB"))
+    for role in ("api", "all"):
+        for preload in (False, True):
+            ready, pss, private = gunicorn_start(preload, role, args.workers, args.port, env)
+            print("%-8s %-10s %12.0f %14.1f %18.1f" % (role, "yes" if preload else "no", ready, pss, private))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
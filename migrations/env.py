@@ -73,6 +73,12 @@ def run_migrations_online():
     connectable = current_app.extensions['migrate'].db.engine
 
     with connectable.connect() as connection:
+        # SQLite: op.batch_alter_table() rebuilds a table by copying and dropping it, with
+        # foreign keys on (models.py turns them on) the DROP would run the ON DELETE CASCADEs
+        # of the other tables. The pragma only works outside a transaction, so here
+        if connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
@@ -0,0 +1,30 @@
+"""seed the revoked_token version
+
+Revision ID: 86d69d788347
+Revises: 9c3e5a7f1b24
+Create Date: 2026-10-17 23:41:27.093512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '86d69d788347'
+down_revision = '9c3e5a7f1b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # every versioned table has its row before the workers start, so bump() is only an UPDATE
+    # (two workers inserting the first row at the same time would conflict).
+    # The row is already there when a worker bumped it before this migration ran.
+    table_version = sa.table('table_version', sa.column('name', sa.String), sa.column('version', sa.Integer))
+    found = op.get_bind().execute(sa.select([table_version.c.name]).where(table_version.c.name == 'revoked_token')).first()
+    if found is None:
+        op.bulk_insert(table_version, [{'name': 'revoked_token', 'version': 0}])
+
+
+def downgrade():
+    op.execute("DELETE FROM table_version WHERE name = 'revoked_token'")
@@ -0,0 +1,34 @@
+"""unique favorite per user and item
+
+Revision ID: 8d41e6a0f2b9
+Revises: 3f9a2b7d1c40
+Create Date: 2026-10-17 11:03:52.640117
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41e6a0f2b9'
+down_revision = '3f9a2b7d1c40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # remove the duplicated favorites first (keep the oldest row of each user/item),
+    # the derived table is needed by MySQL to delete from the table it selects from
+    op.execute(
+        "DELETE FROM favorite WHERE id NOT IN ("
+        "SELECT id FROM (SELECT MIN(id) AS id FROM favorite GROUP BY user_id, item_type, item_id) AS keep)"
+    )
+    # the unique constraint creates the composite (user_id, item_type, item_id) index used by
+    # GET /favorite and /favorite_raw. user.email needs no new index, its unique constraint has one.
+    # batch mode so it also works on SQLite
+    with op.batch_alter_table('favorite') as batch_op:
+        batch_op.create_unique_constraint('uq_favorite_user_item', ['user_id', 'item_type', 'item_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('favorite') as batch_op:
+        batch_op.drop_constraint('uq_favorite_user_item', type_='unique')
@@ -0,0 +1,73 @@
+"""favorite foreign keys to character and planet
+
+Revision ID: b5c0d93e7a18
+Revises: 8d41e6a0f2b9
+Create Date: 2026-10-17 12:20:07.381925
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5c0d93e7a18'
+down_revision = '8d41e6a0f2b9'
+branch_labels = None
+depends_on = None
+
+favorite = sa.table('favorite',
+    sa.column('id', sa.Integer),
+    sa.column('item_id', sa.Integer),
+    sa.column('item_type', sa.String),
+    sa.column('character_id', sa.Integer),
+    sa.column('planet_id', sa.Integer),
+)
+character = sa.table('character', sa.column('id', sa.Integer))
+planet = sa.table('planet', sa.column('id', sa.Integer))
+
+
+def upgrade():
+    with op.batch_alter_table('favorite') as batch_op:
+        batch_op.add_column(sa.Column('character_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('planet_id', sa.Integer(), nullable=True))
+
+    # item_id -> character_id / planet_id, only when the item still exists
+    op.execute(favorite.update()
+        .where(favorite.c.item_type == 'character')
+        .where(favorite.c.item_id.in_(sa.select(character.c.id)))
+        .values(character_id=favorite.c.item_id))
+    op.execute(favorite.update()
+        .where(favorite.c.item_type == 'planet')
+        .where(favorite.c.item_id.in_(sa.select(planet.c.id)))
+        .values(planet_id=favorite.c.item_id))
+    # dangling favorites (their item was deleted) can not get a foreign key
+    op.execute(favorite.delete().where(favorite.c.character_id.is_(None)).where(favorite.c.planet_id.is_(None)))
+
+    with op.batch_alter_table('favorite') as batch_op:
+        batch_op.drop_constraint('uq_favorite_user_item', type_='unique')
+        batch_op.drop_column('item_id')
+        batch_op.create_foreign_key('fk_favorite_character_id', 'character', ['character_id'], ['id'], ondelete='CASCADE')
+        batch_op.create_foreign_key('fk_favorite_planet_id', 'planet', ['planet_id'], ['id'], ondelete='CASCADE')
+        batch_op.create_unique_constraint('uq_favorite_user_character', ['user_id', 'character_id'])
+        batch_op.create_unique_constraint('uq_favorite_user_planet', ['user_id', 'planet_id'])
+        batch_op.create_check_constraint('ck_favorite_item',
+            "(item_type = 'character' AND character_id IS NOT NULL AND planet_id IS NULL)"
+            " OR (item_type = 'planet' AND planet_id IS NOT NULL AND character_id IS NULL)")
+
+
+def downgrade():
+    with op.batch_alter_table('favorite') as batch_op:
+        batch_op.add_column(sa.Column('item_id', sa.Integer(), nullable=True))
+
+    op.execute(favorite.update().values(item_id=sa.func.coalesce(favorite.c.character_id, favorite.c.planet_id)))
+
+    with op.batch_alter_table('favorite') as batch_op:
+        batch_op.drop_constraint('ck_favorite_item', type_='check')
+        batch_op.drop_constraint('uq_favorite_user_planet', type_='unique')
+        batch_op.drop_constraint('uq_favorite_user_character', type_='unique')
+        batch_op.drop_constraint('fk_favorite_planet_id', type_='foreignkey')
+        batch_op.drop_constraint('fk_favorite_character_id', type_='foreignkey')
+        batch_op.drop_column('planet_id')
+        batch_op.drop_column('character_id')
+        batch_op.alter_column('item_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_unique_constraint('uq_favorite_user_item', ['user_id', 'item_type', 'item_id'])
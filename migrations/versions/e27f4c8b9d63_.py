@@ -0,0 +1,44 @@
+"""hash user passwords
+
+Revision ID: e27f4c8b9d63
+Revises: b5c0d93e7a18
+Create Date: 2026-10-17 13:41:26.905113
+
+"""
+import os
+from alembic import op
+import sqlalchemy as sa
+from werkzeug.security import generate_password_hash
+
+
+# revision identifiers, used by Alembic.
+revision = 'e27f4c8b9d63'
+down_revision = 'b5c0d93e7a18'
+branch_labels = None
+depends_on = None
+
+user = sa.table('user',
+    sa.column('id', sa.Integer),
+    sa.column('password', sa.String),
+)
+
+
+def upgrade():
+    # a PBKDF2 hash does not fit in 80 characters
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=80), type_=sa.String(length=255), existing_nullable=False)
+
+    # replace the plain text passwords by their hash (same method and cost as src/passwords.py)
+    method = 'pbkdf2:sha256:' + os.environ.get('PASSWORD_HASH_ITERATIONS', '260000')
+    connection = op.get_bind()
+    for row in connection.execute(sa.select(user.c.id, user.c.password)).fetchall():
+        if row.password.startswith('pbkdf2:') and row.password.count('$') == 2:
+            continue
+        hashed = generate_password_hash(row.password, method=method, salt_length=16)
+        connection.execute(user.update().where(user.c.id == row.id).values(password=hashed))
+
+
+def downgrade():
+    # hashes can not be turned back into passwords and do not fit in the old
+    # String(80) column, so the column stays as it is
+    pass
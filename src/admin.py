@@ -1,7 +1,64 @@
 import os
+from flask import g
 from flask_admin import Admin
+from sqlalchemy import inspect
 from models import db, User, Character, Planet, Favorite
 from flask_admin.contrib.sqla import ModelView
+from versions import table_versions
+from cache import model_cache
+from search import search
+from service import Service
+
+class UserView(ModelView):
+    # a user edited or deleted here (is_active...) must drop out of the identity cache
+    # of every worker (see identity.py): the change bumps the user table version
+    def on_model_change(self, form, model, is_created):
+        table_versions.bump(User)
+
+    def on_model_delete(self, model):
+        table_versions.bump(User)
+
+class CatalogView(ModelView):
+    # characters and planets edited here, like the write endpoints of main.py: the table
+    # version changes the ETags, the cached favorites lists and the search index of every
+    # worker, this worker's model cache and search index are updated at once
+    def on_model_change(self, form, model, is_created):
+        table_versions.bump(self.model)
+
+    def after_model_change(self, form, model, is_created):
+        model_cache.invalidate(self.model, model.id)
+        search.update(self.model, [model.id])
+
+    def on_model_delete(self, model):
+        g.admin_deleted_id = model.id
+        table_versions.bump(self.model)   # its favorites are deleted too (ON DELETE CASCADE)
+
+    def after_model_delete(self, model):
+        id = g.pop("admin_deleted_id", None)
+        model_cache.invalidate(self.model, id)
+        search.update(self.model, [id])
+
+class FavoriteView(ModelView):
+    # the favorite table version is bumped like in the favorite endpoints, and the cached
+    # favorites list of the user (and of the previous one when the favorite changed hands)
+    # is dropped after the commit, see cache.FavoritesCache
+    def owners(self, model):
+        history = inspect(model).attrs.user_id.history
+        return set(history.deleted or ()) | {model.user_id}
+
+    def on_model_change(self, form, model, is_created):
+        g.admin_favorite_owners = self.owners(model)
+        table_versions.bump(Favorite)
+
+    def after_model_change(self, form, model, is_created):
+        Service.invalidate_favorites(g.pop("admin_favorite_owners", set()) | {model.user_id})
+
+    def on_model_delete(self, model):
+        g.admin_favorite_owners = {model.user_id}
+        table_versions.bump(Favorite)
+
+    def after_model_delete(self, model):
+        Service.invalidate_favorites(g.pop("admin_favorite_owners", set()))
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
@@ -10,10 +67,10 @@ def setup_admin(app):
 
     
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Character, db.session))
-    admin.add_view(ModelView(Planet, db.session))
-    admin.add_view(ModelView(Favorite, db.session))
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(CatalogView(Character, db.session))
+    admin.add_view(CatalogView(Planet, db.session))
+    admin.add_view(FavoriteView(Favorite, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
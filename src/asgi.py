@@ -0,0 +1,154 @@
+# ASGI entry point for the read endpoints, with an async database engine.
+# Run it next to (or instead of) the gunicorn/WSGI app:
+#   $ uvicorn asgi:app --app-dir ./src --workers 4
+# One worker serves many requests at the same time while they wait for the database,
+# instead of one blocked sync worker per in-flight query.
+# It uses the same models as main.py (models.py) and the same query parameters
+# (limit, after, fields, filters) and JWTs (TOKEN_KEY) as the Flask endpoints.
+# Tokens are verified by the same code as in the Flask app (identity.py), in a small Flask
+# app of its own run in a thread: an access token only, not revoked (DELETE /token), of a
+# user that still exists and is active.
+# Writes, /token and the admin stay in the Flask app.
+
+import os
+import contextlib
+from flask import Flask
+from flask_jwt_extended import JWTManager
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from models import db, Character, Planet, Favorite
+from identity import verify_identity, init_identity
+from routing import engine_options
+from utils import APIException, MAX_PAGE_SIZE, parse_int_arg, parse_fields_arg, filter_conditions
+from serializers import select_columns, serialize_rows, dumps
+
+# sync driver in DB_CONNECTION_STRING -> its async driver
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "mysql+mysqlconnector": "mysql+aiomysql",
+    "mysql+mysqldb": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def async_database_url(url):
+    scheme, rest = url.split("://", 1)
+    return ASYNC_DRIVERS.get(scheme, scheme) + "://" + rest
+
+DATABASE_URL = os.environ.get('ASYNC_DB_CONNECTION_STRING') or async_database_url(os.environ.get('DB_CONNECTION_STRING'))
+engine = create_async_engine(DATABASE_URL)
+Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+# for the token checks only (sync, the identity cache and revoked tokens of identity.py)
+auth_app = Flask(__name__)
+auth_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')
+auth_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+auth_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
+auth_app.config["JWT_SECRET_KEY"] = os.environ.get('TOKEN_KEY')
+db.init_app(auth_app)
+jwt = JWTManager(auth_app)
+init_identity(jwt)
+
+
+class FastJSONResponse(JSONResponse):
+    # orjson when installed (serializers.dumps), like the Flask app
+    def render(self, content):
+        return dumps(content).encode("utf-8")
+
+
+async def list_rows(model, args):
+    # same rules as utils.paginate_list, next cursor in the X-Next-Cursor header
+    fields = parse_fields_arg(args, model.public_fields)
+    limit = parse_int_arg(args, "limit")
+    after = parse_int_arg(args, "after")
+    if limit is not None and (limit < 1 or limit > MAX_PAGE_SIZE):
+        raise APIException("'limit' must be between 1 and " + str(MAX_PAGE_SIZE), status_code=400)
+
+    query = select(*select_columns(model, fields)).order_by(model.id)
+    if after is not None:
+        query = query.where(model.id > after)
+    for condition in filter_conditions(model, args, model.filter_fields):
+        query = query.where(condition)
+    if limit is not None:
+        query = query.limit(limit + 1)
+
+    async with Session() as session:
+        rows = (await session.execute(query)).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return serialize_rows(model, fields, rows), next_cursor
+
+async def get_item(model, id, message):
+    async with Session() as session:
+        item = await session.get(model, id)
+    if item is None:
+        raise APIException(message, status_code=404)
+    return item.serialize()
+
+def verify_token(header):
+    with auth_app.test_request_context(headers={"Authorization": header} if header else {}):
+        try:
+            return verify_identity()
+        except Exception as error:
+            # flask_jwt_extended's answer for this error, {"msg": ...} with a 401 (or a 422 for
+            # a refresh or malformed token) like the Flask app; the other errors are raised again
+            response = auth_app.make_response(auth_app.handle_user_exception(error))
+            body = response.get_json()
+            raise APIException(body["msg"], status_code=response.status_code, payload=body)
+
+async def current_user_id(request):
+    # the tokens made by POST /token in the Flask app (flask_jwt_extended puts the identity in "sub")
+    return await run_in_threadpool(verify_token, request.headers.get("Authorization", ""))
+
+
+def list_endpoint(model):
+    async def endpoint(request):
+        items, next_cursor = await list_rows(model, request.query_params)
+        headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else None
+        return FastJSONResponse(items, headers=headers)
+    return endpoint
+
+def detail_endpoint(model, message):
+    async def endpoint(request):
+        return FastJSONResponse(await get_item(model, request.path_params["id"], message))
+    return endpoint
+
+async def get_all_favorite(request):
+    user_id = await current_user_id(request)   # its user exists, or it was a 401
+    async with Session() as session:
+        query = select(Favorite).where(Favorite.user_id == user_id) \
+            .options(joinedload(Favorite.character), joinedload(Favorite.planet)) \
+            .order_by(Favorite.id)
+        favorites = (await session.execute(query)).scalars().all()
+        return FastJSONResponse([fav.item.serialize() if fav.item is not None else None for fav in favorites])
+
+
+async def handle_api_exception(request, error):
+    return FastJSONResponse(error.to_dict(), status_code=error.status_code)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route('/character', list_endpoint(Character)),
+        Route('/character/{id:int}', detail_endpoint(Character, 'Character not found')),
+        Route('/planet', list_endpoint(Planet)),
+        Route('/planet/{id:int}', detail_endpoint(Planet, 'Planet not found')),
+        Route('/favorite', get_all_favorite),
+    ],
+    exception_handlers={APIException: handle_api_exception},
+    lifespan=lifespan,
+)
@@ -0,0 +1,85 @@
+from sqlalchemy import event, select, inspect
+from sqlalchemy.orm import Session
+from models import db, Attribute, Character, Planet, split_values
+from bulk import chunks
+
+# Keeps the attribute tables (models.py) in sync with the comma separated columns
+# they normalize (Planet.terrain/climate, Character.hair_color/skin_color):
+# - ORM writes (the endpoints, the admin) are synced in the same flush, see sync_after_flush
+# - the Core writes (bulk endpoints, flask load-data) call sync_attributes() before their commit
+# Deleted rows lose their links through ON DELETE CASCADE.
+
+MULTI_VALUE_MODELS = (Character, Planet)
+
+
+def attribute_ids(connection, pairs):
+    # {(kind, value)} -> {(kind, value): attribute id}, the missing attributes are created
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+    table = Attribute.__table__
+    kinds = {kind for kind, value in pairs}
+
+    def load():
+        found = {}
+        values = sorted({value for kind, value in pairs})
+        for values_chunk in chunks(values):
+            query = select(table.c.id, table.c.kind, table.c.value) \
+                .where(table.c.kind.in_(kinds), table.c.value.in_(values_chunk))
+            for row in connection.execute(query):
+                if (row.kind, row.value) in pairs:
+                    found[(row.kind, row.value)] = row.id
+        return found
+
+    found = load()
+    missing = pairs - set(found)
+    if missing:
+        connection.execute(table.insert(), [{"kind": kind, "value": value} for kind, value in sorted(missing)])
+        found = load()
+    return found
+
+def sync_attributes(connection, model, condition):
+    # rebuilds the links of the rows matching condition from their column values
+    fields = model.multi_value_fields
+    link = model.attribute_table
+    owner_id = link.c[model.__tablename__ + "_id"]
+    columns = [model.id] + [getattr(model, field) for field in fields]
+    rows = connection.execute(select(*columns).where(condition)).all()
+    if not rows:
+        return
+    wanted = set()
+    for row in rows:
+        for field, raw in zip(fields, row[1:]):
+            for value in split_values(raw):
+                wanted.add((row[0], field, value))
+    ids = attribute_ids(connection, {(field, value) for id, field, value in wanted})
+    for ids_chunk in chunks([row[0] for row in rows]):
+        connection.execute(link.delete().where(owner_id.in_(ids_chunk)))
+    if wanted:
+        connection.execute(link.insert(), [{owner_id.name: id, "attribute_id": ids[(field, value)]}
+                                           for id, field, value in wanted])
+
+def sync_ids(model, ids):
+    for ids_chunk in chunks(list(ids)):
+        sync_attributes(db.session.connection(), model, model.id.in_(ids_chunk))
+
+def sync_names(model, names):
+    # for the bulk inserts, which do not return the new ids (name is unique)
+    names = [name for name in names if isinstance(name, str)]
+    for names_chunk in chunks(names):
+        sync_attributes(db.session.connection(), model, model.name.in_(names_chunk))
+
+
+@event.listens_for(Session, "after_flush")
+def sync_after_flush(session, flush_context):
+    changed = {}
+    for obj in list(session.new) + list(session.dirty):
+        model = type(obj)
+        if model not in MULTI_VALUE_MODELS:
+            continue
+        state = inspect(obj)
+        if obj in session.new or any(state.attrs[field].history.has_changes() for field in model.multi_value_fields):
+            changed.setdefault(model, []).append(obj.id)
+    for model, ids in changed.items():
+        for ids_chunk in chunks(ids):
+            sync_attributes(session.connection(), model, model.id.in_(ids_chunk))
@@ -0,0 +1,232 @@
+import os
+from models import db
+from utils import APIException
+
+# Bulk create/update/delete for the /<model>/bulk endpoints.
+# Every item is validated first and gets its own result ({"index", "status", ...}),
+# the valid ones are written with executemany-style statements in chunks of
+# BULK_BATCH_SIZE and the endpoint commits them all in ONE transaction.
+
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', 500))
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 10000))
+
+NUMERIC_TYPES = (int, float)
+
+
+def chunks(items, size=None):
+    size = size or BULK_BATCH_SIZE
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def get_bulk_body(request_body):
+    if not isinstance(request_body, list):
+        raise APIException('Request body must be a JSON array', status_code=400)
+    if len(request_body) > BULK_MAX_ITEMS:
+        raise APIException('Too many items, the limit is ' + str(BULK_MAX_ITEMS), status_code=400)
+    return request_body
+
+def error_result(index, message, error=None):
+    result = {"index": index, "status": "error", "message": message}
+    if error is not None:
+        result["error"] = error   # machine readable reason: "not_found"
+    return result
+
+def validate_value(column, value):
+    # numbers may come as strings ("172.0"), like in /populate
+    python_type = column.type.python_type
+    if python_type in NUMERIC_TYPES:
+        if isinstance(value, bool):
+            return "'" + column.name + "' must be a number"
+        try:
+            float(value)
+        except (TypeError, ValueError):
+            return "'" + column.name + "' must be a number"
+    if python_type is str and not isinstance(value, str):
+        return "'" + column.name + "' must be a string"
+    return None
+
+def validate_item(model, item, required):
+    # returns (record ready for the table, error message or None)
+    if not isinstance(item, dict):
+        return item, "Item must be a JSON object"
+    missing = [name for name in required if name not in item]
+    if missing:
+        return item, "Missing fields: " + ", ".join(missing)
+    # models whose API fields are not their columns (Favorite.item_id) translate them
+    to_columns = getattr(model, "to_columns", None)
+    if to_columns is not None:
+        try:
+            item = to_columns(item)
+        except ValueError as error:
+            return item, str(error)
+    columns = model.__table__.columns
+    unknown = [name for name in item if name not in columns]
+    if unknown:
+        return item, "Unknown fields: " + ", ".join(unknown)
+    for name, value in item.items():
+        if value is None and not columns[name].nullable:
+            return item, "'" + name + "' can not be null"
+        if value is not None:
+            error = validate_value(columns[name], value)
+            if error:
+                return item, error
+    return item, None
+
+def unique_column_sets(model):
+    # ("name",) for unique columns, ("user_id", "planet_id") for composite unique constraints
+    table = model.__table__
+    sets = [(column.name,) for column in table.columns if column.unique]
+    for constraint in table.constraints:
+        if isinstance(constraint, db.UniqueConstraint) and len(constraint.columns) > 1:
+            sets.append(tuple(column.name for column in constraint.columns))
+    return sets
+
+def find_unique_conflicts(model, candidates, exclude_ids=()):
+    # unique columns (like Character.name) are checked up front, so one duplicate
+    # does not abort the whole transaction: {index: message}
+    conflicts = {}
+    for names in unique_column_sets(model):
+        label = ", ".join(names)
+        seen = {}
+        for index, item in candidates:
+            value = tuple(item.get(name) for name in names)
+            if None in value:
+                continue
+            value = value[0] if len(names) == 1 else value
+            if value in seen:
+                conflicts[index] = "Duplicate '" + label + "' in request: " + str(value)
+            else:
+                seen[value] = index
+        if not seen:
+            continue
+        columns = [getattr(model, name) for name in names]
+        key = columns[0] if len(columns) == 1 else db.tuple_(*columns)
+        taken = set()
+        for chunk in chunks(list(seen)):
+            rows = db.session.query(model.id, *columns).filter(key.in_(chunk)).all()
+            taken.update((row[1] if len(names) == 1 else tuple(row[1:])) for row in rows if row[0] not in exclude_ids)
+        for value, index in seen.items():
+            if value in taken:
+                conflicts.setdefault(index, "'" + label + "' already exists: " + str(value))
+    return conflicts
+
+def reference_key(column, value):
+    # "3" and 3 are the same id (numbers may come as strings)
+    try:
+        return column.type.python_type(value)
+    except (TypeError, ValueError):
+        return value
+
+def find_missing_references(model, candidates):
+    # foreign keys (Favorite.character_id/planet_id/user_id) are checked up front too,
+    # a dangling id would make the database abort the whole transaction: {index: message}
+    missing = {}
+    for column in model.__table__.columns:
+        for foreign_key in column.foreign_keys:
+            target = foreign_key.column
+            values = {reference_key(column, item[column.name]) for index, item in candidates
+                      if item.get(column.name) is not None}
+            if not values:
+                continue
+            found = set()
+            for chunk in chunks(list(values)):
+                found.update(row[0] for row in db.session.query(target).filter(target.in_(chunk)).all())
+            for index, item in candidates:
+                value = item.get(column.name)
+                if value is not None and reference_key(column, value) not in found:
+                    missing.setdefault(index, "'" + column.name + "' not found: " + str(value))
+    return missing
+
+def existing_ids(model, ids):
+    found = set()
+    for chunk in chunks(list(set(ids))):
+        found.update(row[0] for row in db.session.query(model.id).filter(model.id.in_(chunk)).all())
+    return found
+
+
+def bulk_create(model, items, required):
+    results = [None] * len(items)
+    candidates = []
+    for index, item in enumerate(items):
+        item, error = validate_item(model, item, required)
+        if error:
+            results[index] = error_result(index, error)
+        else:
+            candidates.append((index, item))
+
+    conflicts = find_unique_conflicts(model, candidates)
+    missing = find_missing_references(model, candidates)
+    valid = []
+    for index, item in candidates:
+        if index in missing:
+            results[index] = error_result(index, missing[index], "not_found")
+        elif index in conflicts:
+            results[index] = error_result(index, conflicts[index])
+        else:
+            valid.append(item)
+            results[index] = {"index": index, "status": "created"}
+
+    for chunk in chunks(valid):
+        db.session.bulk_insert_mappings(model, chunk)
+    return results
+
+def bulk_update(model, items):
+    # every item needs its "id", the other keys are the fields to update
+    results = [None] * len(items)
+    candidates = []
+    for index, item in enumerate(items):
+        item, error = validate_item(model, item, ["id"])
+        if error:
+            results[index] = error_result(index, error)
+        else:
+            candidates.append((index, item))
+
+    found = existing_ids(model, [item["id"] for _, item in candidates])
+    updated_ids = set(item["id"] for _, item in candidates if item["id"] in found)
+    conflicts = find_unique_conflicts(model, candidates, exclude_ids=updated_ids)
+    missing = find_missing_references(model, candidates)
+    valid = []
+    for index, item in candidates:
+        if item["id"] not in found:
+            results[index] = {"index": index, "id": item["id"], "status": "not_found"}
+        elif index in missing:
+            results[index] = error_result(index, missing[index], "not_found")
+        elif index in conflicts:
+            results[index] = error_result(index, conflicts[index])
+        else:
+            valid.append(item)
+            results[index] = {"index": index, "id": item["id"], "status": "updated"}
+
+    for chunk in chunks(valid):
+        db.session.bulk_update_mappings(model, chunk)
+    return results
+
+def bulk_delete(model, items):
+    # items are ids or objects with an "id"
+    results = [None] * len(items)
+    ids = []
+    for index, item in enumerate(items):
+        id = item.get("id") if isinstance(item, dict) else item
+        if isinstance(id, bool) or not isinstance(id, int):
+            results[index] = error_result(index, "'id' must be an integer")
+        else:
+            ids.append((index, id))
+
+    found = existing_ids(model, [id for _, id in ids])
+    for index, id in ids:
+        results[index] = {"index": index, "id": id, "status": "deleted" if id in found else "not_found"}
+
+    for chunk in chunks(list(found)):
+        model.query.filter(model.id.in_(chunk)).delete(synchronize_session=False)
+    return results
+
+def changed_ids(results):
+    return [result["id"] for result in results if result["status"] in ("updated", "deleted")]
+
+def created_ids(model, items, results):
+    # bulk_insert_mappings does not return the new ids: they are looked up by name (unique)
+    names = [items[result["index"]]["name"] for result in results if result["status"] == "created"]
+    ids = []
+    for names_chunk in chunks(names):
+        ids.extend(row.id for row in db.session.query(model.id).filter(model.name.in_(names_chunk)))
+    return ids
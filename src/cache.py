@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from versions import table_versions
+
+# Read-through cache for serialized Character and Planet objects.
+# The catalog is almost read-only, so detail reads and the favorites resolver
+# go to the cache first and only hit the database on a miss.
+# The write endpoints in main.py call invalidate() for the id they touched, and every
+# entry is stamped with the table version: a write made by another worker makes the
+# entries of this worker stale as soon as it sees the new version (the ETags change then too).
+
+class CacheBackend:
+    # Interface every backend implements, so a shared store (redis, memcached...)
+    # can replace the per-process dict without touching the endpoints.
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def set(self, key, value):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+    def stats(self):
+        return {}
+
+
+class LocalCache(CacheBackend):
+    # Per-process LRU with a TTL. Each gunicorn worker has its own copy,
+    # the TTL bounds how stale another worker can be after a write.
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()  # key -> (expires_at, value), oldest first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                del self.items[key]
+                self.misses += 1
+                self.evictions += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.items),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class RedisCache(CacheBackend):
+    # Shared by every worker (and server): a write seen by one worker is seen by all.
+    # Values are stored as JSON. Needs the "redis" package (optional dependency).
+
+    def __init__(self, url, ttl=300, prefix="api:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RedisCache needs the redis package: $ pipenv install redis")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(self.ttl))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def cache_backend(url, max_size, ttl, prefix):
+    # url: "" -> LocalCache (per process), redis://host:6379/0 -> RedisCache
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url, ttl=ttl, prefix=prefix)
+    return LocalCache(max_size=max_size, ttl=ttl)
+
+
+class ModelCache:
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def key(self, model, id):
+        return model.__tablename__ + ":" + str(id)
+
+    def get(self, model, id):
+        # serialized object or None if it does not exist.
+        # Entries are [table version, object]: the version is read before the row, so an
+        # entry is never older than its stamp
+        key = self.key(model, id)
+        stamp = table_versions.get(model)
+        entry = self.backend.get(key)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        item = model.query.get(id)
+        if item is None:
+            return None
+        value = item.serialize()
+        self.backend.set(key, [stamp, value])
+        return value
+
+    def invalidate(self, model, id):
+        self.backend.delete(self.key(model, id))
+
+    def stats(self):
+        return self.backend.stats()
+
+
+model_cache = ModelCache(LocalCache(
+    max_size=int(os.environ.get('CACHE_MAX_SIZE', 10000)),
+    ttl=float(os.environ.get('CACHE_TTL', 300)),
+))
+
+
+class FavoritesCache:
+    # GET /favorite materialized per user: the resolved list, ready to jsonify, stored as
+    #   {"stamp": [character version, planet version, favorite version], "items": [[favorite id, item or None], ...]}
+    # - a stamp that is not the current table versions means a character, a planet or a
+    #   favorite changed, in this worker or another one: the entry is rebuilt from the
+    #   database (one query) on the next read
+    # - add_favorite/delete_favorite update the entry in place instead of dropping it, and
+    #   stamp it with the new versions when their write is the only change since the entry
+    #   was built (Service.only_own_write)
+    # Another worker's favorite write is seen within VERSION_CHECK_INTERVAL, like the ETags.
+    # With the LocalCache backend each worker has its own entries, set
+    # FAVORITES_CACHE_URL=redis://... to share them.
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+
+    def key(self, user_id):
+        return "favorites:" + str(user_id)
+
+    def get(self, user_id, stamp):
+        entry = self.backend.get(self.key(user_id))
+        if entry is None or entry["stamp"] != stamp:
+            return None
+        return entry["items"]
+
+    def set(self, user_id, stamp, items):
+        self.backend.set(self.key(user_id), {"stamp": stamp, "items": items})
+
+    def add(self, user_id, stamp, new_stamp, favorite_id, item):
+        with self.lock:
+            items = self.get(user_id, stamp)
+            if items is None:
+                return  # not cached (or stale): the next read builds it with this favorite
+            items = [entry for entry in items if entry[0] != favorite_id] + [[favorite_id, item]]
+            items.sort(key=lambda entry: entry[0])
+            self.set(user_id, new_stamp, items)
+
+    def remove(self, user_id, stamp, new_stamp, favorite_id):
+        with self.lock:
+            items = self.get(user_id, stamp)
+            if items is None:
+                return
+            self.set(user_id, new_stamp, [entry for entry in items if entry[0] != favorite_id])
+
+    def invalidate(self, user_id):
+        self.backend.delete(self.key(user_id))
+
+    def stats(self):
+        return self.backend.stats()
+
+
+favorites_cache = FavoritesCache(cache_backend(
+    os.environ.get('FAVORITES_CACHE_URL', ''),
+    max_size=int(os.environ.get('FAVORITES_CACHE_MAX_SIZE', 10000)),
+    ttl=float(os.environ.get('FAVORITES_CACHE_TTL', 60)),
+    prefix="api:",
+))
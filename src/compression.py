@@ -0,0 +1,166 @@
+import os
+import zlib
+import threading
+from flask import request
+from cache import LocalCache
+
+# Response compression negotiated with Accept-Encoding: zstd, br or gzip (the client's
+# preference, then this order). gzip is always there (zlib), brotli and zstd only when
+# their packages are installed (in the Pipfile, the code still works without them).
+# - bodies smaller than COMPRESS_MIN_SIZE bytes are sent as they are
+# - streamed responses (?stream=1) are compressed chunk by chunk while they are sent,
+#   their ETag becomes weak too (see below)
+# - a response with an ETag (the versioned GET endpoints, built from the table version,
+#   and the sitemap documents) always has the same body for the same ETag: its compressed
+#   bytes are kept in a cache and reused until the table changes, compressed once at a
+#   higher level. The ETag becomes weak (W/"..."), like nginx does, since the bytes on
+#   the wire are not the ones it was made for; If-None-Match still matches it.
+# COMPRESS_ENABLED=0 turns it off (a proxy in front already compresses, for example).
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') not in ('0', 'false')
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_CACHE_SIZE = int(os.environ.get('COMPRESS_CACHE_SIZE', 128))
+COMPRESS_CACHE_MAX_BYTES = int(os.environ.get('COMPRESS_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/html", "text/plain",
+                          "text/css", "application/javascript", "text/javascript", "image/svg+xml")
+
+# levels: (every request, once per cached body)
+GZIP_LEVELS = (6, 9)
+BROTLI_LEVELS = (5, 9)
+ZSTD_LEVELS = (3, 12)
+
+
+def gzip_compress(data, cached):
+    compressor = zlib.compressobj(GZIP_LEVELS[cached], zlib.DEFLATED, 31)   # wbits 31: gzip header
+    return compressor.compress(data) + compressor.flush()
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(GZIP_LEVELS[0], zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def brotli_compress(data, cached):
+    return brotli.compress(data, quality=BROTLI_LEVELS[cached])
+
+def brotli_stream(chunks):
+    compressor = brotli.Compressor(quality=BROTLI_LEVELS[0])
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+def zstd_compress(data, cached):
+    return zstandard.ZstdCompressor(level=ZSTD_LEVELS[cached]).compress(data)
+
+def zstd_stream(chunks):
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVELS[0]).compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+# Content-Encoding -> (compress whole body, compress a stream of chunks), in preference order
+CODECS = {}
+if zstandard is not None:
+    CODECS["zstd"] = (zstd_compress, zstd_stream)
+if brotli is not None:
+    CODECS["br"] = (brotli_compress, brotli_stream)
+CODECS["gzip"] = (gzip_compress, gzip_stream)
+
+
+def encode_chunks(chunks):
+    # bytes for the compressors; closing it closes the endpoint's generator too
+    # (stream_with_context releases the request context and the db session then)
+    try:
+        for chunk in chunks:
+            yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+class Compressor:
+
+    def __init__(self, cache):
+        self.cache = cache    # (strong ETag, encoding) -> compressed body
+        self.lock = threading.Lock()
+        self.counts = {"responses": 0, "streams": 0, "cache_hits": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def count(self, **values):
+        with self.lock:
+            for name, value in values.items():
+                self.counts[name] += value
+
+    def negotiate(self):
+        return request.accept_encodings.best_match(list(CODECS))
+
+    def after_request(self, response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        # the body depends on Accept-Encoding from now on, caches must know it
+        response.vary.add("Accept-Encoding")
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or "Content-Encoding" in response.headers or response.direct_passthrough
+                or request.method == "HEAD"):
+            return response
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+        compress, compress_stream = CODECS[encoding]
+
+        etag, weak = response.get_etag()
+        if response.is_streamed:
+            # size unknown: always compressed, chunk by chunk as the generator yields
+            response.response = compress_stream(encode_chunks(response.response))
+            response.headers.pop("Content-Length", None)
+            response.headers["Content-Encoding"] = encoding
+            if etag and not weak:
+                response.set_etag(etag, weak=True)
+            self.count(streams=1)
+            return response
+
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        if etag and not weak and len(data) <= COMPRESS_CACHE_MAX_BYTES:
+            key = etag + ":" + encoding
+            body = self.cache.get(key)
+            if body is None:
+                body = compress(data, True)
+                self.cache.set(key, body)
+            else:
+                self.count(cache_hits=1)
+            response.set_etag(etag, weak=True)
+        else:
+            body = compress(data, False)
+        response.set_data(body)
+        response.headers["Content-Encoding"] = encoding
+        self.count(responses=1, bytes_in=len(data), bytes_out=len(body))
+        return response
+
+    def stats(self):
+        values = {"compression_" + name: value for name, value in self.counts.items()}
+        values["compression_cache_size"] = self.cache.stats().get("size", 0)
+        return values
+
+
+# TTL: a table that changed makes new ETags, the old entries are never asked again
+compressor = Compressor(LocalCache(max_size=COMPRESS_CACHE_SIZE, ttl=3600))
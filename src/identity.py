@@ -0,0 +1,130 @@
+import os
+import threading
+from datetime import datetime, timezone
+from functools import wraps
+from flask import g
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from models import db, User, RevokedToken
+from cache import cache_backend
+from versions import table_versions
+
+# Who is calling, resolved once per request and without queries most of the time.
+#
+# - jwt_required() replaces flask_jwt_extended's decorator: the token is verified at most
+#   once per request (the rate limiter already did it for most requests) and
+#   get_jwt_identity(), get_jwt() and get_current_user() work as before.
+# - the user of the token is looked up in identity_cache: a deleted or inactive user gets
+#   a 401 even with a valid token. The entries are stamped with the version of the user
+#   table, so update_user/delete_user (and the admin, see admin.py) invalidate them in
+#   every worker within VERSION_CHECK_INTERVAL, and they expire after IDENTITY_CACHE_TTL.
+# - revoked tokens (DELETE /token) are kept in the revoked_token table and checked against
+#   an in-memory set of their ids, reloaded only when that table changes. Access tokens
+#   live 15 minutes (JWT_ACCESS_TOKEN_EXPIRES), the set only holds the unexpired ones.
+# An authenticated read costs no query for auth, besides the table_version read that the
+# ETags already make once per second per worker.
+
+
+def verify_identity(optional=False):
+    # verify_jwt_in_request() once per request; with optional=True a missing or invalid
+    # token is not an error (the caller gets None), the endpoints verify it again and answer 401
+    if g.get("identity_verified"):
+        return get_jwt_identity()
+    if optional:
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            return None
+    else:
+        verify_jwt_in_request()
+    identity = get_jwt_identity()
+    if identity is not None:
+        g.identity_verified = True
+    return identity
+
+def jwt_required():
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            verify_identity()
+            return fn(*args, **kwargs)
+        decorator.requires_token = True   # listed as such in /routes and /openapi.json
+        return decorator
+    return wrapper
+
+
+class IdentityCache:
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def key(self, user_id):
+        return "identity:" + str(user_id)
+
+    def get(self, user_id):
+        # {"id", "username", "email"} of an active user, None if it is gone or inactive
+        stamp = table_versions.get(User)
+        entry = self.backend.get(self.key(user_id))
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        row = db.session.query(User.id, User.username, User.email, User.is_active).filter(User.id == user_id).first()
+        user = {"id": row.id, "username": row.username, "email": row.email} if row is not None and row.is_active else None
+        self.backend.set(self.key(user_id), [stamp, user])
+        return user
+
+    def invalidate(self, user_id):
+        self.backend.delete(self.key(user_id))
+
+    def stats(self):
+        return self.backend.stats()
+
+
+class RevokedTokens:
+
+    def __init__(self):
+        self.jtis = frozenset()
+        self.stamp = None
+        self.lock = threading.Lock()
+
+    def is_revoked(self, jti):
+        stamp = table_versions.get(RevokedToken)
+        if stamp != self.stamp:
+            with self.lock:
+                if stamp != self.stamp:
+                    now = datetime.utcnow()
+                    rows = db.session.query(RevokedToken.jti).filter(RevokedToken.expires_at > now)
+                    self.jtis = frozenset(row.jti for row in rows)
+                    self.stamp = stamp
+        return jti in self.jtis
+
+    def revoke(self, jwt_data):
+        # the caller commits; the expired rows go away at the same time
+        expires_at = datetime.fromtimestamp(jwt_data["exp"], timezone.utc).replace(tzinfo=None) if "exp" in jwt_data else datetime.max
+        RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+        if RevokedToken.query.get(jwt_data["jti"]) is None:
+            db.session.add(RevokedToken(jti=jwt_data["jti"], user_id=jwt_data.get("sub"), expires_at=expires_at))
+        table_versions.bump(RevokedToken)
+
+    def stats(self):
+        return {"revoked_tokens": len(self.jtis)}
+
+
+identity_cache = IdentityCache(cache_backend(
+    os.environ.get('IDENTITY_CACHE_URL', ''),
+    max_size=int(os.environ.get('IDENTITY_CACHE_MAX_SIZE', 10000)),
+    ttl=float(os.environ.get('IDENTITY_CACHE_TTL', 30)),
+    prefix="api:",
+))
+revoked_tokens = RevokedTokens()
+
+
+def init_identity(jwt):
+    # the callbacks flask_jwt_extended calls while it verifies a token
+
+    @jwt.token_in_blocklist_loader
+    def token_revoked(jwt_header, jwt_data):
+        return revoked_tokens.is_revoked(jwt_data["jti"])
+
+    @jwt.user_lookup_loader
+    def load_user(jwt_header, jwt_data):
+        # None -> 401 "Error loading the user"
+        return identity_cache.get(jwt_data["sub"])
@@ -0,0 +1,302 @@
+import os
+import io
+import csv
+import json
+import time
+import random
+import click
+from flask.cli import with_appcontext
+from models import db, User, Character, Planet, Favorite
+from bulk import validate_item, find_unique_conflicts, find_missing_references
+from attributes import sync_names
+from versions import table_versions
+
+# Streaming data loader, run it with:
+#   $ flask load-data character characters.ndjson
+#   $ flask load-data planet planets.csv --checkpoint planets.ckpt
+#   $ flask load-data character --synthetic 2000000
+#   $ flask load-data --seed                 (the sample data that /populate also loads)
+# Records are read one by one (JSON array, NDJSON or CSV), validated like the
+# /<model>/bulk endpoints and inserted in chunks with Core executemany INSERTs,
+# or with COPY when the database is PostgreSQL. Every chunk is its own commit,
+# and the checkpoint file remembers how many records are done, so an interrupted
+# load can be run again with the same arguments and continues where it stopped.
+
+LOAD_CHUNK_SIZE = int(os.environ.get('LOAD_CHUNK_SIZE', 5000))
+
+MODELS = {
+    "user": User,
+    "character": Character,
+    "planet": Planet,
+    "favorite": Favorite,
+}
+
+SEED_DATA = [
+    (User, [
+        {"username": "user01", "email": "user01@example.com", "password": "01"},
+        {"username": "user02", "email": "user02@example.com", "password": "02"},
+        {"username": "user03", "email": "user03@example.com", "password": "03"},
+    ]),
+    (Character, [
+        {"name": "Luke Skywalker", "birth_year": "19BBY", "gender": "male", "height": "172.0", "eye_color": "blue", "hair_color": "blond", "skin_color": "fair", "item_type": "character"},
+        {"name": "C-3PO", "birth_year": "112BBY", "gender": "", "height": "167.0", "eye_color": "yellow", "hair_color": "n/a", "skin_color": "gold", "item_type": "character"},
+        {"name": "R2-D2", "birth_year": "33BBY", "gender": "n/a", "height": "96.0", "eye_color": "red", "hair_color": "n/a", "skin_color": "white, blue", "item_type": "character"},
+        {"name": "Darth Vader", "birth_year": "41.9BBY", "gender": "male", "height": "202.0", "eye_color": "yellow", "hair_color": "none", "skin_color": "white", "item_type": "character"},
+        {"name": "Leia Organa", "birth_year": "19BBY", "gender": "female", "height": "150.0", "eye_color": "brown", "hair_color": "brown", "skin_color": "light", "item_type": "character"},
+        {"name": "Owen Lars", "birth_year": "52BBY", "gender": "male", "height": "178.0", "eye_color": "blue", "hair_color": "brown, grey", "skin_color": "light", "item_type": "character"},
+    ]),
+    (Planet, [
+        {"name": "Tatooine", "population": "200000", "terrain": "desert", "diameter": "10465.0", "climate": "arid", "rotation_period": "23.0", "item_type": "planet"},
+        {"name": "Alderaan", "population": "2000000000", "terrain": "grasslands, mountains", "diameter": "12500.0", "climate": "temperate", "rotation_period": "24.0", "item_type": "planet"},
+        {"name": "Yavin IV", "population": "1000", "terrain": "jungle, rainforests", "diameter": "10200.0", "climate": "temperate, tropical", "rotation_period": "24.0", "item_type": "planet"},
+        {"name": "Hoth", "population": "5000", "terrain": "tundra, ice caves, mountain ranges", "diameter": "7200.0", "climate": "frozen", "rotation_period": "23.0", "item_type": "planet"},
+        {"name": "Dagobah", "population": "6500", "terrain": "swamp, jungles", "diameter": "8900.0", "climate": "murky", "rotation_period": "23.0", "item_type": "planet"},
+        {"name": "Bespin", "population": "6000000", "terrain": "gas giant", "diameter": "118000.0", "climate": "temperate", "rotation_period": "12.0", "item_type": "planet"},
+    ]),
+]
+
+
+### Readers: each one yields dicts without loading the whole file
+
+def iter_json_array(fp, read_size=65536):
+    decoder = json.JSONDecoder()
+    buffer = fp.read(read_size).lstrip()
+    if not buffer.startswith("["):
+        raise click.ClickException("JSON input must be an array of objects")
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(","):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith("]"):
+            return
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except ValueError:
+            more = fp.read(read_size)
+            if not more:
+                raise click.ClickException("Invalid or truncated JSON input")
+            buffer += more
+            continue
+        yield record
+        buffer = buffer[end:]
+
+def iter_ndjson(fp):
+    for line in fp:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def iter_csv(fp):
+    for row in csv.DictReader(fp):
+        # empty cells are NULL
+        yield {key: (value if value != "" else None) for key, value in row.items()}
+
+READERS = {
+    "json": iter_json_array,
+    "ndjson": iter_ndjson,
+    "csv": iter_csv,
+}
+
+def guess_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension in ("jsonl", "ndjson"):
+        return "ndjson"
+    if extension in READERS:
+        return extension
+    raise click.ClickException("Can not guess the format of " + path + ", use --format")
+
+
+### Synthetic data, deterministic so a resumed load produces the same records
+
+def synthetic_records(model, count):
+    max_user = db.session.query(db.func.max(User.id)).scalar() or 1
+    max_character = db.session.query(db.func.max(Character.id)).scalar() or 1
+    max_planet = db.session.query(db.func.max(Planet.id)).scalar() or 1
+    colors = ["blue", "brown", "yellow", "red", "green", "black", "white", "n/a"]
+    climates = ["arid", "temperate", "tropical", "frozen", "murky"]
+    terrains = ["desert", "grasslands", "mountains", "jungle", "tundra", "swamp", "ocean"]
+    for i in range(count):
+        rnd = random.Random(i)
+        if model is User:
+            yield {"username": "synthetic%d" % i, "email": "synthetic%d@example.com" % i, "password": "%06d" % i}
+        elif model is Character:
+            yield {"name": "Synthetic Character %d" % i, "birth_year": "%dBBY" % rnd.randint(1, 900),
+                   "gender": rnd.choice(["male", "female", "n/a"]), "height": rnd.randint(50, 250),
+                   "eye_color": rnd.choice(colors), "hair_color": rnd.choice(colors),
+                   "skin_color": rnd.choice(colors), "item_type": "character"}
+        elif model is Planet:
+            yield {"name": "Synthetic Planet %d" % i, "population": rnd.randint(0, 10 ** 9),
+                   "terrain": rnd.choice(terrains), "diameter": rnd.randint(1000, 200000),
+                   "climate": rnd.choice(climates), "rotation_period": rnd.randint(5, 50), "item_type": "planet"}
+        elif model is Favorite:
+            item_type = rnd.choice(["character", "planet"])
+            max_item = max_character if item_type == "character" else max_planet
+            yield {"user_id": rnd.randint(1, max_user), "item_type": item_type, "item_id": rnd.randint(1, max_item)}
+
+
+### Writers
+
+def complete_rows(model, chunk):
+    # executemany and COPY need the same columns in every row, so missing
+    # columns get their python default (User.is_active) or NULL
+    defaults = {}
+    for column in model.__table__.columns:
+        if column.name == "id":
+            continue
+        default = column.default
+        defaults[column.name] = default.arg if default is not None and default.is_scalar else None
+    return [dict(defaults, **record) for record in chunk]
+
+def insert_chunk(model, chunk, use_copy):
+    chunk = complete_rows(model, chunk)
+    if use_copy:
+        copy_chunk(model, chunk)
+    else:
+        db.session.execute(model.__table__.insert(), chunk)
+
+def copy_chunk(model, chunk):
+    # PostgreSQL COPY through the same connection (and transaction) as the session.
+    # QUOTE_NONNUMERIC quotes every string, so "" stays an empty string and None becomes NULL
+    columns = [column.name for column in model.__table__.columns if column.name != "id"]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+    for record in chunk:
+        writer.writerow([record.get(name) for name in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    quoted = ", ".join('"' + name + '"' for name in columns)
+    cursor.copy_expert('COPY "' + model.__tablename__ + '" (' + quoted + ") FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+### Checkpoints
+
+def read_checkpoint(path, source):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as fp:
+        checkpoint = json.load(fp)
+    if checkpoint.get("source") != source:
+        raise click.ClickException("Checkpoint " + path + " belongs to another load: " + str(checkpoint.get("source")))
+    return checkpoint["done"]
+
+def write_checkpoint(path, source, done):
+    if not path:
+        return
+    with open(path + ".tmp", "w") as fp:
+        json.dump({"source": source, "done": done}, fp)
+    os.replace(path + ".tmp", path)
+
+
+def load_records(model, records, chunk_size=None, use_copy=False, skip=0, ignore_unknown=False,
+                 on_chunk=None, checkpoint=None, source=None):
+    # returns (loaded, invalid, errors) where errors are the first invalid records with their message
+    chunk_size = chunk_size or LOAD_CHUNK_SIZE
+    columns = model.__table__.columns
+    loaded = invalid = 0
+    done = skip
+    errors = []
+
+    def flush(chunk):
+        # chunk is a list of (position in the input, record)
+        nonlocal loaded, invalid
+        # duplicates and dangling foreign keys (favorites of deleted items) are skipped
+        conflicts = find_unique_conflicts(model, chunk)
+        conflicts.update(find_missing_references(model, chunk))
+        rows = [record for position, record in chunk if position not in conflicts]
+        for position in sorted(conflicts):
+            if len(errors) < 20:
+                errors.append((position, conflicts[position]))
+        invalid += len(conflicts)
+        if rows:
+            insert_chunk(model, rows, use_copy)
+            if hasattr(model, "multi_value_fields"):
+                sync_names(model, [record["name"] for record in rows])
+        table_versions.bump(model)
+        db.session.commit()
+        loaded += len(rows)
+        write_checkpoint(checkpoint, source, done)
+        if on_chunk:
+            on_chunk(done, loaded, invalid)
+
+    chunk = []
+    for position, record in enumerate(records):
+        if position < skip:
+            continue
+        done = position + 1
+        if isinstance(record, dict):
+            if ignore_unknown:
+                record = {key: value for key, value in record.items() if key in columns or key in model.required_fields}
+            if "item_type" in columns and "item_type" not in record and model is not Favorite:
+                record["item_type"] = model.__tablename__
+            record.pop("id", None)
+        record, error = validate_item(model, record, model.required_fields)
+        if error:
+            invalid += 1
+            if len(errors) < 20:
+                errors.append((position, error))
+            continue
+        chunk.append((position, record))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk or done > skip:
+        flush(chunk)
+    return loaded, invalid, errors
+
+
+def load_seed_data():
+    for model, records in SEED_DATA:
+        load_records(model, [dict(record) for record in records])
+
+
+@click.command("load-data")
+@click.argument("model_name", required=False, type=click.Choice(list(MODELS)))
+@click.argument("path", required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "input_format", type=click.Choice(list(READERS)), help="Input format, guessed from the extension by default.")
+@click.option("--chunk-size", type=int, default=None, help="Records per INSERT/COPY and commit (LOAD_CHUNK_SIZE).")
+@click.option("--checkpoint", type=click.Path(dir_okay=False), help="File that stores the progress, to resume an interrupted load.")
+@click.option("--synthetic", type=int, default=None, help="Generate this many synthetic records instead of reading a file.")
+@click.option("--copy/--no-copy", "use_copy", default=None, help="Use PostgreSQL COPY (default: when the database is PostgreSQL).")
+@click.option("--ignore-unknown", is_flag=True, help="Drop fields that are not model columns (SWAPI dumps).")
+@click.option("--seed", is_flag=True, help="Load the sample users, characters and planets.")
+@with_appcontext
+def load_data_command(model_name, path, input_format, chunk_size, checkpoint, synthetic, use_copy, ignore_unknown, seed):
+    """Stream a JSON/NDJSON/CSV file (or synthetic data) into a table."""
+    if seed:
+        load_seed_data()
+        click.echo("Seed data loaded")
+        return
+    if model_name is None or (path is None) == (synthetic is None):
+        raise click.UsageError("Give a model and either a PATH or --synthetic N")
+
+    model = MODELS[model_name]
+    is_postgres = db.engine.dialect.name == "postgresql"
+    if use_copy is None:
+        use_copy = is_postgres
+    elif use_copy and not is_postgres:
+        raise click.ClickException("--copy needs a PostgreSQL database")
+
+    source = model_name + ":" + (os.path.abspath(path) if path else "synthetic:" + str(synthetic))
+    skip = read_checkpoint(checkpoint, source)
+    if skip:
+        click.echo("Resuming after " + str(skip) + " records")
+
+    started = time.monotonic()
+
+    def on_chunk(done, loaded, invalid):
+        elapsed = max(time.monotonic() - started, 0.001)
+        click.echo("%s: %d read, %d loaded, %d invalid (%.0f records/s)" % (model_name, done, loaded, invalid, (done - skip) / elapsed))
+
+    if path:
+        input_format = input_format or guess_format(path)
+        with open(path, newline="" if input_format == "csv" else None, encoding="utf-8") as fp:
+            loaded, invalid, errors = load_records(model, READERS[input_format](fp), chunk_size, use_copy, skip,
+                                                   ignore_unknown, on_chunk, checkpoint, source)
+    else:
+        loaded, invalid, errors = load_records(model, synthetic_records(model, synthetic), chunk_size, use_copy, skip,
+                                               ignore_unknown, on_chunk, checkpoint, source)
+
+    for position, error in errors:
+        click.echo("record " + str(position) + ": " + error, err=True)
+    click.echo("Done: %d loaded, %d invalid in %.1fs" % (loaded, invalid, time.monotonic() - started))
@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+# Logging for the endpoints, instead of print():
+#   logs.info("Character created", character=request_body)
+# - records are JSON lines (one object per line) with level, time, message and the fields,
+#   in development (FLASK_ENV=development) they are colored text instead
+# - payloads are shrunk before they are formatted (LOG_MAX_ITEMS, LOG_MAX_STRING)
+# - DEBUG/INFO records are sampled with LOG_SAMPLE_RATE (1.0 keeps all), warnings and errors are always kept
+# - the request thread only puts the formatted record in a bounded queue, a background
+#   thread writes it to stdout. If the queue is full the record is dropped (and counted)
+#   instead of blocking the request
+
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+LOG_MAX_ITEMS = int(os.environ.get('LOG_MAX_ITEMS', 10))
+LOG_MAX_STRING = int(os.environ.get('LOG_MAX_STRING', 200))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+DEV_MODE = os.environ.get('FLASK_ENV') == 'development' or os.environ.get('LOG_FORMAT') == 'color'
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG' if DEV_MODE else 'INFO').upper()
+
+logger = logging.getLogger("api")
+
+
+# to print with colors in the console (development only)
+class bcolors:
+    HEADER = '\033[95m'
+    OKBLUE = '\033[94m'
+    OKCYAN = '\033[96m'
+    OKGREEN = '\033[92m'
+    WARNING = '\033[93m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+    UNDERLINE = '\033[4m'
+
+
+def shrink(value, depth=0):
+    # cut long lists and strings, so logging a whole table costs as much as logging a few rows
+    if isinstance(value, str):
+        return value if len(value) <= LOG_MAX_STRING else value[:LOG_MAX_STRING] + "...(%d chars)" % len(value)
+    if isinstance(value, (list, tuple, set)):
+        if depth >= 3:
+            return "<%d items>" % len(value)
+        items = [shrink(item, depth + 1) for item in list(value)[:LOG_MAX_ITEMS]]
+        if len(value) > LOG_MAX_ITEMS:
+            items.append("...(+%d more)" % (len(value) - LOG_MAX_ITEMS))
+        return items
+    if isinstance(value, dict):
+        if depth >= 3:
+            return "<%d keys>" % len(value)
+        return {str(key): shrink(item, depth + 1) for key, item in list(value.items())[:LOG_MAX_ITEMS * 5]}
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return shrink(str(value), depth)
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + ".%03dZ" % record.msecs,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(shrink(getattr(record, "data", None) or {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ColorFormatter(logging.Formatter):
+
+    COLORS = {
+        "DEBUG": bcolors.OKCYAN,
+        "INFO": bcolors.OKGREEN,
+        "WARNING": bcolors.WARNING,
+        "ERROR": bcolors.FAIL,
+        "CRITICAL": bcolors.FAIL + bcolors.BOLD,
+    }
+
+    def format(self, record):
+        data = shrink(getattr(record, "data", None) or {})
+        text = record.getMessage()
+        if data:
+            text += " " + json.dumps(data, default=str)
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return self.COLORS.get(record.levelname, "") + record.levelname + bcolors.ENDC + " " + text
+
+
+class SamplingFilter(logging.Filter):
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or LOG_SAMPLE_RATE >= 1.0:
+            return True
+        return random.random() < LOG_SAMPLE_RATE
+
+
+class DroppingQueueHandler(QueueHandler):
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def init_logging():
+    if logger.handlers:
+        return logger
+    handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.setFormatter(ColorFormatter() if DEV_MODE else JSONFormatter())
+    handler.addFilter(SamplingFilter())
+    start_listener(handler)
+
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return logger
+
+listener = None
+
+def start_listener(handler):
+    global listener
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(handler.queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+
+def restart_after_fork():
+    # a forked worker (gunicorn --preload) gets a copy of the queue but not the thread that
+    # empties it: it starts its own, on a new queue (the copy's lock may be held by that thread)
+    if listener is not None:
+        atexit.unregister(listener.stop)    # its thread is not in this process
+    for handler in logger.handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            start_listener(handler)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=restart_after_fork)
+
+def stats():
+    return {"log_records_dropped_total": DroppingQueueHandler.dropped}
+
+
+def debug(message, **data):
+    logger.debug(message, extra={"data": data})
+
+def info(message, **data):
+    logger.info(message, extra={"data": data})
+
+def warning(message, **data):
+    logger.warning(message, extra={"data": data})
+
+def error(message, **data):
+    logger.error(message, extra={"data": data}, exc_info=True)
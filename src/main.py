@@ -5,48 +5,152 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os # library in phyton that allows me to interact with the operating system (os)
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger # not used in this exercise
+import weakref
+from flask import Flask, Blueprint, request, jsonify
+from sqlalchemy.exc import IntegrityError
 from flask_cors import CORS # to avoid CORS (Cross-Origin Resource Sharing) domain errors 
-from utils import APIException, generate_sitemap
-from admin import setup_admin
+from utils import APIException, paginate_list, list_response, wants_stream, stream_list, parse_int_arg, MAX_PAGE_SIZE
 from models import db, User, Character, Planet, Favorite
 from service import Service
+from cache import model_cache, favorites_cache
+from versions import table_versions, versioned
+from bulk import get_bulk_body, bulk_create, bulk_update, bulk_delete, changed_ids, created_ids
+from loader import load_data_command, load_seed_data
+from metrics import init_metrics, metrics
+from search import search
+from attributes import sync_ids, sync_names
+from stats import numeric_stats
+from serializers import init_json
+from sitemap import init_sitemap
+from ratelimit import rate_limiter, RATE_LIMIT_ENABLED
+from compression import compressor, COMPRESS_ENABLED
+import logs
+from routing import engine_options, replica_binds, router
+from passwords import hash_password_bounded, verify_password_bounded, needs_rehash, dummy_hash
 
 # import Flask-JWT-Extended extension library
 from flask_jwt_extended import create_access_token
 from flask_jwt_extended import get_jwt_identity
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import get_jwt
 from flask_jwt_extended import JWTManager
-
-
-app = Flask(__name__)    # create new Flask app
-app.url_map.strict_slashes = False    # to allow URL with or without final slash "/"
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')  # connect to database specified in file: .env
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False   # if "true", everytime I modify models.py it creates a migration
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
-
-# Setup the Flask-JWT-Extended extension
-app.config["JWT_SECRET_KEY"] = os.environ.get('TOKEN_KEY')  # for security purposes, located in .env file, which is also located in .gitignore
-jwt = JWTManager(app)
+# jwt_required verifies the token once per request and looks its user up in a cache (see identity.py)
+from identity import jwt_required, identity_cache, revoked_tokens, init_identity
+
+# The app is built by create_app(role), every worker picks what it loads with APP_ROLE:
+#   api     the endpoints only: no Flask-Admin and no Flask-Migrate (alembic) are imported,
+#           the workers start faster and use less memory
+#   admin   the admin UI (/admin/) and the "flask db" commands, no endpoints
+#   all     everything (default, for development, "flask db ..." and "flask load-data")
+# $ flask run finds create_app() by itself, gunicorn uses src/wsgi.py.
+# Measure the difference with: $ pipenv run bench-startup
+ROLES = {
+    "api": ("api",),
+    "admin": ("admin", "migrate"),
+    "all": ("api", "admin", "migrate"),
+}
+APP_ROLE = os.environ.get('APP_ROLE', 'all')
+
+# every endpoint below is registered on this blueprint, create_app() adds it to the app
+api = Blueprint('api', __name__)
+jwt = JWTManager()
+init_identity(jwt)   # revoked tokens and deleted/inactive users get a 401
+
+metrics.add_collector(lambda: {"model_cache_" + name: value for name, value in model_cache.stats().items()})
+metrics.add_collector(logs.stats)
+metrics.add_collector(router.stats)
+metrics.add_collector(search.stats)
+metrics.add_collector(lambda: {"favorites_cache_" + name: value for name, value in favorites_cache.stats().items()})
+metrics.add_collector(lambda: {"identity_cache_" + name: value for name, value in identity_cache.stats().items()})
+metrics.add_collector(revoked_tokens.stats)
+if RATE_LIMIT_ENABLED:
+    metrics.add_collector(rate_limiter.stats)
+if COMPRESS_ENABLED:
+    metrics.add_collector(compressor.stats)
+
+
+def create_app(role=None):
+    role = role or APP_ROLE
+    if role not in ROLES:
+        raise ValueError("APP_ROLE must be one of: " + ", ".join(ROLES))
+    parts = ROLES[role]
+
+    app = Flask(__name__)    # create new Flask app
+    app.url_map.strict_slashes = False    # to allow URL with or without final slash "/"
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')  # connect to database specified in file: .env
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False   # if "true", everytime I modify models.py it creates a migration
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()   # pool size, recycle, pre-ping... from the DB_POOL_* env variables
+    app.config['SQLALCHEMY_BINDS'] = replica_binds()    # read replicas from DB_REPLICA_CONNECTION_STRINGS
+    db.init_app(app)
+    router.init_app(app, db)    # GET requests read from the replicas (see routing.py)
+
+    # the optional subsystems are imported only by the roles that use them
+    if "migrate" in parts:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    if "admin" in parts:
+        from admin import setup_admin
+        setup_admin(app)
+
+    # Setup the Flask-JWT-Extended extension
+    app.config["JWT_SECRET_KEY"] = os.environ.get('TOKEN_KEY')  # for security purposes, located in .env file, which is also located in .gitignore
+    jwt.init_app(app)
+
+    app.cli.add_command(load_data_command)   # $ flask load-data
+
+    # structured logging through a background thread (see logs.py)
+    logs.init_logging()
+
+    # orjson for jsonify() (see serializers.py), before init_metrics so the encoding is still timed
+    init_json(app)
+
+    # request timing, SQL query counting, Server-Timing headers and GET /metrics (see metrics.py)
+    init_metrics(app)
+
+    if "api" in parts:
+        CORS(app)
+        # token buckets per client and a cap on the requests in flight (see ratelimit.py),
+        # after init_metrics so the 429/503 answers are counted too
+        if RATE_LIMIT_ENABLED:
+            rate_limiter.init_app(app)
+        # gzip/br/zstd for the bodies over COMPRESS_MIN_SIZE (see compression.py),
+        # registered after init_metrics so the compression time is in the request time
+        if COMPRESS_ENABLED:
+            compressor.init_app(app)
+        app.register_blueprint(api)
+
+    # GET /, /routes, /openapi.json and /healthz from route metadata read once (see sitemap.py),
+    # after everything else so every route is listed
+    init_sitemap(app)
+
+    apps.add(app)
+    return app
+
+# gunicorn --preload: the app is loaded once in the master and the workers are forked
+# from it (they share its memory). Pooled connections must not be shared by processes,
+# so the master closes them right before each fork. One hook for every app built here,
+# the set does not keep them alive (tests and benchmarks build many)
+apps = weakref.WeakSet()
+
+def dispose_engines(app):
+    with app.app_context():
+        for bind in [None] + list(app.config['SQLALCHEMY_BINDS']):
+            db.get_engine(app, bind=bind).dispose()
+
+def dispose_all_engines():
+    for app in list(apps):
+        dispose_engines(app)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=dispose_all_engines)
 
 # Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
-# Generate sitemap with all your endpoints
-@app.route('/')
-def sitemap():
-    return generate_sitemap(app)
-
 # Create a route to authenticate your users and return JWTs. The
 # create_access_token() function is used to actually generate the JWT.
-@app.route("/token", methods=["POST"])
+@api.route("/token", methods=["POST"])
 def create_token():
     email = request.json.get("email", None) # "None" parameter, see below
     password = request.json.get("password", None)
@@ -56,45 +160,85 @@ def create_token():
     # if username is None:
     #     return jsonify({msg: "value not found"})  
 
-    user = User.query.filter_by(email=email, password=password).first()
+    user = User.query.filter_by(email=email).first()
     # Filter() method filters the records before we fire the select with all() or first()
 
-    if user is None:
+    # the password is checked against its hash in the password pool (passwords.py),
+    # a missing user is checked against a dummy hash so both cases take the same time
+    if not isinstance(password, str):
          return jsonify({"msg": "Bad username or password"}), 401
+    if not verify_password_bounded(user.password if user is not None else dummy_hash(), password) or user is None:
+         return jsonify({"msg": "Bad username or password"}), 401
+
+    # the work factor changed since this hash was made: store a new one
+    if needs_rehash(user.password):
+        user.password = hash_password_bounded(password)
+        table_versions.bump(User)
+        db.session.commit()
     
-    print("Authorized user: ", user)
+    logs.info("Authorized user", user_id=user.id)
 
     access_token = create_access_token(identity=user.id) # this line indicates that function get_jwt_identity() returns "user.id"
     return jsonify(access_token=access_token)
 
+# Log out: the token sent in the Authorization header can not be used anymore
+@api.route("/token", methods=["DELETE"])
+@jwt_required()
+def revoke_token():
+    revoked_tokens.revoke(get_jwt())
+    db.session.commit()
+    logs.info("Token revoked", user_id=get_jwt_identity())
+    return jsonify({"msg": "Token revoked"}), 200
+
+### List endpoints accept (all optional):
+#   ?limit=50&after=<last id>   keyset pagination, next cursor in the X-Next-Cursor / Link headers
+#   ?fields=id,name             sparse fieldset, only those columns are selected
+#   ?climate=arid               exact match filter on the model filter_fields
+#   ?population_gt=1000         ranges on the numeric fields: _gt, _gte, _lt, _lte, _between=min,max
+#                               (?height=unknown: the rows without a value)
+#   ?terrain=mountains          on terrain, climate, hair_color and skin_color: rows that have this value
+#                               in their list ("tundra, mountains"), several comma separated values must all be there
+#   ?stream=1 or "Accept: application/x-ndjson"   stream the rows instead of building one big list
+### /character/bulk, /planet/bulk and /favorite/bulk take a JSON array: POST creates, PATCH updates
+### (each item with its "id"), DELETE removes (ids). All valid items are written in one transaction
+### and the response has one result per item: {"index": 0, "status": "created" | "updated" | "deleted" | "not_found" | "error"}
+### (a favorite whose character, planet or user does not exist: "status": "error", "error": "not_found")
+
+### GET /user, /character and /planet (list and detail) send an ETag built from the table version,
+### send it back in "If-None-Match" to get a 304 without running any query
+
 ### User endpoints [GET, POST, PUT, UPDATE]: 
-@app.route('/user', methods=['GET'])
+@api.route('/user', methods=['GET'])
+@versioned(User)
 def get_all_user():
-    all_users = User.query.all()
-    all_users = list(map(lambda x: x.serialize(), all_users)) 
-    print("GET all_users: ", all_users)
-    return jsonify(all_users), 200
-
-@app.route('/user/<int:id>', methods=['GET'])
+    if wants_stream():
+        return stream_list(User, request.args, User.public_fields, User.filter_fields), 200
+    all_users, next_cursor = paginate_list(User, request.args, User.public_fields, User.filter_fields)
+    logs.debug("GET all_users", count=len(all_users))
+    return list_response(all_users, next_cursor), 200
+
+@api.route('/user/<int:id>', methods=['GET'])
+@versioned(User)
 def get_single_user(id):
     user = User.query.get(id)
 
     if user is None:
         raise APIException('User not found', status_code=404)
 
-    print("GET single user: ", user)
+    logs.debug("GET single user", user_id=user.id)
     return jsonify(user.serialize()), 200
 
-@app.route('/user', methods=['POST'])
+@api.route('/user', methods=['POST'])
 def create_user():
     request_body = request.get_json()
-    user = User(username=request_body["username"], email=request_body["email"], password=request_body["password"])
+    user = User(username=request_body["username"], email=request_body["email"], password=hash_password_bounded(request_body["password"]))
     db.session.add(user)
+    table_versions.bump(User)
     db.session.commit()
-    print("User created: ", request_body)
+    logs.info("User created", user_id=user.id)
     return jsonify(request_body), 200
 
-@app.route('/user/<int:user_id>', methods=['PUT'])
+@api.route('/user/<int:user_id>', methods=['PUT'])
 def update_user(user_id):
     request_body = request.get_json()
     user = User.query.get(user_id)
@@ -106,14 +250,16 @@ def update_user(user_id):
     if "email" in request_body:
         user.email = request_body["email"]
     if "password" in request_body:
-        user.password = request_body["password"]
+        user.password = hash_password_bounded(request_body["password"])
     
+    table_versions.bump(User)
     db.session.commit()
+    identity_cache.invalidate(user.id)
 
-    print("User property updated: ", request_body)
+    logs.info("User property updated", user_id=user.id, fields=[name for name in request_body if name != "password"])
     return jsonify(request_body), 200
 
-@app.route('/user/<int:id>', methods=['DELETE'])
+@api.route('/user/<int:id>', methods=['DELETE'])
 def delete_user(id):
     user = User.query.get(id)
 
@@ -121,7 +267,10 @@ def delete_user(id):
         raise APIException('User not found', status_code=404)
 
     db.session.delete(user)
+    table_versions.bump(User)
     db.session.commit()
+    identity_cache.invalidate(id)
+    Service.invalidate_favorites([id])
     response_body = {
          "msg": "User delete successful",
     }
@@ -129,31 +278,42 @@ def delete_user(id):
 
 
 ### Character endpoints [GET, POST, PUT, UPDATE]: 
-@app.route('/character', methods=['GET'])
+@api.route('/character', methods=['GET'])
+@versioned(Character)
 def get_all_character():
-    all_characters = Character.query.all()
-    all_characters = list(map(lambda x: x.serialize(), all_characters)) 
-    return jsonify(all_characters), 200
+    if wants_stream():
+        return stream_list(Character, request.args, Character.public_fields, Character.filter_fields), 200
+    all_characters, next_cursor = paginate_list(Character, request.args, Character.public_fields, Character.filter_fields)
+    return list_response(all_characters, next_cursor), 200
 
-@app.route('/character/<int:id>', methods=['GET'])
+@api.route('/character/<int:id>', methods=['GET'])
+@versioned(Character)
 def get_single_character(id):
-    character = Character.query.get(id)
+    character = model_cache.get(Character, id)
 
     if character is None:
         raise APIException('Character not found', status_code=404)
 
-    return jsonify(character.serialize()), 200
+    return jsonify(character), 200
+
+# count, unknown, min, max, avg and histogram of height, same filters as GET /character (see stats.py)
+@api.route('/character/stats', methods=['GET'])
+@versioned(Character)
+def get_character_stats():
+    return jsonify(numeric_stats(Character, request.args)), 200
 
-@app.route('/character', methods=['POST'])
+@api.route('/character', methods=['POST'])
 def create_character():
     request_body = request.get_json()
     character = Character(name=request_body["name"], birth_year=request_body["birth_year"], eye_color=request_body["eye_color"], gender=request_body["gender"], hair_color=request_body["hair_color"], height=request_body["height"], skin_color=request_body["skin_color"], item_type=request_body["item_type"])
     db.session.add(character)
+    table_versions.bump(Character)
     db.session.commit()
-    print("Character created: ", request_body)
+    search.update(Character, [character.id])
+    logs.info("Character created", character=request_body)
     return jsonify(request_body), 200
 
-@app.route('/character/<int:id>', methods=['PUT'])
+@api.route('/character/<int:id>', methods=['PUT'])
 def update_character(id):
     request_body = request.get_json()
     character = Character.query.get(id)
@@ -175,12 +335,15 @@ def update_character(id):
     if "skin_color" in request_body:
         character.skin_color = request_body["skin_color"]
     
+    table_versions.bump(Character)
     db.session.commit()
+    model_cache.invalidate(Character, id)
+    search.update(Character, [id])
 
-    print("Character property updated: ", request_body)
+    logs.info("Character property updated", id=id, changes=request_body)
     return jsonify(request_body), 200
 
-@app.route('/character/<int:id>', methods=['DELETE'])
+@api.route('/character/<int:id>', methods=['DELETE'])
 def delete_character(id):
     character = Character.query.get(id)
 
@@ -188,39 +351,92 @@ def delete_character(id):
         raise APIException('Character not found', status_code=404)
 
     db.session.delete(character)
+    table_versions.bump(Character)
+    table_versions.bump(Favorite)   # its favorites are deleted too (ON DELETE CASCADE)
     db.session.commit()
+    model_cache.invalidate(Character, id)
+    search.update(Character, [id])
     response_body = {
          "msg": "Character delete successful",
     }
     return jsonify(response_body), 200
 
+@api.route('/character/bulk', methods=['POST'])
+def create_character_bulk():
+    items = get_bulk_body(request.get_json())
+    results = bulk_create(Character, items, Character.required_fields)
+    sync_names(Character, [item.get("name") for item in items if isinstance(item, dict)])
+    new_ids = created_ids(Character, items, results)
+    table_versions.bump(Character)
+    db.session.commit()
+    search.update(Character, new_ids)
+    logs.info("Characters created (bulk)", count=len(items), results=results)
+    return jsonify(results), 200
+
+@api.route('/character/bulk', methods=['PATCH'])
+def update_character_bulk():
+    items = get_bulk_body(request.get_json())
+    results = bulk_update(Character, items)
+    sync_ids(Character, changed_ids(results))
+    table_versions.bump(Character)
+    db.session.commit()
+    for id in changed_ids(results):
+        model_cache.invalidate(Character, id)
+    search.update(Character, changed_ids(results))
+    logs.info("Characters updated (bulk)", count=len(items), results=results)
+    return jsonify(results), 200
+
+@api.route('/character/bulk', methods=['DELETE'])
+def delete_character_bulk():
+    items = get_bulk_body(request.get_json())
+    results = bulk_delete(Character, items)
+    table_versions.bump(Character)
+    table_versions.bump(Favorite)   # its favorites are deleted too (ON DELETE CASCADE)
+    db.session.commit()
+    for id in changed_ids(results):
+        model_cache.invalidate(Character, id)
+    search.update(Character, changed_ids(results))
+    logs.info("Characters deleted (bulk)", count=len(items), results=results)
+    return jsonify(results), 200
+
 
 ### Planet endpoints [GET, POST, PUT, UPDATE]: 
-@app.route('/planet', methods=['GET'])
+@api.route('/planet', methods=['GET'])
+@versioned(Planet)
 def get_all_planet():
-    all_planets = Planet.query.all()
-    all_planets = list(map(lambda x: x.serialize(), all_planets)) 
-    return jsonify(all_planets), 200
+    if wants_stream():
+        return stream_list(Planet, request.args, Planet.public_fields, Planet.filter_fields), 200
+    all_planets, next_cursor = paginate_list(Planet, request.args, Planet.public_fields, Planet.filter_fields)
+    return list_response(all_planets, next_cursor), 200
 
-@app.route('/planet/<int:id>', methods=['GET'])
+@api.route('/planet/<int:id>', methods=['GET'])
+@versioned(Planet)
 def get_single_planet(id):
-    planet = Planet.query.get(id)
+    planet = model_cache.get(Planet, id)
 
     if planet is None:
         raise APIException('Planet not found', status_code=404)
 
-    return jsonify(planet.serialize()), 200
+    return jsonify(planet), 200
+
+# same for population, diameter and rotation_period
+@api.route('/planet/stats', methods=['GET'])
+@versioned(Planet)
+def get_planet_stats():
+    return jsonify(numeric_stats(Planet, request.args)), 200
 
-@app.route('/planet', methods=['POST'])
+@api.route('/planet', methods=['POST'])
 def create_planet():
     request_body = request.get_json()
     planet = Planet(name=request_body["name"], climate=request_body["climate"], diameter=request_body["diameter"], population=request_body["population"], rotation_period=request_body["rotation_period"], terrain=request_body["terrain"], item_type=request_body["item_type"])
     db.session.add(planet)
+    table_versions.bump(Planet)
     db.session.commit()
-    print("Planet created: ", request_body)
+    search.update(Planet, [planet.id])
+    logs.info("Planet created", planet=request_body)
     return jsonify(request_body), 200
 
-@app.route('/planet/<int:id>', methods=['PUT'])
+@api.route('/planet/<int:id>', methods=['PUT'])
 def update_planet(id):
     request_body = request.get_json()
     planet = Planet.query.get(id)
@@ -240,12 +456,15 @@ def update_planet(id):
     if "terrain" in request_body:
         planet.terrain = request_body["terrain"]
     
+    table_versions.bump(Planet)
     db.session.commit()
+    model_cache.invalidate(Planet, id)
+    search.update(Planet, [id])
 
-    print("Planet property updated: ", request_body)
+    logs.info("Planet property updated", id=id, changes=request_body)
     return jsonify(request_body), 200
 
-@app.route('/planet/<int:id>', methods=['DELETE'])
+@api.route('/planet/<int:id>', methods=['DELETE'])
 def delete_planet(id):
     planet = Planet.query.get(id)
 
@@ -253,29 +472,98 @@ def delete_planet(id):
         raise APIException('Planet not found', status_code=404)
 
     db.session.delete(planet)
+    table_versions.bump(Planet)
+    table_versions.bump(Favorite)   # its favorites are deleted too (ON DELETE CASCADE)
     db.session.commit()
+    model_cache.invalidate(Planet, id)
+    search.update(Planet, [id])
     response_body = {
          "msg": "Planet delete successful",
     }
     return jsonify(response_body), 200
 
+@api.route('/planet/bulk', methods=['POST'])
+def create_planet_bulk():
+    items = get_bulk_body(request.get_json())
+    results = bulk_create(Planet, items, Planet.required_fields)
+    sync_names(Planet, [item.get("name") for item in items if isinstance(item, dict)])
+    new_ids = created_ids(Planet, items, results)
+    table_versions.bump(Planet)
+    db.session.commit()
+    search.update(Planet, new_ids)
+    logs.info("Planets created (bulk)", count=len(items), results=results)
+    return jsonify(results), 200
+
+@api.route('/planet/bulk', methods=['PATCH'])
+def update_planet_bulk():
+    items = get_bulk_body(request.get_json())
+    results = bulk_update(Planet, items)
+    sync_ids(Planet, changed_ids(results))
+    table_versions.bump(Planet)
+    db.session.commit()
+    for id in changed_ids(results):
+        model_cache.invalidate(Planet, id)
+    search.update(Planet, changed_ids(results))
+    logs.info("Planets updated (bulk)", count=len(items), results=results)
+    return jsonify(results), 200
+
+@api.route('/planet/bulk', methods=['DELETE'])
+def delete_planet_bulk():
+    items = get_bulk_body(request.get_json())
+    results = bulk_delete(Planet, items)
+    table_versions.bump(Planet)
+    table_versions.bump(Favorite)   # its favorites are deleted too (ON DELETE CASCADE)
+    db.session.commit()
+    for id in changed_ids(results):
+        model_cache.invalidate(Planet, id)
+    search.update(Planet, changed_ids(results))
+    logs.info("Planets deleted (bulk)", count=len(items), results=results)
+    return jsonify(results), 200
+
+
+### Search over the names of characters and planets (see search.py):
+#   GET /search?q=sky walk           every word matches as a prefix, or with one typo when it matches nothing (&fuzzy=0 to turn it off)
+#   &type=character|planet           only one kind (both by default)
+#   &climate=arid&gender=male        facet filters, the response counts the results per facet value
+#   &limit=20
+#   "approximate": true when a word starts too many words to count them all (SEARCH_MAX_EXPANSIONS)
+@api.route('/search', methods=['GET'])
+def search_names():
+    kinds = [request.args["type"]] if request.args.get("type") else ["character", "planet"]
+    unknown = [kind for kind in kinds if kind not in search.indexes]
+    if unknown:
+        raise APIException("'type' must be character or planet", status_code=400)
+    limit = parse_int_arg(request.args, "limit", 20)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise APIException("'limit' must be between 1 and " + str(MAX_PAGE_SIZE), status_code=400)
+    facet_fields = Character.facet_fields + Planet.facet_fields
+    filters = {field: request.args[field] for field in facet_fields if request.args.get(field)}
+    fuzzy = request.args.get("fuzzy", "1") not in ("0", "false")
+    return jsonify(search.search(request.args.get("q", ""), kinds, filters, limit, fuzzy)), 200
+
+# every worker builds its index when it starts (and again when another process changed the table)
+@api.before_app_first_request
+def build_search_index():
+    try:
+        search.build_all()
+    except Exception:
+        db.session.rollback()
+        logs.error("Search index not built, it will be on the first search")
+
 
 ### Favorite endpoints:
-@app.route('/favorite', methods=['GET'])
+@api.route('/favorite', methods=['GET'])
 @jwt_required()
 def get_all_favorite():
     
     # Access the identity of the current user with get_jwt_identity()
     current_user_id = get_jwt_identity()
 
-    user = User.query.get(current_user_id)
-    if user is None:
-        raise APIException('User not found', status_code=404)
-
+    # one cache hit most of the time, the service checks the user when it has to query
     all_favorites = Service.get_favorites(current_user_id)
     return jsonify(all_favorites), 200
 
-@app.route('/favorite_raw', methods=['GET'])
+@api.route('/favorite_raw', methods=['GET'])
 @jwt_required()
 def get_all_favorite_raw():
 
@@ -284,20 +572,41 @@ def get_all_favorite_raw():
 
     all_favorite_raw = Favorite.query.filter_by(user_id=current_user_id).all()
     all_favorite_raw = list(map(lambda x: x.serialize(), all_favorite_raw)) 
-    print("GET all_favorite_raw: ", all_favorite_raw)
+    logs.debug("GET all_favorite_raw", user_id=current_user_id, count=len(all_favorite_raw))
     return jsonify(all_favorite_raw), 200
 
-@app.route('/favorite', methods=['POST'])
+@api.route('/favorite', methods=['POST'])
 @jwt_required()
 def add_favorite():
     request_body = request.get_json()
-    favorite = Favorite(item_id=request_body["item_id"], item_type=request_body["item_type"], user_id=request_body["user_id"])
+
+    # idempotent: adding a favorite that already exists does not create a duplicate row
+    try:
+        columns = Favorite.to_columns({"item_id": request_body["item_id"], "item_type": request_body["item_type"], "user_id": request_body["user_id"]})
+    except ValueError as error:
+        raise APIException(str(error), status_code=400)
+    favorite = Favorite.query.filter_by(**columns).first()
+    if favorite is not None:
+        return jsonify(request_body), 200
+
+    favorite = Favorite(**columns)
     db.session.add(favorite)
-    db.session.commit()
-    print("Favorite added: ", request_body)
+    before = Service.favorites_stamp()
+    table_versions.bump(Favorite)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # the same favorite was added by a concurrent request (uq_favorite_user_character/planet),
+        # or the character/planet does not exist (foreign key)
+        db.session.rollback()
+        if Favorite.query.filter_by(**columns).first() is None:
+            raise APIException('Item not found', status_code=404)
+        return jsonify(request_body), 200
+    Service.favorite_added(favorite, before)
+    logs.info("Favorite added", favorite=request_body)
     return jsonify(request_body), 200
 
-@app.route('/favorite/<int:id>', methods=['DELETE'])
+@api.route('/favorite/<int:id>', methods=['DELETE'])
 @jwt_required()
 def delete_favorite(id):
     favorite = Favorite.query.get(id)
@@ -305,38 +614,57 @@ def delete_favorite(id):
     if favorite is None:
         raise APIException('Favorite not found', status_code=404)
 
+    user_id = favorite.user_id
     db.session.delete(favorite)
+    before = Service.favorites_stamp()
+    table_versions.bump(Favorite)
     db.session.commit()
+    Service.favorite_deleted(user_id, id, before)
     response_body = {
          "msg": "Favorite delete successful",
     }
     return jsonify(response_body), 200
 
+@api.route('/favorite/bulk', methods=['POST'])
+@jwt_required()
+def create_favorite_bulk():
+    items = get_bulk_body(request.get_json())
+    results = bulk_create(Favorite, items, Favorite.required_fields)
+    table_versions.bump(Favorite)
+    db.session.commit()
+    Service.invalidate_favorites({item.get("user_id") for item in items if isinstance(item, dict)})
+    logs.info("Favorites created (bulk)", count=len(items), results=results)
+    return jsonify(results), 200
 
-# Populate DB
-@app.route('/populate', methods=['GET'])
-def populate():
-    u1 = User(username='user01', email='user01@example.com', password="01")
-    u2 = User(username='user02', email='user02@example.com', password="02")
-    u3 = User(username='user03', email='user03@example.com', password="03")
-
-    c1 = Character(name='Luke Skywalker', birth_year='19BBY', gender='male', height='172.0', eye_color='blue', hair_color='blond', skin_color='fair', item_type='character')
-    c2 = Character(name='C-3PO', birth_year='112BBY', gender='', height='167.0', eye_color='yellow', hair_color='n/a', skin_color='gold', item_type='character')
-    c3 = Character(name='R2-D2', birth_year='33BBY', gender='n/a', height='96.0', eye_color='red', hair_color='n/a', skin_color='white, blue', item_type='character')
-    c4 = Character(name='Darth Vader', birth_year='41.9BBY', gender='male', height='202.0', eye_color='yellow', hair_color='none', skin_color='white', item_type='character')
-    c5 = Character(name='Leia Organa', birth_year='19BBY', gender='female', height='150.0', eye_color='brown', hair_color='brown', skin_color='light', item_type='character')
-    c6 = Character(name='Owen Lars', birth_year='52BBY', gender='male', height='178.0', eye_color='blue', hair_color='brown, grey', skin_color='light', item_type='character')
-
-    p1 = Planet(name='Tatooine', population='200000', terrain='desert', diameter='10465.0', climate='arid', rotation_period='23.0', item_type='planet')
-    p2 = Planet(name='Alderaan', population='2000000000', terrain='grasslands, mountains', diameter='12500.0', climate='temperate', rotation_period='24.0', item_type='planet')
-    p3 = Planet(name='Yavin IV', population='1000', terrain='jungle, rainforests', diameter='10200.0', climate='temperate, tropical', rotation_period='24.0', item_type='planet')
-    p4 = Planet(name='Hoth', population='5000', terrain='tundra, ice caves, mountain ranges', diameter='7200.0', climate='frozen', rotation_period='23.0', item_type='planet')
-    p5 = Planet(name='Dagobah', population='6500', terrain='swamp, jungles', diameter='8900.0', climate='murky', rotation_period='23.0', item_type='planet')
-    p6 = Planet(name='Bespin', population='6000000', terrain='gas giant', diameter='118000.0', climate='temperate', rotation_period='12.0', item_type='planet')
-
-    db.session.add_all([u1, u2, u3, c1, c2, c3, c4, c5, c6, p1, p2, p3, p4, p5, p6])
+@api.route('/favorite/bulk', methods=['PATCH'])
+@jwt_required()
+def update_favorite_bulk():
+    items = get_bulk_body(request.get_json())
+    owners = Service.favorite_owners(items)
+    results = bulk_update(Favorite, items)
+    table_versions.bump(Favorite)
     db.session.commit()
+    Service.invalidate_favorites(owners | {item.get("user_id") for item in items if isinstance(item, dict)})
+    logs.info("Favorites updated (bulk)", count=len(items), results=results)
+    return jsonify(results), 200
 
+@api.route('/favorite/bulk', methods=['DELETE'])
+@jwt_required()
+def delete_favorite_bulk():
+    items = get_bulk_body(request.get_json())
+    owners = Service.favorite_owners(items)
+    results = bulk_delete(Favorite, items)
+    table_versions.bump(Favorite)
+    db.session.commit()
+    Service.invalidate_favorites(owners)
+    logs.info("Favorites deleted (bulk)", count=len(items), results=results)
+    return jsonify(results), 200
+
+
+# Populate DB with the sample data (for bigger datasets use the CLI: $ flask load-data --help)
+@api.route('/populate', methods=['GET'])
+def populate():
+    load_seed_data()
     return('Data populated')
 
 
@@ -344,6 +672,6 @@ def populate():
 # Meaning: only runs if `$ python src/main.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
 
 
@@ -0,0 +1,176 @@
+import os
+import time
+import threading
+from flask import g, request, has_app_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import logs
+
+# Request instrumentation:
+# - latency histogram per endpoint, SQL statements and SQL time per request
+#   (SQLAlchemy engine events) and JSON encoding time
+# - a "Server-Timing" header on every response (visible in the browser dev tools)
+# - requests that run more than QUERY_BUDGET statements are logged and counted,
+#   that is how an N+1 shows up
+# - GET /metrics in the Prometheus text format
+# The numbers are per process: with gunicorn every worker has its own, Prometheus
+# adds them up when it scrapes each worker.
+
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 10))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}  # labels -> [count per bucket..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        data = self.series.get(labels)
+        if data is None:
+            data = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[i] += 1
+        data[len(self.buckets)] += 1
+        data[-1] += value
+
+    def lines(self, name, label_names):
+        for labels, data in sorted(self.series.items()):
+            base = format_labels(label_names, labels)
+            for i, bound in enumerate(self.buckets):
+                yield name + "_bucket" + format_labels(label_names + ("le",), labels + (str(bound),)) + " " + str(data[i])
+            yield name + "_bucket" + format_labels(label_names + ("le",), labels + ("+Inf",)) + " " + str(data[len(self.buckets)])
+            yield name + "_sum" + base + " " + repr(data[-1])
+            yield name + "_count" + base + " " + str(data[len(self.buckets)])
+
+
+def format_labels(names, values):
+    pairs = [name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.requests = {}         # (method, endpoint, status) -> count
+        self.query_seconds = {}    # (method, endpoint) -> seconds
+        self.serialize_seconds = {}
+        self.over_budget = {}
+        self.collectors = []       # functions that return {metric name: value}, see add_collector()
+
+    def record(self, method, endpoint, status, seconds, query_count, query_seconds, serialize_seconds):
+        key = (method, endpoint)
+        with self.lock:
+            self.latency.observe(key, seconds)
+            self.queries.observe(key, query_count)
+            status_key = key + (str(status),)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            self.query_seconds[key] = self.query_seconds.get(key, 0.0) + query_seconds
+            self.serialize_seconds[key] = self.serialize_seconds.get(key, 0.0) + serialize_seconds
+            if query_count > QUERY_BUDGET:
+                self.over_budget[key] = self.over_budget.get(key, 0) + 1
+
+    def add_collector(self, fn):
+        # fn() -> {"metric_name": value}, read on every scrape (cache stats, pool stats...)
+        self.collectors.append(fn)
+
+    def render(self):
+        lines = []
+        labels = ("method", "endpoint")
+        with self.lock:
+            lines.append("# TYPE http_request_duration_seconds histogram")
+            lines.extend(self.latency.lines("http_request_duration_seconds", labels))
+            lines.append("# TYPE db_queries_per_request histogram")
+            lines.extend(self.queries.lines("db_queries_per_request", labels))
+            lines.append("# TYPE http_requests_total counter")
+            for key, value in sorted(self.requests.items()):
+                lines.append("http_requests_total" + format_labels(labels + ("status",), key) + " " + str(value))
+            for name, values in (("db_query_seconds_total", self.query_seconds),
+                                 ("serialize_seconds_total", self.serialize_seconds),
+                                 ("query_budget_exceeded_total", self.over_budget)):
+                lines.append("# TYPE " + name + " counter")
+                for key, value in sorted(values.items()):
+                    lines.append(name + format_labels(labels, key) + " " + repr(value))
+        for fn in self.collectors:
+            for name, value in sorted(fn().items()):
+                lines.append(name + " " + repr(value))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+### SQL statements, counted for the request that runs them
+
+# the start time lives on the statement's execution context: a statement that fails
+# never reaches after_cursor_execute, and its context is dropped with it
+# (context is None for a few internal statements: counted, not timed)
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and "request_started" in g:
+        g.query_count += 1
+        started = getattr(context, "query_started", None)
+        if started is not None:
+            g.query_seconds += time.perf_counter() - started
+
+
+def add_serialize_time(seconds):
+    # called by the JSON encoder
+    if has_app_context() and "request_started" in g:
+        g.serialize_seconds += seconds
+
+
+def start_request():
+    g.request_started = time.perf_counter()
+    g.query_count = 0
+    g.query_seconds = 0.0
+    g.serialize_seconds = 0.0
+
+def finish_request(response):
+    if "request_started" not in g:
+        return response
+    seconds = time.perf_counter() - g.request_started
+    endpoint = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    metrics.record(request.method, endpoint, response.status_code, seconds,
+                   g.query_count, g.query_seconds, g.serialize_seconds)
+
+    response.headers["Server-Timing"] = 'db;dur=%.2f;desc="%d queries", serialize;dur=%.2f, total;dur=%.2f' % (
+        g.query_seconds * 1000, g.query_count, g.serialize_seconds * 1000, seconds * 1000)
+    if g.query_count > QUERY_BUDGET:
+        logs.warning("Query budget exceeded", method=request.method, path=request.full_path,
+                     queries=g.query_count, budget=QUERY_BUDGET)
+    return response
+
+
+def init_metrics(app):
+    app.before_request(start_request)
+    app.after_request(finish_request)
+
+    # time spent turning responses into JSON
+    base_encoder = app.json_encoder
+
+    class TimedJSONEncoder(base_encoder):
+        def encode(self, o):
+            started = time.perf_counter()
+            try:
+                return super().encode(o)
+            finally:
+                add_serialize_time(time.perf_counter() - started)
+
+    app.json_encoder = TimedJSONEncoder
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -1,9 +1,24 @@
 
 # IMPORTANT: run in Postman GET 'URL/populate' to populate database for testing purposes
 
-from flask_sqlalchemy import SQLAlchemy
+import math
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import validates
+from passwords import hash_password, is_password_hash
+from utils import APIException
+from routing import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()   # flask_sqlalchemy.SQLAlchemy that can send reads to replicas (see routing.py)
+
+# SQLite ignores foreign keys (and ON DELETE CASCADE) unless they are turned on per connection
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
 
 # For each 'model` I have to declare a class with the model properties 
 # and a method `serialize` that returns a dictionary representation of the class
@@ -13,7 +28,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(120), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(80), unique=False, nullable=False)
+    password = db.Column(db.String(255), unique=False, nullable=False)   # hash, see passwords.py
     is_active = db.Column(db.Boolean(), unique=False, nullable=False, default=True)
 
     favorites = db.relationship('Favorite', backref='user', lazy=True) # One to Many
@@ -35,6 +50,26 @@ class User(db.Model):
     def __repr__(self):
         return '<User: %r>' % self.username
 
+    # columns that serialize() exposes and the list endpoint can filter by (GET /user?username=...)
+    public_fields = ("id", "username", "email")
+    filter_fields = ("username",)
+    required_fields = ("username", "email", "password")
+
+    @validates("password")
+    def validate_password(self, name, value):
+        # every ORM write stores a hash (the admin, scripts...). The endpoints hash in the
+        # password pool first (passwords.py), their hash goes through unchanged
+        if value is not None and not is_password_hash(value):
+            return hash_password(value)
+        return value
+
+    @staticmethod
+    def to_columns(record):
+        # bulk loads store the hash, never the plain password
+        if "password" in record and not is_password_hash(record["password"]):
+            record = dict(record, password=hash_password(record["password"]))
+        return record
+
     # serialize(): tell python how convert the class object into a dictionary ready to jsonify
     def serialize(self):
         return {
@@ -47,11 +82,61 @@ class User(db.Model):
 
 class Favorite(db.Model):
     __tablename__ = "favorite"
+    # A favorite points to ONE character or ONE planet through a real foreign key,
+    # "item_type" says which one is set. Deleting the character/planet deletes its favorites (CASCADE).
+    # A user can favorite the same item only once, the indexes of these constraints also serve
+    # the "favorites of this user" lookups (user_id is their first column)
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "character_id", name="uq_favorite_user_character"),
+        db.UniqueConstraint("user_id", "planet_id", name="uq_favorite_user_planet"),
+        db.CheckConstraint(
+            "(item_type = 'character' AND character_id IS NOT NULL AND planet_id IS NULL)"
+            " OR (item_type = 'planet' AND planet_id IS NOT NULL AND character_id IS NULL)",
+            name="ck_favorite_item"),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    item_id = db.Column(db.Integer, unique=False, nullable=False) # store character_id or planet_id
     item_type = db.Column(db.String(80), unique=False, nullable=False) # type can be Character or Planet
+    character_id = db.Column(db.Integer, db.ForeignKey("character.id", name="fk_favorite_character_id", ondelete="CASCADE"), nullable=True)
+    planet_id = db.Column(db.Integer, db.ForeignKey("planet.id", name="fk_favorite_planet_id", ondelete="CASCADE"), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
 
+    # passive_deletes: the database cascade removes the favorites, the ORM does not load them first
+    character = db.relationship("Character", backref=db.backref("favorites", cascade="all, delete-orphan", passive_deletes=True))
+    planet = db.relationship("Planet", backref=db.backref("favorites", cascade="all, delete-orphan", passive_deletes=True))
+
+    # the API still talks about "item_id" + "item_type"
+    required_fields = ("item_id", "item_type", "user_id")
+    item_columns = {"character": "character_id", "planet": "planet_id"}
+
+    def __init__(self, **kwargs):
+        super().__init__(**Favorite.to_columns(kwargs))
+
+    @staticmethod
+    def to_columns(record):
+        # {"item_type": "planet", "item_id": 3} -> {"item_type": "planet", "planet_id": 3, "character_id": None}
+        if "item_id" not in record:
+            return record
+        record = dict(record)
+        item_id = record.pop("item_id")
+        column = Favorite.item_columns.get(record.get("item_type"))
+        if column is None:
+            raise ValueError("'item_type' must be one of: " + ", ".join(Favorite.item_columns))
+        for name in Favorite.item_columns.values():
+            record[name] = item_id if name == column else None
+        return record
+
+    @property
+    def item_id(self):
+        return self.character_id if self.item_type == "character" else self.planet_id
+
+    @property
+    def item(self):
+        # the Character or Planet object (use joinedload/selectinload when reading many favorites)
+        return self.character if self.item_type == "character" else self.planet
+
+    def __repr__(self):
+        return '<Favorite: %r %r %r>' % (self.user_id, self.item_type, self.item_id)
+
     def serialize(self):
         return {
             "id": self.id,
@@ -61,18 +146,142 @@ class Favorite(db.Model):
         }
 
 
-class Character(db.Model):
+def split_values(raw):
+    # "tundra, Ice caves" -> ["tundra", "ice caves"]
+    if raw is None:
+        return []
+    return [value.strip().lower() for value in str(raw).split(",") if value.strip()]
+
+
+class Attribute(db.Model):
+    # one row per distinct value of a multi-valued column ("terrain", "ice caves")
+    __tablename__ = "attribute"
+    __table_args__ = (
+        db.UniqueConstraint("kind", "value", name="uq_attribute_kind_value"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)   # the column: terrain, climate, hair_color, skin_color
+    value = db.Column(db.String(50), nullable=False)
+
+    def __repr__(self):
+        return '<Attribute: %r=%r>' % (self.kind, self.value)
+
+
+# which attributes each planet/character has. The primary key starts with attribute_id,
+# so "the planets with mountains" is one index range, the other index is for the updates
+planet_attribute = db.Table("planet_attribute",
+    db.Column("attribute_id", db.Integer, db.ForeignKey("attribute.id", ondelete="CASCADE"), primary_key=True),
+    db.Column("planet_id", db.Integer, db.ForeignKey("planet.id", ondelete="CASCADE"), primary_key=True, index=True),
+)
+
+character_attribute = db.Table("character_attribute",
+    db.Column("attribute_id", db.Integer, db.ForeignKey("attribute.id", ondelete="CASCADE"), primary_key=True),
+    db.Column("character_id", db.Integer, db.ForeignKey("character.id", ondelete="CASCADE"), primary_key=True, index=True),
+)
+
+
+class MultiValueMixin:
+    # The multi_value_fields keep their comma separated string (serialize() does not change),
+    # and each value is also a row of attribute_table, kept in sync by attributes.py.
+    # Filters on those fields are index lookups instead of LIKE '%...%' scans.
+
+    @classmethod
+    def has_values(cls, field, raw):
+        # ?terrain=mountains -> the rows with that value, ?terrain=tundra,mountains -> with both
+        values = split_values(raw)
+        if not values:
+            return getattr(cls, field) == raw
+        link = cls.attribute_table
+        owner_id = link.c[cls.__tablename__ + "_id"]
+        conditions = []
+        for value in values:
+            owners = db.select(owner_id).join(Attribute, Attribute.id == link.c.attribute_id) \
+                .where(Attribute.kind == field, Attribute.value == value)
+            conditions.append(cls.id.in_(owners))
+        return db.and_(*conditions)
+
+
+# SWAPI writes "unknown" (or "n/a", "none") when it has no number, stored as NULL
+UNKNOWN_NUMBERS = ("unknown", "n/a", "none", "")
+
+def parse_number(value, python_type, name):
+    # 172, "172.0", "1,000,000" -> the number, "unknown"/None -> None, anything else -> ValueError
+    error = ValueError("'" + name + "' must be a number or \"unknown\"")
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise error
+    if isinstance(value, str):
+        value = value.strip().lower().replace(",", "")
+        if value in UNKNOWN_NUMBERS:
+            return None
+    try:
+        if python_type is int:
+            try:
+                return int(value)
+            except ValueError:
+                number = float(value)
+                if not number.is_integer():
+                    raise error
+                return int(number)
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise error
+    if math.isnan(number) or math.isinf(number):
+        raise error
+    return number
+
+
+class NumericMixin:
+    # numeric_fields take numbers, numbers as strings (like /populate sends them) or "unknown"
+    # (NULL). The ORM writes go through the validates() of each model, the bulk endpoints
+    # and flask load-data through to_columns()
+
+    @classmethod
+    def parse_numeric(cls, name, value):
+        return parse_number(value, getattr(cls, name).type.python_type, name)
+
+    @classmethod
+    def parse_field(cls, name, value):
+        try:
+            return cls.parse_numeric(name, value)
+        except ValueError as error:
+            raise APIException(str(error), status_code=400)
+
+    @classmethod
+    def to_columns(cls, record):
+        record = dict(record)
+        for name in cls.numeric_fields:
+            if name in record:
+                record[name] = cls.parse_numeric(name, record[name])
+        return record
+
+
+class Character(MultiValueMixin, NumericMixin, db.Model):
     __tablename__ = "character"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
     birth_year = db.Column(db.String(50), unique=False, nullable=False)
     gender = db.Column(db.String(50), unique=False, nullable=False)
-    height = db.Column(db.Float, unique=False, nullable=False)
+    height = db.Column(db.Float, unique=False, nullable=True, index=True)  # NULL: unknown
     eye_color = db.Column(db.String(50), unique=False, nullable=False)
     hair_color = db.Column(db.String(50), unique=False, nullable=False)
     skin_color = db.Column(db.String(50), unique=False, nullable=False)
     item_type = db.Column(db.String(50), unique=False, nullable=False)
 
+    public_fields = ("id", "name", "birth_year", "gender", "height", "eye_color", "hair_color", "skin_color", "item_type")
+    filter_fields = ("name", "birth_year", "gender", "eye_color", "hair_color", "skin_color")
+    facet_fields = ("gender", "eye_color")  # GET /search
+    multi_value_fields = ("hair_color", "skin_color")
+    attribute_table = character_attribute
+    numeric_fields = ("height",)
+
+    @validates(*numeric_fields)
+    def validate_numeric(self, name, value):
+        return self.parse_field(name, value)
+
+    required_fields = ("name", "birth_year", "eye_color", "gender", "hair_color", "height", "skin_color", "item_type")
+
     def __repr__(self):
         return '<Character: %r>' % self.name
 
@@ -90,17 +299,30 @@ class Character(db.Model):
         }
 
 
-class Planet(db.Model):
+class Planet(MultiValueMixin, NumericMixin, db.Model):
     __tablename__ = "planet"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
-    population = db.Column(db.Integer, unique=False, nullable=False)
+    population = db.Column(db.BigInteger, unique=False, nullable=True, index=True)  # NULL: unknown
     terrain = db.Column(db.String(50), unique=False, nullable=False)
-    diameter = db.Column(db.Float, unique=False, nullable=False)
+    diameter = db.Column(db.Float, unique=False, nullable=True, index=True)
     climate = db.Column(db.String(50), unique=False, nullable=False)
-    rotation_period = db.Column(db.Float, unique=False, nullable=False)
+    rotation_period = db.Column(db.Float, unique=False, nullable=True, index=True)
     item_type = db.Column(db.String(50), unique=False, nullable=False)
 
+    public_fields = ("id", "name", "population", "terrain", "diameter", "climate", "rotation_period", "item_type")
+    filter_fields = ("name", "terrain", "climate")
+    facet_fields = ("climate", "terrain")  # GET /search
+    multi_value_fields = ("terrain", "climate")
+    attribute_table = planet_attribute
+    numeric_fields = ("population", "diameter", "rotation_period")
+
+    @validates(*numeric_fields)
+    def validate_numeric(self, name, value):
+        return self.parse_field(name, value)
+
+    required_fields = ("name", "climate", "diameter", "population", "rotation_period", "terrain", "item_type")
+
     def __repr__(self):
         return '<Planet: %r>' % self.name
 
@@ -117,4 +339,25 @@ class Planet(db.Model):
         }
     
 
-    
\ No newline at end of file
+    
+
+class TableVersion(db.Model):
+    # one row per table, "version" goes up by one on every write to that table (used for ETags)
+    __tablename__ = "table_version"
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, unique=False, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<TableVersion: %r %r>' % (self.name, self.version)
+
+
+class RevokedToken(db.Model):
+    # the JWTs revoked before they expire (DELETE /token), see identity.py.
+    # A row is useless after expires_at and is deleted by the next revocation
+    __tablename__ = "revoked_token"
+    jti = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return '<RevokedToken: %r>' % self.jti
@@ -0,0 +1,78 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+from utils import APIException
+
+# Password hashing for User.password (PBKDF2-SHA256 from werkzeug, no extra dependency).
+# PASSWORD_HASH_ITERATIONS is the work factor: raise it and every user's hash is
+# upgraded the next time they log in (see needs_rehash).
+# Hashing is CPU bound on purpose, so it runs in a small thread pool (hashlib releases
+# the GIL while it hashes) with a bounded queue: a burst of logins gets a 503 instead of
+# tying up every request worker.
+
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 260000))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+SALT_LENGTH = 16
+
+executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+def hash_method(iterations=None):
+    return "pbkdf2:sha256:" + str(iterations or PASSWORD_HASH_ITERATIONS)
+
+def is_password_hash(value):
+    return isinstance(value, str) and value.startswith("pbkdf2:") and value.count("$") == 2
+
+def hash_password(password, iterations=None):
+    return generate_password_hash(password, method=hash_method(iterations), salt_length=SALT_LENGTH)
+
+def verify_password(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+def needs_rehash(pwhash):
+    # stored with another work factor (or another method) than the current setting
+    return pwhash.split("$", 1)[0] != hash_method()
+
+# used when the email does not exist, so a wrong email costs as much as a wrong password.
+# Made on the first use and not at import: it is a full hash, and every worker would pay it at startup
+DUMMY_HASH = None
+
+def dummy_hash():
+    global DUMMY_HASH
+    if DUMMY_HASH is None:
+        DUMMY_HASH = hash_password("dummy password")
+    return DUMMY_HASH
+
+def reset_pool():
+    # in a forked worker (gunicorn --preload) the threads of the parent's pool do not exist
+    global executor, slots
+    executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password")
+    slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_pool)
+
+
+def run_bounded(fn, *args):
+    if not slots.acquire(blocking=False):
+        raise APIException('Too many login attempts, try again later', status_code=503)
+    try:
+        future = executor.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda f: slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except TimeoutError:
+        raise APIException('Too many login attempts, try again later', status_code=503)
+
+def hash_password_bounded(password):
+    return run_bounded(hash_password, password)
+
+def verify_password_bounded(pwhash, password):
+    return run_bounded(verify_password, pwhash, password)
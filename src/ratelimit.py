@@ -0,0 +1,252 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from flask import g, request, jsonify
+from identity import verify_identity
+import logs
+
+# Rate limiting and admission control, checked before every request.
+#
+# Token bucket per client: the client is the JWT identity ("user:12") when the request
+# carries a valid token, its IP otherwise. The bucket holds up to RATE_LIMIT_BURST tokens
+# and refills at RATE_LIMIT_RATE tokens per second; every request takes the cost of its
+# route (ROUTE_COSTS, a full table list costs more than a detail read). An empty bucket
+# answers 429 with Retry-After, the seconds until the request would fit.
+#
+# Concurrency cap: at most RATE_LIMIT_MAX_CONCURRENT requests run at the same time in
+# this process (threaded workers), the next ones wait RATE_LIMIT_QUEUE_TIMEOUT seconds
+# for a slot and get a 503 with Retry-After after that, before the worker saturates.
+#
+# Settings:
+#   RATE_LIMIT_ENABLED=0            turns both off (the load test does)
+#   RATE_LIMIT_RATE, RATE_LIMIT_BURST
+#   RATE_LIMIT_COSTS=create_token=20,populate=100   overrides ROUTE_COSTS (endpoint=cost)
+#   RATE_LIMIT_URL=redis://host:6379/0   buckets shared by every worker and server
+#                                        (in-process by default, like cache.py)
+#   RATE_LIMIT_TRUST_PROXY=1        the client IP is the first X-Forwarded-For address
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') not in ('0', 'false')
+RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', 20))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 100))
+RATE_LIMIT_MAX_CONCURRENT = int(os.environ.get('RATE_LIMIT_MAX_CONCURRENT', 64))
+RATE_LIMIT_QUEUE_TIMEOUT = float(os.environ.get('RATE_LIMIT_QUEUE_TIMEOUT', 0.5))
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', '0') in ('1', 'true')
+
+# endpoint (view function name) -> tokens per request, 1 when it is not listed
+ROUTE_COSTS = {
+    "create_token": 10,             # a password hash
+    "create_user": 10,
+    "update_user": 10,
+    "populate": 50,
+    "get_character_stats": 5,
+    "get_planet_stats": 5,
+    "search_names": 2,
+    "create_character_bulk": 20,
+    "update_character_bulk": 20,
+    "delete_character_bulk": 20,
+    "create_planet_bulk": 20,
+    "update_planet_bulk": 20,
+    "delete_planet_bulk": 20,
+    "create_favorite_bulk": 20,
+    "update_favorite_bulk": 20,
+    "delete_favorite_bulk": 20,
+}
+# list endpoints: 1 token per 100 rows of ?limit, FULL_LIST_COST without a limit (or streamed)
+LIST_ENDPOINTS = ("get_all_character", "get_all_planet", "get_all_user")
+FULL_LIST_COST = 20
+# never limited: cached documents and the probes of the load balancer
+EXEMPT_ENDPOINTS = ("static", "get_metrics", "root", "routes", "openapi", "healthz")
+
+
+def parse_costs(value):
+    costs = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, cost = item.split("=", 1)
+            costs[name.strip()] = float(cost)
+    return costs
+
+
+class BucketBackend:
+    # Interface of the bucket stores: take() removes cost tokens from the bucket of key
+    # when it has them and returns (allowed, tokens left, seconds until cost tokens are there)
+
+    def take(self, key, cost, rate, burst):
+        raise NotImplementedError()
+
+    def stats(self):
+        return {}
+
+
+class LocalBuckets(BucketBackend):
+    # Per-process buckets: with N workers a client gets up to N times the rate.
+    # The least recently seen clients are forgotten past max_keys (a new bucket is full,
+    # so forgetting a client can only be in its favor).
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> (tokens, time of the last update)
+        self.lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return allowed, tokens, 0.0 if allowed else (cost - tokens) / rate
+
+    def stats(self):
+        return {"keys": len(self.buckets)}
+
+
+class RedisBuckets(BucketBackend):
+    # Shared buckets, one hash per client updated by a Lua script so the read-refill-take
+    # is atomic across workers. Needs the "redis" package (optional dependency).
+
+    SCRIPT = """
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local cost, rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local tokens = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url, prefix="ratelimit:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RedisBuckets needs the redis package: $ pipenv install redis")
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+        self.prefix = prefix
+
+    def take(self, key, cost, rate, burst):
+        allowed, tokens = self.script(keys=[self.prefix + key], args=[cost, rate, burst, time.time()])
+        tokens = float(tokens)
+        return bool(allowed), tokens, 0.0 if allowed else (cost - tokens) / rate
+
+
+def bucket_backend(url):
+    # url: "" -> LocalBuckets (per process), redis://host:6379/0 -> RedisBuckets
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBuckets(url)
+    return LocalBuckets()
+
+
+class RateLimiter:
+
+    def __init__(self, backend, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST,
+                 max_concurrent=RATE_LIMIT_MAX_CONCURRENT, queue_timeout=RATE_LIMIT_QUEUE_TIMEOUT):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.costs = dict(ROUTE_COSTS, **parse_costs(os.environ.get('RATE_LIMIT_COSTS', '')))
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0       # 429, empty bucket
+        self.shed = 0           # 503, no free slot
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def client_key(self):
+        # a valid token identifies the user, a missing or bad one falls back to the IP
+        # (the endpoint itself still answers 401 for a bad token). The token is verified
+        # here once for the whole request (see identity.py)
+        identity = verify_identity(optional=True)
+        if identity is not None:
+            return "user:" + str(identity)
+        address = request.remote_addr
+        if RATE_LIMIT_TRUST_PROXY and request.headers.get("X-Forwarded-For"):
+            address = request.headers["X-Forwarded-For"].split(",")[0].strip()
+        return "ip:" + str(address)
+
+    def endpoint(self):
+        # view function name, without the blueprint ("api.create_token" -> "create_token")
+        return (request.endpoint or "").rsplit(".", 1)[-1]
+
+    def cost(self):
+        endpoint = self.endpoint()
+        if endpoint in LIST_ENDPOINTS:
+            limit = request.args.get("limit", "")
+            if not limit.isdigit() or request.args.get("stream") in ("1", "true"):
+                return FULL_LIST_COST
+            return min(FULL_LIST_COST, 1 + int(limit) // 100)
+        return self.costs.get(endpoint, 1)
+
+    def before_request(self):
+        if request.endpoint is None or self.endpoint() in EXEMPT_ENDPOINTS:
+            return None
+
+        # a cost bigger than the bucket could never be paid
+        cost = min(self.cost(), self.burst)
+        key = self.client_key()
+        allowed, tokens, wait = self.backend.take(key, cost, self.rate, self.burst)
+        g.rate_limit_remaining = int(tokens)
+        if not allowed:
+            with self.lock:
+                self.rejected += 1
+            logs.warning("Rate limited", client=key, endpoint=self.endpoint(), cost=cost)
+            return self.reject(429, "Too many requests", wait)
+
+        if self.slots is not None:
+            if not self.slots.acquire(timeout=self.queue_timeout):
+                with self.lock:
+                    self.shed += 1
+                logs.warning("Request shed", endpoint=self.endpoint(), in_flight=self.in_flight)
+                return self.reject(503, "Server busy", 1)
+            g.rate_limit_slot = True
+            with self.lock:
+                self.in_flight += 1
+        return None
+
+    def reject(self, status_code, message, wait):
+        response = jsonify({"message": message})
+        response.status_code = status_code
+        response.headers["Retry-After"] = str(max(1, int(math.ceil(wait))))
+        return response
+
+    def after_request(self, response):
+        if "rate_limit_remaining" in g:
+            response.headers["X-RateLimit-Limit"] = str(int(self.burst))
+            response.headers["X-RateLimit-Remaining"] = str(g.rate_limit_remaining)
+        return response
+
+    def teardown_request(self, error=None):
+        # runs even when the endpoint raised, the slot is always given back
+        if g.pop("rate_limit_slot", False):
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+
+    def stats(self):
+        values = {"rate_limit_rejected": self.rejected, "rate_limit_shed": self.shed,
+                  "rate_limit_in_flight": self.in_flight}
+        for name, value in self.backend.stats().items():
+            values["rate_limit_" + name] = value
+        return values
+
+
+rate_limiter = RateLimiter(bucket_backend(os.environ.get('RATE_LIMIT_URL', '')))
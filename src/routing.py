@@ -0,0 +1,165 @@
+import os
+import time
+import random
+import threading
+from flask import g, request, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm, text, event
+
+# Connection pool settings and read-replica routing.
+#
+# Pool (all optional, SQLAlchemy defaults otherwise):
+#   DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE (default 1800s),
+#   DB_POOL_PRE_PING (default 1: test each connection before using it)
+#
+# Replicas:
+#   DB_REPLICA_CONNECTION_STRINGS=postgresql://replica1/db,postgresql://replica2/db
+# GET/HEAD requests read from a healthy replica, everything else (writes, POST /token)
+# goes to the primary (DB_CONNECTION_STRING). Only SELECTs are sent to the replica:
+# the writes of a GET request (flushes, INSERT/UPDATE/DELETE statements, connections
+# asked for with session.connection()) go to the primary, and so does every statement
+# after them until the transaction ends, so it reads what it just wrote. After a client writes, its reads stay on
+# the primary for DB_REPLICA_STICKY_SECONDS so it always sees its own writes even
+# if the replica lags: the client is remembered in this process (by its token, or its
+# IP without one) and with a cookie for the other workers.
+
+REPLICA_BIND_PREFIX = "replica_"
+REPLICA_STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+REPLICA_HEALTH_INTERVAL = float(os.environ.get('DB_REPLICA_HEALTH_INTERVAL', 10))
+STICKY_COOKIE = "db_primary_until"
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def engine_options():
+    options = {
+        "pool_pre_ping": os.environ.get('DB_POOL_PRE_PING', '1') not in ('0', 'false'),
+        "pool_recycle": int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    # only QueuePool (PostgreSQL, MySQL) takes these, SQLite would reject them
+    for name, env in (("pool_size", "DB_POOL_SIZE"), ("max_overflow", "DB_MAX_OVERFLOW"), ("pool_timeout", "DB_POOL_TIMEOUT")):
+        if os.environ.get(env):
+            options[name] = int(os.environ[env])
+    return options
+
+def replica_binds():
+    urls = [url.strip() for url in os.environ.get('DB_REPLICA_CONNECTION_STRINGS', '').split(",") if url.strip()]
+    return {REPLICA_BIND_PREFIX + str(i): url for i, url in enumerate(urls)}
+
+
+class ReplicaRouter:
+
+    def __init__(self):
+        self.binds = []
+        self.healthy = {}     # bind -> True/False
+        self.checked_at = {}  # bind -> time of the last health check
+        self.sticky = {}      # client key -> primary-only until (time.time())
+        self.lock = threading.Lock()
+        self.reads = {"primary": 0}
+
+    def init_app(self, app, db):
+        self.db = db
+        self.binds = [bind for bind in (app.config.get('SQLALCHEMY_BINDS') or {}) if bind.startswith(REPLICA_BIND_PREFIX)]
+        for bind in self.binds:
+            self.reads[bind] = 0
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def client_key(self):
+        return request.headers.get("Authorization") or request.remote_addr
+
+    def is_sticky(self):
+        now = time.time()
+        try:
+            if float(request.cookies.get(STICKY_COOKIE, 0)) > now:
+                return True
+        except ValueError:
+            pass
+        return self.sticky.get(self.client_key(), 0) > now
+
+    def is_healthy(self, app, bind):
+        # "SELECT 1" at most every REPLICA_HEALTH_INTERVAL seconds per replica
+        now = time.monotonic()
+        if now - self.checked_at.get(bind, -REPLICA_HEALTH_INTERVAL) >= REPLICA_HEALTH_INTERVAL:
+            self.checked_at[bind] = now
+            try:
+                with self.db.get_engine(app, bind=bind).connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                self.healthy[bind] = True
+            except Exception:
+                self.healthy[bind] = False
+        return self.healthy.get(bind, False)
+
+    def pick(self, app):
+        # a random healthy replica, None for the primary
+        candidates = [bind for bind in self.binds if self.is_healthy(app, bind)]
+        return random.choice(candidates) if candidates else None
+
+    def before_request(self):
+        g.db_bind = None
+        if self.binds and request.method in READ_METHODS and not self.is_sticky():
+            g.db_bind = self.pick(self.db.get_app())
+        with self.lock:
+            self.reads[g.db_bind or "primary"] += 1
+
+    def after_request(self, response):
+        if self.binds and request.method not in READ_METHODS and response.status_code < 400:
+            until = time.time() + REPLICA_STICKY_SECONDS
+            with self.lock:
+                self.sticky[self.client_key()] = until
+                # forget the clients whose stickiness is over
+                if len(self.sticky) > 10000:
+                    now = time.time()
+                    self.sticky = {key: value for key, value in self.sticky.items() if value > now}
+            response.set_cookie(STICKY_COOKIE, str(until), max_age=int(REPLICA_STICKY_SECONDS) + 1, httponly=True)
+        return response
+
+    def current_bind(self):
+        if has_request_context():
+            return g.get("db_bind")
+        return None
+
+    def stats(self):
+        # pool usage of every engine + where the requests read from
+        values = {}
+        for bind in [None] + self.binds:
+            engine = self.db.get_engine(self.db.get_app(), bind=bind)
+            name = bind or "primary"
+            pool = engine.pool
+            for metric in ("size", "checkedin", "checkedout", "overflow"):
+                fn = getattr(pool, metric, None)
+                if fn is not None:
+                    values['db_pool_' + metric + '{db="' + name + '"}'] = fn()
+        for name, count in self.reads.items():
+            values['db_routed_requests_total{db="' + name + '"}'] = count
+        for bind in self.binds:
+            values['db_replica_healthy{db="' + bind + '"}'] = 1 if self.healthy.get(bind) else 0
+        return values
+
+
+router = ReplicaRouter()
+
+
+class RoutingSession(SignallingSession):
+
+    wrote = False   # this transaction wrote on the primary
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        bind = router.current_bind()
+        if bind is not None and not self.wrote:
+            if not self._flushing and getattr(clause, "is_select", False):
+                return get_state(self.app).db.get_engine(self.app, bind=bind)
+            self.wrote = True
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def transaction_end(session, transaction):
+    # commit/rollback: the next transaction may read from the replica again
+    if transaction.parent is None:
+        session.wrote = False
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
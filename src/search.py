@@ -0,0 +1,337 @@
+import os
+import re
+import heapq
+import bisect
+import threading
+from collections import Counter
+from itertools import chain
+from flask import current_app
+from models import Character, Planet
+from versions import table_versions
+from cache import LocalCache
+import logs
+
+# In-memory search over the names of characters and planets (GET /search):
+# - prefix matching: "sky" finds "Luke Skywalker", every word of the query must match
+# - fuzzy matching: a word with one typo ("tatoine") still matches (words of 4+ letters),
+#   when it matches fewer than SEARCH_TYPO_THRESHOLD documents without typos (1: only
+#   when it matches nothing, like Typesense's typo_tokens_threshold)
+# - facet counts and filters over Model.facet_fields (climate, terrain, gender, eye_color),
+#   comma separated values ("arid, temperate") count for each value
+#
+# One index per model and per worker, built from the database on the first request and
+# updated by the write endpoints (search.update(Model, ids) after the commit).
+# Writes made by other workers or by "flask load-data" are noticed with the table
+# versions (versions.py): if a table moved more than this worker's own writes, the next
+# search starts a rebuild in a background thread and the searches keep using the current
+# index until the new one is swapped in (a few seconds on a 200k catalog).
+#
+# A query costs about as much as the number of documents it matches (the facet counts
+# look at all of them). A word of the query matches at most SEARCH_MAX_EXPANSIONS
+# words of the index as a prefix (the first ones in alphabetical order, the word itself
+# first, like Elasticsearch's max_expansions): a 2-3 letter prefix of a big catalog
+# starts thousands of words, the response then says "approximate": true, its total and
+# facet counts only cover those words. Short prefixes are also the most repeated
+# (search as you type), so the last SEARCH_CACHE_SIZE responses are kept until the
+# index changes.
+
+TOKEN = re.compile(r"[a-z0-9]+")
+FUZZY_MIN_LENGTH = 4
+BUILD_CHUNK_SIZE = 10000
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 1000))
+SEARCH_MAX_EXPANSIONS = int(os.environ.get('SEARCH_MAX_EXPANSIONS', 50))
+SEARCH_TYPO_THRESHOLD = int(os.environ.get('SEARCH_TYPO_THRESHOLD', 1))
+
+def tokenize(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+def facet_values(value):
+    if value is None:
+        return []
+    return [v.strip() for v in str(value).split(",") if v.strip()]
+
+def deletes(token):
+    # the token without one of its letters: two words with one typo share one of these
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+class SearchIndex:
+
+    def __init__(self, model):
+        self.model = model
+        self.kind = model.__tablename__
+        self.lock = threading.RLock()
+        self.build_lock = threading.Lock()
+        self.version = None  # table version the index matches, None = (re)build on the next search
+        self.built = False   # False until the first build: there is no index to search meanwhile
+        self.rebuilding = None  # the background rebuild thread while it runs
+        self.loading = False # True while build() fills it: the tokens are sorted once at the end
+        self.generation = 0  # changes with every write, part of the cached responses keys
+        self.clear()
+
+    STATE = ("names", "doc_tokens", "doc_codes", "codes", "pairs", "postings", "sorted_tokens", "typos", "facets")
+
+    def clear(self):
+        self.names = {}         # id -> name
+        self.doc_tokens = {}    # id -> its tokens
+        self.doc_codes = []     # id -> codes of its (field, value) pairs, a list: the facet counts read it per matched id
+        self.codes = {}         # (field, value) -> code
+        self.pairs = []         # code -> (field, value)
+        self.postings = {}      # token -> set of ids
+        self.sorted_tokens = [] # for the prefix lookups (bisect)
+        self.typos = {}         # token minus one letter -> set of tokens
+        self.facets = {field: {} for field in self.model.facet_fields}  # field -> value -> set of ids
+
+    ### writes
+
+    def add(self, id, name, facets):
+        # facets: {field: raw column value}
+        if id in self.names:
+            self.remove(id)
+        self.generation += 1
+        tokens = tuple(set(tokenize(name)))
+        self.names[id] = name
+        self.doc_tokens[id] = tokens
+        for token in tokens:
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = set()
+                if not self.loading:
+                    bisect.insort(self.sorted_tokens, token)
+                if len(token) >= FUZZY_MIN_LENGTH and token.isalpha():
+                    for variant in deletes(token):
+                        self.typos.setdefault(variant, set()).add(token)
+            ids.add(id)
+        codes = []
+        for field, raw in facets.items():
+            for value in facet_values(raw):
+                self.facets[field].setdefault(value, set()).add(id)
+                code = self.codes.get((field, value))
+                if code is None:
+                    code = self.codes[(field, value)] = len(self.pairs)
+                    self.pairs.append((field, value))
+                codes.append(code)
+        if id >= len(self.doc_codes):
+            self.doc_codes.extend([()] * (id + 1 - len(self.doc_codes)))
+        self.doc_codes[id] = tuple(codes)
+
+    def remove(self, id):
+        if id not in self.names:
+            return
+        self.generation += 1
+        del self.names[id]
+        for token in self.doc_tokens.pop(id):
+            ids = self.postings[token]
+            ids.discard(id)
+            if not ids:
+                del self.postings[token]
+                del self.sorted_tokens[bisect.bisect_left(self.sorted_tokens, token)]
+                if len(token) >= FUZZY_MIN_LENGTH and token.isalpha():
+                    for variant in deletes(token):
+                        tokens = self.typos[variant]
+                        tokens.discard(token)
+                        if not tokens:
+                            del self.typos[variant]
+        codes, self.doc_codes[id] = self.doc_codes[id], ()
+        for field, value in map(self.pairs.__getitem__, codes):
+            ids = self.facets[field][value]
+            ids.discard(id)
+            if not ids:
+                del self.facets[field][value]
+
+    def rows(self, ids=None):
+        model = self.model
+        columns = [model.id, model.name] + [getattr(model, f) for f in model.facet_fields]
+        query = model.query.with_entities(*columns)
+        if ids is not None:
+            query = query.filter(model.id.in_(ids))
+        return query.order_by(model.id).yield_per(BUILD_CHUNK_SIZE)
+
+    def add_row(self, row):
+        self.add(row[0], row[1], dict(zip(self.model.facet_fields, row[2:])))
+
+    def build(self):
+        # a new index is filled next to this one and swapped in, searches keep using the old one meanwhile
+        version = table_versions.get(self.model)
+        fresh = SearchIndex(self.model)
+        fresh.loading = True
+        for row in self.rows():
+            fresh.add_row(row)
+        fresh.sorted_tokens = sorted(fresh.postings)
+        with self.lock:
+            for name in self.STATE:
+                setattr(self, name, getattr(fresh, name))
+            self.version = version
+            self.built = True
+            self.generation += 1
+        logs.info("Search index built", model=self.kind, count=len(self.names), version=version)
+
+    def update(self, ids):
+        # after the commit of a write endpoint: reindex these rows (the deleted ones are removed)
+        if self.version is None:
+            return  # not built yet, or out of date: the next (re)build has the changes
+        # the queries run before taking the lock, searches do not wait for the database
+        ids = list(ids)
+        rows = list(self.rows(ids))
+        version = table_versions.get(self.model)
+        with self.lock:
+            if self.version is None:
+                return
+            found = set()
+            for row in rows:
+                self.add_row(row)
+                found.add(row[0])
+            for id in ids:
+                if id not in found:
+                    self.remove(id)
+            # the endpoint bumped the table version once: more than that is someone else's write
+            self.version = version if version == self.version + 1 else None
+
+    def is_stale(self):
+        return self.version is None or table_versions.get(self.model) != self.version
+
+    def ensure_fresh(self):
+        if not self.built:
+            with self.build_lock:
+                if not self.built:  # another thread may have just built it
+                    self.build()
+        elif self.is_stale():
+            self.rebuild_in_background()
+
+    def rebuild_in_background(self):
+        with self.lock:
+            if self.rebuilding is not None:
+                return
+            self.rebuilding = threading.Thread(target=self.rebuild, args=(current_app._get_current_object(),),
+                                               name="search-rebuild-" + self.kind, daemon=True)
+        self.rebuilding.start()
+
+    def rebuild(self, app):
+        try:
+            with app.app_context():
+                with self.build_lock:
+                    if self.is_stale():
+                        self.build()
+        except Exception:
+            logs.error("Search index not rebuilt, it will be on the next search", model=self.kind)
+        finally:
+            self.rebuilding = None
+
+    ### reads
+
+    def token_ids(self, word, fuzzy):
+        # -> (ids where a token is exactly the word, ids where a token starts with it or is one typo away,
+        #     True when the word starts more than SEARCH_MAX_EXPANSIONS tokens)
+        exact = self.postings.get(word, set())
+        matches = []
+        tokens = self.sorted_tokens
+        i = bisect.bisect_left(tokens, word)
+        end = min(i + SEARCH_MAX_EXPANSIONS, len(tokens))
+        while i < end and tokens[i].startswith(word):
+            matches.append(self.postings[tokens[i]])
+            i += 1
+        truncated = i == end and i < len(tokens) and tokens[i].startswith(word)
+        matched = set().union(*matches) if matches else set()
+        if fuzzy and len(matched) < SEARCH_TYPO_THRESHOLD and len(word) >= FUZZY_MIN_LENGTH and word.isalpha():
+            similar = set(self.typos.get(word, ()))  # a letter missing in the query
+            for variant in deletes(word):
+                if len(variant) >= FUZZY_MIN_LENGTH and variant in self.postings:   # an extra letter in the query
+                    similar.add(variant)
+                similar.update(self.typos.get(variant, ()))  # a wrong letter
+            matched = matched.union(*[self.postings[token] for token in similar])
+        return exact, matched, truncated
+
+    def search(self, words, filters, limit, fuzzy):
+        # -> (total, [(rank, id)], {field: {value: count}}, approximate)
+        with self.lock:
+            exact = None    # None = every document
+            matched = None
+            approximate = False
+            for word in words:
+                word_exact, word_matched, truncated = self.token_ids(word, fuzzy)
+                approximate = approximate or truncated
+                exact = word_exact if exact is None else exact & word_exact
+                matched = word_matched if matched is None else matched & word_matched
+            for field, value in filters.items():
+                ids = self.facets[field].get(value, set())
+                exact = ids if exact is None else exact & ids
+                matched = ids if matched is None else matched & ids
+
+            if matched is None:
+                hits = heapq.nsmallest(limit, self.names)
+                return len(self.names), [(0, id) for id in hits], self.facet_counts(None), False
+            # the documents where every word is a whole word come first
+            first = heapq.nsmallest(limit, exact)
+            rest = heapq.nsmallest(limit - len(first), matched - exact) if len(first) < limit else []
+            hits = [(0, id) for id in first] + [(1, id) for id in rest]
+            return len(matched), hits, self.facet_counts(matched), approximate
+
+    def facet_counts(self, matched):
+        if matched is None:
+            return {field: {value: len(ids) for value, ids in values.items()} for field, values in self.facets.items()}
+        # the codes of the matched documents counted in one pass (cheaper than intersecting
+        # every facet value with them)
+        counts = {field: {} for field in self.facets}
+        for code, count in Counter(chain.from_iterable(map(self.doc_codes.__getitem__, matched))).items():
+            field, value = self.pairs[code]
+            counts[field][value] = count
+        return counts
+
+
+class SearchIndexes:
+
+    def __init__(self, models):
+        self.indexes = {model.__tablename__: SearchIndex(model) for model in models}
+        self.responses = LocalCache(max_size=SEARCH_CACHE_SIZE, ttl=3600)
+
+    def get(self, kind):
+        return self.indexes[kind]
+
+    def update(self, model, ids):
+        if model.__tablename__ in self.indexes:
+            self.indexes[model.__tablename__].update(ids)
+
+    def build_all(self):
+        for index in self.indexes.values():
+            index.ensure_fresh()
+
+    def search(self, query, kinds, filters, limit, fuzzy=True):
+        words = tokenize(query)
+        for kind in kinds:
+            self.indexes[kind].ensure_fresh()
+        key = repr((words, kinds, sorted(filters.items()), limit, fuzzy, [self.indexes[kind].generation for kind in kinds]))
+        response = self.responses.get(key)
+        if response is None:
+            response = self.run(words, kinds, filters, limit, fuzzy)
+            self.responses.set(key, response)
+        return response
+
+    def run(self, words, kinds, filters, limit, fuzzy):
+        total = 0
+        hits = []
+        facets = {}
+        approximate = False
+        for kind in kinds:
+            index = self.indexes[kind]
+            # a filter on a field the model does not have excludes the model
+            if any(field not in index.facets for field in filters):
+                continue
+            count, index_hits, index_facets, index_approximate = index.search(words, filters, limit, fuzzy)
+            total += count
+            approximate = approximate or index_approximate
+            hits.extend((rank, kind, id, index.names[id]) for rank, id in index_hits)
+            facets.update(index_facets)
+        hits.sort(key=lambda hit: hit[0])  # stable: by rank, then characters before planets, by id
+        results = [{"type": kind, "id": id, "name": name} for rank, kind, id, name in hits[:limit]]
+        response = {"total": total, "results": results, "facets": facets}
+        if approximate:
+            response["approximate"] = True
+        return response
+
+    def stats(self):
+        values = {'search_index_documents{model="' + kind + '"}': len(index.names) for kind, index in self.indexes.items()}
+        values.update({"search_cache_" + name: value for name, value in self.responses.stats().items()})
+        return values
+
+
+search = SearchIndexes([Character, Planet])
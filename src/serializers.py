@@ -0,0 +1,75 @@
+import json
+from functools import lru_cache
+from flask.json import JSONEncoder
+
+# Fast serialization for the list endpoints:
+# - row_serializer(model, fields) builds ONCE per model/fieldset a function that turns a
+#   Core result row (a tuple, no ORM object is created) into a dict,
+#   e.g. lambda row: {"id": row[0], "name": row[1]}
+# - JSON is encoded with orjson when it is installed (several times faster than the
+#   json module), with a fallback to the standard json module
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+@lru_cache(maxsize=None)
+def row_serializer(model_name, fields):
+    # fields is a tuple, the row columns are in the same order (see select_columns)
+    body = ", ".join("%r: row[%d]" % (field, index) for index, field in enumerate(fields))
+    source = "def serialize_%s(row):\n    return {%s}\n" % (model_name, body)
+    namespace = {}
+    exec(source, namespace)
+    return namespace["serialize_" + model_name]
+
+def select_columns(model, fields):
+    # the requested fields first (in order, for row_serializer) then "id" for the cursor
+    columns = [getattr(model, f) for f in fields]
+    if "id" not in fields:
+        columns.append(model.id)
+    return columns
+
+def serialize_rows(model, fields, rows):
+    serialize = row_serializer(model.__tablename__, tuple(fields))
+    return [serialize(row) for row in rows]
+
+
+def dumps(value, sort_keys=False):
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode("utf-8")
+    return json.dumps(value, sort_keys=sort_keys)
+
+
+class FastJSONEncoder(JSONEncoder):
+    # Flask 1.x: app.json_encoder, used by jsonify()
+
+    def encode(self, o):
+        # orjson only does compact output, pretty printing (debug mode) goes through json
+        if orjson is None or self.indent is not None:
+            return JSONEncoder.encode(self, o)
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        try:
+            return orjson.dumps(o, default=self.default, option=option).decode("utf-8")
+        except TypeError:
+            return JSONEncoder.encode(self, o)
+
+
+def init_json(app):
+    try:
+        from flask.json.provider import DefaultJSONProvider
+    except ImportError:
+        app.json_encoder = FastJSONEncoder
+        return
+
+    # Flask >= 2.2 replaced json_encoder by JSON providers
+    class FastJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            if orjson is None or kwargs.get("indent") is not None:
+                return DefaultJSONProvider.dumps(self, obj, **kwargs)
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+            return orjson.dumps(obj, default=DefaultJSONProvider.default, option=option).decode("utf-8")
+
+    app.json_provider_class = FastJSONProvider
+    app.json = FastJSONProvider(app)
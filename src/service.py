@@ -1,45 +1,80 @@
-from models import db, User, Character, Planet, Favorite
-
-# to print with colors in the console
-class bcolors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKCYAN = '\033[96m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
+from models import db, Character, Planet, Favorite
+from utils import APIException
+from cache import model_cache, favorites_cache
+from versions import table_versions
+from identity import identity_cache
 
 class Service:
 
-    def get_favorite_per_type(fav):
+    def resolve_favorites(favorites):
 
-        print(bcolors.WARNING + str(fav) + bcolors.ENDC)
+        # the characters and planets were loaded together with the favorites (joinedload),
+        # keep the original favorite order
+        return [fav.item.serialize() if fav.item is not None else None for fav in favorites]
 
-        if fav.item_type == "planet":
-            planet = Planet.query.get(fav.item_id)
-            return planet.serialize()
-        if fav.item_type == "character":
-            character = Character.query.get(fav.item_id)
-            return character.serialize()
-        return None
+    def favorites_stamp():
+        # the cached favorites lists are valid while no character, planet or favorite changed,
+        # in any worker (the favorite version moves with every favorite write)
+        return [table_versions.get(Character), table_versions.get(Planet), table_versions.get(Favorite)]
+
+    def only_own_write(before, after):
+        # the favorite version moved by one (this request's write) and nothing else changed
+        return after[:2] == before[:2] and after[2] == before[2] + 1
 
     def get_favorites(user_id):
-        
-        #Verify that user exits
-        user = User.query.get(user_id)
-        if user is None:
-            raise APIException('User not found', status_code=404)
+
+        #the usual read: the user's list is in the cache (see cache.FavoritesCache)
+        stamp = Service.favorites_stamp()
+        items = favorites_cache.get(user_id, stamp)
+        if items is not None:
+            return [item for favorite_id, item in items]
 
         #search favorites from the user
         #all_favorites = Favorite.query.all()
-        all_favorites = Favorite.query.filter_by(user_id=user_id).all()
+        #ONE query: the favorites LEFT JOIN their character and planet
+        all_favorites = Favorite.query.filter_by(user_id=user_id) \
+            .options(db.joinedload(Favorite.character), db.joinedload(Favorite.planet)) \
+            .order_by(Favorite.id).all()
+
+        #Verify that user exits (a user with favorites exists, the foreign key says so),
+        #the identity cache already has it: the token of this request was checked against it
+        if not all_favorites and identity_cache.get(user_id) is None:
+            raise APIException('User not found', status_code=404)
 
-        #turn ids into planet_id or character_id
-        all_favorites = list(map(lambda x: Service.get_favorite_per_type(x), all_favorites)) 
+        #turn favorites into planets and characters, and keep them for the next reads
+        resolved = Service.resolve_favorites(all_favorites)
+        favorites_cache.set(user_id, stamp, [[fav.id, item] for fav, item in zip(all_favorites, resolved)])
 
         #return entire list (planets and characters)
-        return all_favorites
-    
+        return resolved
+
+    def favorite_added(favorite, before):
+        # after the commit of POST /favorite: the new item goes at the end of the cached list,
+        # which is stamped with the new versions if this write was the only change since `before`
+        after = Service.favorites_stamp()
+        if not Service.only_own_write(before, after):
+            return  # the next read rebuilds it
+        model = Character if favorite.item_type == "character" else Planet
+        item = model_cache.get(model, favorite.item_id)
+        favorites_cache.add(favorite.user_id, before, after, favorite.id, item)
+
+    def favorite_deleted(user_id, favorite_id, before):
+        after = Service.favorites_stamp()
+        if Service.only_own_write(before, after):
+            favorites_cache.remove(user_id, before, after, favorite_id)
+
+    def favorite_owners(items):
+        # the users of the favorites in a bulk request (ids or objects with an "id"),
+        # their lists must be rebuilt after the change
+        owners = set()
+        ids = [item.get("id") if isinstance(item, dict) else item for item in items]
+        ids = [id for id in ids if isinstance(id, int) and not isinstance(id, bool)]
+        for start in range(0, len(ids), 500):
+            rows = db.session.query(Favorite.user_id).filter(Favorite.id.in_(ids[start:start + 500])).distinct()
+            owners.update(row.user_id for row in rows)
+        return owners
+
+    def invalidate_favorites(user_ids):
+        for user_id in user_ids:
+            if user_id is not None:
+                favorites_cache.invalidate(user_id)
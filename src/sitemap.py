@@ -0,0 +1,163 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from flask import request, Response
+from werkzeug.routing import IntegerConverter, FloatConverter
+from models import db
+from utils import sitemap_html
+from serializers import dumps
+
+# The root page, the route list and a cheap health check:
+#   GET /               the HTML sitemap
+#   GET /routes         the same routes as JSON: path, methods, endpoint, auth
+#   GET /openapi.json   an OpenAPI 3 document of the routes
+#   GET /healthz        "SELECT 1" on a pooled connection, no model and no session
+# The routes are read once, after create_app() registered everything, and every document
+# is rendered once and served as the same bytes with an ETag (304 for If-None-Match):
+# load balancers and curious clients hitting / no longer walk the url_map each time.
+
+HEALTHZ_CACHE_SECONDS = float(os.environ.get('HEALTHZ_CACHE_SECONDS', 1.0))
+HIDDEN_PREFIXES = ("/admin", "/static")
+SKIPPED_METHODS = ("HEAD", "OPTIONS")
+PARAMETER = re.compile(r"<(?:[^:<>]+:)?([^<>]+)>")
+
+
+def requires_token(view):
+    # identity.jwt_required() marks its wrapper, flask_jwt_extended's own decorator has no
+    # marker: it is recognized by its code (functools.wraps keeps the chain in __wrapped__)
+    while view is not None:
+        if getattr(view, "requires_token", False):
+            return True
+        code = getattr(view, "__code__", None)
+        if code is not None and "flask_jwt_extended" in code.co_filename:
+            return True
+        view = getattr(view, "__wrapped__", None)
+    return False
+
+def parameter_type(converter):
+    if isinstance(converter, IntegerConverter):
+        return "integer"
+    if isinstance(converter, FloatConverter):
+        return "number"
+    return "string"
+
+def route_metadata(app):
+    routes = []
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith(HIDDEN_PREFIXES):
+            continue
+        view = app.view_functions[rule.endpoint]
+        routes.append({
+            "path": rule.rule,
+            "methods": sorted(method for method in rule.methods if method not in SKIPPED_METHODS),
+            "endpoint": rule.endpoint,
+            "auth": requires_token(view),
+            "parameters": {name: parameter_type(converter) for name, converter in rule._converters.items()},
+        })
+    routes.sort(key=lambda route: (route["path"], route["methods"]))
+    return routes
+
+def openapi_document(routes):
+    paths = {}
+    for route in routes:
+        path = PARAMETER.sub(r"{\1}", route["path"])
+        for method in route["methods"]:
+            operation = {
+                "operationId": route["endpoint"].rsplit(".", 1)[-1] + ("" if len(route["methods"]) == 1 else "_" + method.lower()),
+                "responses": {"200": {"description": "OK"}},
+            }
+            if route["parameters"]:
+                operation["parameters"] = [{"name": name, "in": "path", "required": True, "schema": {"type": type}}
+                                           for name, type in route["parameters"].items()]
+            if route["auth"]:
+                operation["security"] = [{"bearerAuth": []}]
+                operation["responses"]["401"] = {"description": "Missing or invalid token"}
+            paths.setdefault(path, {})[method.lower()] = operation
+    return {
+        "openapi": "3.0.3",
+        "info": {"title": "Star Wars API", "version": "1.0.0"},
+        "paths": paths,
+        "components": {"securitySchemes": {"bearerAuth": {"type": "http", "scheme": "bearer", "bearerFormat": "JWT"}}},
+    }
+
+
+class Sitemap:
+
+    def __init__(self, app):
+        self.app = app
+        self.routes = route_metadata(app)
+        self.has_admin = "admin" in app.blueprints
+        self.documents = {}   # (name, script root) -> (body, mimetype, etag)
+        self.health = None    # (checked at, status code, body)
+        self.lock = threading.Lock()
+
+    def render(self, name):
+        if name == "html":
+            # the links are the GET routes that need no parameter
+            links = ["/admin/"] if self.has_admin else []
+            links += [request.script_root + route["path"] for route in self.routes
+                      if "GET" in route["methods"] and not route["parameters"]]
+            return sitemap_html(links), "text/html"
+        if name == "routes":
+            return dumps(self.routes), "application/json"
+        return dumps(openapi_document(self.routes)), "application/json"
+
+    def document(self, name):
+        key = (name, request.script_root)
+        cached = self.documents.get(key)
+        if cached is None:
+            body, mimetype = self.render(name)
+            body = body.encode("utf-8")
+            cached = self.documents[key] = (body, mimetype, hashlib.md5(body).hexdigest())
+        body, mimetype, etag = cached
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    def check_database(self):
+        # a connection from the pool (pre-ping on), "SELECT 1" and the pool counters,
+        # at most once every HEALTHZ_CACHE_SECONDS whatever the number of probes
+        with self.lock:
+            if self.health is not None and time.monotonic() - self.health[0] < HEALTHZ_CACHE_SECONDS:
+                return self.health[1], self.health[2]
+            engine = db.get_engine(self.app)
+            started = time.perf_counter()
+            try:
+                with engine.connect() as connection:
+                    connection.exec_driver_sql("SELECT 1")
+                status, body = 200, {"status": "ok", "database": "ok"}
+            except Exception as error:
+                status, body = 503, {"status": "error", "database": type(error).__name__}
+            body["database_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            body["pool"] = engine.pool.status()
+            self.health = (time.monotonic(), status, body)
+            return status, body
+
+
+def init_sitemap(app):
+    # call it last in create_app(), the routes registered after it would not be listed
+    @app.route('/', methods=['GET'])
+    def root():
+        return sitemap.document("html")
+
+    @app.route('/routes', methods=['GET'])
+    def routes():
+        return sitemap.document("routes")
+
+    @app.route('/openapi.json', methods=['GET'])
+    def openapi():
+        return sitemap.document("openapi")
+
+    @app.route('/healthz', methods=['GET'])
+    def healthz():
+        status, body = sitemap.check_database()
+        response = Response(dumps(body), status=status, mimetype="application/json")
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    # read the routes now that the four above are there too
+    sitemap = Sitemap(app)
+    app.extensions["sitemap"] = sitemap
+    return sitemap
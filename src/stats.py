@@ -0,0 +1,70 @@
+from sqlalchemy import func, select, case, cast, Integer
+from models import db
+from utils import APIException, parse_int_arg, filter_conditions
+
+# GET /character/stats and /planet/stats: for each numeric field the number of rows with
+# a value, how many are "unknown" (NULL), min, max, average and a histogram.
+# Everything is computed by the database: one query for the aggregates of all the
+# fields and one GROUP BY per histogram, no row is loaded in Python.
+# They take the same filters as the list endpoints (?climate=arid&population_gt=1000).
+#   ?fields=population,diameter   only these fields (all the numeric fields by default)
+#   ?bins=20                      histogram buckets (0 for no histogram)
+
+HISTOGRAM_BINS = 10
+MAX_HISTOGRAM_BINS = 100
+
+
+def parse_stats_fields(model, args):
+    fields = args.get("fields", None)
+    if not fields:
+        return list(model.numeric_fields)
+    fields = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in model.numeric_fields]
+    if unknown:
+        raise APIException("Not numeric fields: " + ", ".join(unknown) + " (numeric fields: " + ", ".join(model.numeric_fields) + ")", status_code=400)
+    return fields
+
+def as_number(value):
+    # PostgreSQL returns Decimal for AVG() of integers
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return float(value)
+
+
+def histogram(column, conditions, low, high, bins):
+    # bucket number = (value - min) * bins / (max - min), the max goes in the last bucket
+    if high == low:
+        bucket = cast(0, Integer)
+        width = 0.0
+    else:
+        width = (high - low) / bins
+        bucket = case((column >= high, bins - 1), else_=cast((column - low) * (1.0 / width), Integer))
+    query = select(bucket.label("bucket"), func.count()).where(column.isnot(None), *conditions).group_by(bucket)
+    counts = dict(db.session.execute(query).all())
+    buckets = 1 if high == low else bins
+    return [{"from": low + i * width, "to": low + (i + 1) * width if i < buckets - 1 else high, "count": counts.get(i, 0)}
+            for i in range(buckets)]
+
+def numeric_stats(model, args):
+    fields = parse_stats_fields(model, args)
+    bins = parse_int_arg(args, "bins", HISTOGRAM_BINS)
+    if bins < 0 or bins > MAX_HISTOGRAM_BINS:
+        raise APIException("'bins' must be between 0 and " + str(MAX_HISTOGRAM_BINS), status_code=400)
+    conditions = filter_conditions(model, args, model.filter_fields)
+
+    columns = [getattr(model, name) for name in fields]
+    aggregates = [func.count()]
+    for column in columns:
+        aggregates += [func.count(column), func.min(column), func.max(column), func.avg(column)]
+    row = db.session.execute(select(*aggregates).select_from(model.__table__).where(*conditions)).one()
+
+    total = row[0]
+    result = {"count": total, "fields": {}}
+    for i, (name, column) in enumerate(zip(fields, columns)):
+        count, low, high, average = row[1 + 4 * i:5 + 4 * i]
+        low, high = as_number(low), as_number(high)
+        stats = {"count": count, "unknown": total - count, "min": low, "max": high, "avg": as_number(average)}
+        if bins and count:
+            stats["histogram"] = histogram(column, conditions, low, high, bins)
+        result["fields"][name] = stats
+    return result
@@ -1,4 +1,6 @@
-from flask import jsonify, url_for
+import math
+from flask import jsonify, url_for, request, Response, stream_with_context
+from serializers import select_columns, row_serializer, serialize_rows, dumps
 
 class APIException(Exception):
     status_code = 400
@@ -15,21 +17,8 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
-def has_no_empty_params(rule):
-    defaults = rule.defaults if rule.defaults is not None else ()
-    arguments = rule.arguments if rule.arguments is not None else ()
-    return len(defaults) >= len(arguments)
-
-def generate_sitemap(app):
-    links = ['/admin/']
-    for rule in app.url_map.iter_rules():
-        # Filter out rules we can't navigate to in a browser
-        # and rules that require parameters
-        if "GET" in rule.methods and has_no_empty_params(rule):
-            url = url_for(rule.endpoint, **(rule.defaults or {}))
-            if "/admin/" not in url:
-                links.append(url)
-
+# GET / serves this page rendered once (see sitemap.py)
+def sitemap_html(links):
     links_html = "".join(["<li><a href='" + y + "'>" + y + "</a></li>" for y in links])
     return """
         <div style="text-align: center;">
@@ -39,3 +28,149 @@ def generate_sitemap(app):
         <p>Start working on your proyect by following the <a href="https://github.com/4GeeksAcademy/flask-rest-hello/blob/master/docs/_QUICK_START.md" target="_blank">Quick Start</a></p>
         <p>Remember to specify a real endpoint path like: </p>
         <ul style="text-align: left;">"""+links_html+"</ul></div>"
+
+# Keyset (cursor) pagination for the list endpoints
+MAX_PAGE_SIZE = 1000
+
+def parse_int_arg(args, name, default=None):
+    value = args.get(name, None)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise APIException("'" + name + "' must be an integer", status_code=400)
+
+def parse_fields_arg(args, public_fields):
+    # ?fields=name,id -> only those columns are selected and serialized
+    fields = args.get("fields", None)
+    if not fields:
+        return list(public_fields)
+    fields = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in public_fields]
+    if unknown:
+        raise APIException("Unknown fields: " + ", ".join(unknown), status_code=400)
+    return fields
+
+def build_list_query(model, args, public_fields, filter_fields):
+    fields = parse_fields_arg(args, public_fields)
+    limit = parse_int_arg(args, "limit")
+    after = parse_int_arg(args, "after")
+    if limit is not None and (limit < 1 or limit > MAX_PAGE_SIZE):
+        raise APIException("'limit' must be between 1 and " + str(MAX_PAGE_SIZE), status_code=400)
+
+    # "id" is always selected because it is the cursor
+    query = model.query.with_entities(*select_columns(model, fields)).order_by(model.id)
+    if after is not None:
+        query = query.filter(model.id > after)
+    for condition in filter_conditions(model, args, filter_fields):
+        query = query.filter(condition)
+    return query, fields, limit
+
+# range filters on the model numeric_fields:
+#   ?population_gt=1000  _gte, _lt, _lte    ?height_between=150,200 (both included)
+#   ?height=172 exact value, ?height=unknown the rows without a value
+RANGE_OPERATORS = ("gt", "gte", "lt", "lte", "between")
+
+def filter_conditions(model, args, filter_fields):
+    conditions = []
+    for name in filter_fields:
+        if name in args:
+            if name in getattr(model, "multi_value_fields", ()):
+                # "tundra, ice caves" columns: looked up in the attribute tables (see models.py)
+                conditions.append(model.has_values(name, args[name]))
+            else:
+                conditions.append(getattr(model, name) == args[name])
+    for name in getattr(model, "numeric_fields", ()):
+        column = getattr(model, name)
+        if name in args:
+            value = model.parse_field(name, args[name])
+            conditions.append(column.is_(None) if value is None else column == value)
+        for operator in RANGE_OPERATORS:
+            key = name + "_" + operator
+            if key not in args:
+                continue
+            if operator == "between":
+                bounds = args[key].split(",")
+                if len(bounds) != 2:
+                    raise APIException("'" + key + "' must be two numbers: min,max", status_code=400)
+                low, high = [parse_bound(key, bound) for bound in bounds]
+                conditions.append(column.between(low, high))
+                continue
+            value = parse_bound(key, args[key])
+            if operator == "gt":
+                conditions.append(column > value)
+            elif operator == "gte":
+                conditions.append(column >= value)
+            elif operator == "lt":
+                conditions.append(column < value)
+            else:
+                conditions.append(column <= value)
+    return conditions
+
+def parse_bound(key, raw):
+    # bounds are floats, population_gt=1.5e9 works on the integer column too
+    try:
+        value = float(raw)
+    except ValueError:
+        raise APIException("'" + key + "' must be a number", status_code=400)
+    if math.isnan(value) or math.isinf(value):
+        raise APIException("'" + key + "' must be a number", status_code=400)
+    return value
+
+def paginate_list(model, args, public_fields, filter_fields):
+    query, fields, limit = build_list_query(model, args, public_fields, filter_fields)
+
+    # ask for one extra row to know if there is a next page
+    rows = query.limit(limit + 1).all() if limit is not None else query.all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+
+    return serialize_rows(model, fields, rows), next_cursor
+
+# Streaming mode for big exports: rows are fetched in chunks with yield_per()
+# and written one by one, so the whole table is never held in memory
+STREAM_CHUNK_SIZE = 1000
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+def wants_stream():
+    if request.args.get("stream", None) in ("1", "true"):
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+def stream_list(model, args, public_fields, filter_fields):
+    query, fields, limit = build_list_query(model, args, public_fields, filter_fields)
+    if limit is not None:
+        query = query.limit(limit)
+    ndjson = request.accept_mimetypes.best == NDJSON_MIMETYPE
+    serialize = row_serializer(model.__tablename__, tuple(fields))
+
+    def generate():
+        if not ndjson:
+            yield "["
+        first = True
+        for row in query.yield_per(STREAM_CHUNK_SIZE):
+            line = dumps(serialize(row))
+            if ndjson:
+                yield line + "\n"
+            else:
+                yield line if first else "," + line
+            first = False
+        if not ndjson:
+            yield "]"
+
+    # stream_with_context keeps the app context (and the db session) alive while the generator runs
+    mimetype = NDJSON_MIMETYPE if ndjson else "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+def list_response(items, next_cursor):
+    # the body stays a plain JSON array, the cursor travels in the headers
+    response = jsonify(items)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+        args = request.args.to_dict()
+        args["after"] = next_cursor
+        response.headers["Link"] = "<" + url_for(request.endpoint, _external=True, **args) + '>; rel="next"'
+    return response
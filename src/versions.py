@@ -0,0 +1,82 @@
+import os
+import time
+import hashlib
+import threading
+from functools import wraps
+from flask import request, make_response
+from sqlalchemy.exc import IntegrityError
+from models import db, TableVersion
+
+# Per-table version counters behind the ETags of the GET endpoints.
+# Every write endpoint calls table_versions.bump(Model) before its commit, so the
+# new version is stored in the same transaction as the data it describes.
+# Reading the versions is one small SELECT of the whole table_version table,
+# done at most once every VERSION_CHECK_INTERVAL seconds per worker, so checking
+# an If-None-Match is cheaper than a single primary key query.
+
+class VersionRegistry:
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self.versions = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        rows = db.session.query(TableVersion.name, TableVersion.version).all()
+        self.versions = {row.name: row.version for row in rows}
+        self.loaded_at = time.monotonic()
+
+    def get(self, model):
+        with self.lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at > self.check_interval:
+                self.refresh()
+            return self.versions.get(model.__tablename__, 0)
+
+    def increment(self, name):
+        table = TableVersion.__table__
+        return db.session.execute(table.update().where(table.c.name == name).values(version=table.c.version + 1)).rowcount
+
+    def bump(self, model):
+        # call it BEFORE db.session.commit(), the caller's commit stores the new version
+        name = model.__tablename__
+        if self.increment(name) == 0:
+            # no row yet (the migrations seed them, db.create_all() does not). Another worker
+            # may insert it at the same time: the savepoint keeps the caller's transaction
+            # alive when its insert wins, and the row is incremented instead
+            try:
+                with db.session.begin_nested():
+                    db.session.add(TableVersion(name=name, version=1))
+            except IntegrityError:
+                self.increment(name)
+        # read-your-writes: this worker reloads the versions on its next GET
+        self.loaded_at = None
+
+
+table_versions = VersionRegistry(check_interval=float(os.environ.get('VERSION_CHECK_INTERVAL', 1.0)))
+
+
+def make_etag(model):
+    # same table version + same url + same response format => same body
+    version = table_versions.get(model)
+    key = request.full_path + "|" + str(request.accept_mimetypes.best)
+    digest = hashlib.md5(key.encode("utf-8")).hexdigest()[:16]
+    return model.__tablename__ + "-" + str(version) + "-" + digest
+
+def versioned(model):
+    # decorator for GET endpoints: answers 304 before the endpoint runs any ORM query
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            etag = make_etag(model)
+            # weak comparison: compression.py sends this ETag as W/"..." with a compressed body
+            if request.if_none_match.contains_weak(etag):
+                response = make_response("", 304)
+                response.set_etag(etag)
+                return response
+            response = make_response(fn(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
@@ -1,7 +1,10 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
-from main import app as application
+from main import create_app
+
+# APP_ROLE=api|admin|all picks what the workers load (see main.py)
+application = create_app()
 
 if __name__ == "__main__":
     application.run()
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import pytest
+
+# The modules of src/ read their settings when they are imported, so they are set first.
+# Every test starts with empty tables in this SQLite file (see the app fixture).
+DATA_DIR = tempfile.mkdtemp(prefix="api-tests-")
+os.environ["DB_CONNECTION_STRING"] = "sqlite:///" + os.path.join(DATA_DIR, "primary.sqlite")
+os.environ["TOKEN_KEY"] = "test-token-key"
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+os.environ["VERSION_CHECK_INTERVAL"] = "0"       # the writes of "other workers" are seen at once
+os.environ["PASSWORD_HASH_ITERATIONS"] = "1000"
+os.environ["LOG_LEVEL"] = "WARNING"
+
+from main import create_app
+from models import db
+from loader import load_seed_data
+from cache import model_cache, favorites_cache
+from identity import identity_cache, revoked_tokens
+from versions import table_versions
+from search import search
+from compression import compressor
+
+
+def reset_caches():
+    # the caches are module globals, shared by every app built in this process
+    for cache in (model_cache, favorites_cache, identity_cache):
+        cache.backend.clear()
+    compressor.cache.clear()
+    revoked_tokens.jtis = frozenset()
+    revoked_tokens.stamp = None
+    table_versions.loaded_at = None
+    # the search indexes of the previous test's database: built again on the first search
+    for index in search.indexes.values():
+        index.clear()
+        index.version = None
+        index.built = False
+    search.responses.clear()
+
+def make_app(role="api"):
+    app = create_app(role)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    reset_caches()
+    return app
+
+def auth(token):
+    return {"Authorization": "Bearer " + token}
+
+
+@pytest.fixture
+def app():
+    app = make_app()
+    yield app
+    with app.app_context():
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def seeded(app):
+    # the sample users, characters and planets of /populate
+    with app.app_context():
+        load_seed_data()
+    return app
+
+@pytest.fixture
+def token(client, seeded):
+    response = client.post("/token", json={"email": "user01@example.com", "password": "01"})
+    return response.json["access_token"]
@@ -0,0 +1,54 @@
+import pytest
+from conftest import make_app, auth
+from models import db
+from loader import load_seed_data
+
+
+@pytest.fixture
+def admin_client():
+    # the "all" role: the endpoints and /admin/ in the same app
+    app = make_app("all")
+    with app.app_context():
+        load_seed_data()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+
+def planet_form(**changes):
+    fields = {"name": "Tatooine", "population": "200000", "terrain": "desert", "diameter": "10465.0",
+              "climate": "arid", "rotation_period": "23.0", "item_type": "planet"}
+    return dict(fields, **changes)
+
+
+def test_admin_planet_edit_changes_etag_and_search(admin_client):
+    assert admin_client.get("/search?q=tatooine").json["results"]
+    etag = admin_client.get("/planet/1").headers["ETag"]
+
+    response = admin_client.post("/admin/planet/edit/?id=1", data=planet_form(name="Jakku"))
+    assert response.status_code == 302
+
+    response = admin_client.get("/planet/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["name"] == "Jakku"
+    assert [result["name"] for result in admin_client.get("/search?q=jakku").json["results"]] == ["Jakku"]
+    assert not admin_client.get("/search?q=tatooine&fuzzy=0").json["results"]
+
+def test_admin_planet_delete_refreshes_favorites(admin_client):
+    token = admin_client.post("/token", json={"email": "user01@example.com", "password": "01"}).json["access_token"]
+    admin_client.post("/favorite", json={"item_id": 1, "item_type": "planet", "user_id": 1}, headers=auth(token))
+    assert len(admin_client.get("/favorite", headers=auth(token)).json) == 1
+
+    assert admin_client.post("/admin/planet/delete/", data={"id": "1"}).status_code == 302
+
+    assert admin_client.get("/favorite", headers=auth(token)).json == []
+    assert admin_client.get("/planet/1").status_code == 404
+
+def test_admin_favorite_delete_refreshes_list(admin_client):
+    token = admin_client.post("/token", json={"email": "user01@example.com", "password": "01"}).json["access_token"]
+    admin_client.post("/favorite", json={"item_id": 2, "item_type": "planet", "user_id": 1}, headers=auth(token))
+    assert len(admin_client.get("/favorite", headers=auth(token)).json) == 1
+    favorite_id = admin_client.get("/favorite_raw", headers=auth(token)).json[0]["id"]
+
+    assert admin_client.post("/admin/favorite/delete/", data={"id": str(favorite_id)}).status_code == 302
+
+    assert admin_client.get("/favorite", headers=auth(token)).json == []
@@ -0,0 +1,76 @@
+from sqlalchemy import select
+from models import db, Attribute, Character, Planet
+
+
+def links(app, model, id):
+    # the (kind, value) rows linked to this character/planet
+    link = model.attribute_table
+    owner_id = link.c[model.__tablename__ + "_id"]
+    with app.app_context():
+        query = select(Attribute.kind, Attribute.value).join(link, link.c.attribute_id == Attribute.id) \
+            .where(owner_id == id).order_by(Attribute.kind, Attribute.value)
+        return [tuple(row) for row in db.session.execute(query)]
+
+def names(client, url):
+    return [item["name"] for item in client.get(url).json]
+
+def new_planet(name, terrain, climate="temperate"):
+    return {"name": name, "terrain": terrain, "climate": climate, "item_type": "planet",
+            "population": 1000, "diameter": 1000, "rotation_period": 24}
+
+
+def test_planet_create_update_delete(client, seeded):
+    assert client.post("/planet", json=new_planet("Kamino", "Ocean, Cities")).status_code == 200
+    id = client.get("/planet?name=Kamino").json[0]["id"]
+    assert links(seeded, Planet, id) == [("climate", "temperate"), ("terrain", "cities"), ("terrain", "ocean")]
+    assert names(client, "/planet?terrain=ocean") == ["Kamino"]
+    assert names(client, "/planet?terrain=cities,ocean") == ["Kamino"]
+
+    assert client.put("/planet/" + str(id), json={"terrain": "swamp, ocean"}).status_code == 200
+    assert links(seeded, Planet, id) == [("climate", "temperate"), ("terrain", "ocean"), ("terrain", "swamp")]
+    assert names(client, "/planet?terrain=cities") == []
+    assert names(client, "/planet?terrain=swamp") == ["Dagobah", "Kamino"]
+
+    # a write to the other columns keeps the links
+    assert client.put("/planet/" + str(id), json={"name": "Kamino II"}).status_code == 200
+    assert names(client, "/planet?terrain=ocean") == ["Kamino II"]
+
+    assert client.delete("/planet/" + str(id)).status_code == 200
+    assert links(seeded, Planet, id) == []
+    assert names(client, "/planet?terrain=ocean") == []
+    assert names(client, "/planet?terrain=swamp") == ["Dagobah"]
+
+
+def test_character_create_update_delete(client, seeded):
+    character = {"name": "Jango Fett", "birth_year": "66BBY", "gender": "male", "height": 183,
+                 "eye_color": "brown", "hair_color": "Black, Grey", "skin_color": "tan", "item_type": "character"}
+    assert client.post("/character", json=character).status_code == 200
+    id = client.get("/character?name=Jango Fett").json[0]["id"]
+    assert links(seeded, Character, id) == [("hair_color", "black"), ("hair_color", "grey"), ("skin_color", "tan")]
+    assert names(client, "/character?hair_color=grey") == ["Owen Lars", "Jango Fett"]
+
+    assert client.put("/character/" + str(id), json={"hair_color": "black", "skin_color": "Tan, Scarred"}).status_code == 200
+    assert links(seeded, Character, id) == [("hair_color", "black"), ("skin_color", "scarred"), ("skin_color", "tan")]
+    assert names(client, "/character?hair_color=grey") == ["Owen Lars"]
+    assert names(client, "/character?skin_color=scarred") == ["Jango Fett"]
+
+    assert client.delete("/character/" + str(id)).status_code == 200
+    assert links(seeded, Character, id) == []
+    assert names(client, "/character?skin_color=scarred") == []
+
+
+def test_bulk_writes(client, seeded):
+    response = client.post("/planet/bulk", json=[new_planet("Kamino", "ocean"), new_planet("Mustafar", "volcanoes", "hot")])
+    assert [result["status"] for result in response.json] == ["created", "created"]
+    ids = [planet["id"] for planet in client.get("/planet?terrain=ocean").json + client.get("/planet?terrain=volcanoes").json]
+    assert names(client, "/planet?climate=hot") == ["Mustafar"]
+
+    response = client.patch("/planet/bulk", json=[{"id": ids[0], "terrain": "ocean, cities"}, {"id": ids[1], "climate": "hot, arid"}])
+    assert [result["status"] for result in response.json] == ["updated", "updated"]
+    assert links(seeded, Planet, ids[0]) == [("climate", "temperate"), ("terrain", "cities"), ("terrain", "ocean")]
+    assert names(client, "/planet?climate=arid") == ["Tatooine", "Mustafar"]
+
+    response = client.delete("/planet/bulk", json=ids)
+    assert [result["status"] for result in response.json] == ["deleted", "deleted"]
+    assert links(seeded, Planet, ids[0]) == links(seeded, Planet, ids[1]) == []
+    assert names(client, "/planet?terrain=cities") == []
@@ -0,0 +1,58 @@
+from conftest import auth
+from models import db, Character, Favorite
+from loader import load_records
+
+
+def test_bulk_create_partial_failure(client, seeded):
+    items = [
+        {"name": "Han Solo", "birth_year": "29BBY", "gender": "male", "height": "180", "eye_color": "brown",
+         "hair_color": "brown", "skin_color": "fair", "item_type": "character"},
+        {"name": "Chewbacca"},                                                          # missing fields
+        {"name": "Luke Skywalker", "birth_year": "19BBY", "gender": "male", "height": "172", "eye_color": "blue",
+         "hair_color": "blond", "skin_color": "fair", "item_type": "character"},        # name already exists
+        {"name": "Yoda", "birth_year": "896BBY", "gender": "male", "height": "tall", "eye_color": "brown",
+         "hair_color": "white", "skin_color": "green", "item_type": "character"},      # not a number
+    ]
+    response = client.post("/character/bulk", json=items)
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json] == ["created", "error", "error", "error"]
+    with client.application.app_context():
+        assert Character.query.filter_by(name="Han Solo").count() == 1
+        assert Character.query.count() == 7
+
+def test_bulk_favorites_with_missing_items(client, token):
+    items = [
+        {"item_id": 1, "item_type": "planet", "user_id": 1},
+        {"item_id": 999, "item_type": "planet", "user_id": 1},
+        {"item_id": "2", "item_type": "character", "user_id": 1},
+        {"item_id": 2, "item_type": "character", "user_id": 999},
+    ]
+    response = client.post("/favorite/bulk", json=items, headers=auth(token))
+    assert response.status_code == 200
+    results = response.json
+    assert [result["status"] for result in results] == ["created", "error", "created", "error"]
+    assert results[1]["error"] == "not_found" and "planet_id" in results[1]["message"]
+    assert results[3]["error"] == "not_found" and "user_id" in results[3]["message"]
+    assert [item["name"] for item in client.get("/favorite", headers=auth(token)).json] == ["Tatooine", "C-3PO"]
+
+def test_bulk_update_favorite_to_missing_item(client, token):
+    client.post("/favorite", json={"item_id": 1, "item_type": "planet", "user_id": 1}, headers=auth(token))
+    favorite_id = client.get("/favorite_raw", headers=auth(token)).json[0]["id"]
+    response = client.patch("/favorite/bulk", json=[{"id": favorite_id, "item_id": 999, "item_type": "planet"}],
+                            headers=auth(token))
+    assert response.status_code == 200
+    assert response.json[0]["error"] == "not_found"
+
+def test_bulk_delete_reports_missing_ids(client, seeded):
+    response = client.delete("/planet/bulk", json=[1, 999, "x"])
+    assert [result["status"] for result in response.json] == ["deleted", "not_found", "error"]
+
+def test_load_favorites_skips_dangling_items(app, seeded):
+    records = [{"user_id": 1, "item_type": "planet", "item_id": 1},
+               {"user_id": 1, "item_type": "planet", "item_id": 999},
+               {"user_id": 2, "item_type": "character", "item_id": 3}]
+    with app.app_context():
+        loaded, invalid, errors = load_records(Favorite, records)
+        assert (loaded, invalid) == (2, 1)
+        assert errors[0][0] == 1
+        assert db.session.query(Favorite).count() == 2
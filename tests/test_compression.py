@@ -0,0 +1,110 @@
+import gzip
+import json
+import compression
+
+
+def get(client, url, encoding="gzip", **headers):
+    headers["Accept-Encoding"] = encoding
+    return client.get(url, headers=headers)
+
+def fake_br(data, cached):
+    return b"br:" + data
+
+def fake_br_stream(chunks):
+    for chunk in chunks:
+        yield b"br:" + chunk
+
+
+def test_gzip_body_has_a_weak_etag(monkeypatch, client, seeded):
+    monkeypatch.setattr(compression, "COMPRESS_MIN_SIZE", 100)
+    plain = get(client, "/character", encoding="identity")
+    response = get(client, "/character")
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.get_data()) == plain.get_data()
+    # same ETag, weak: the bytes on the wire are not the ones it was made for
+    assert response.headers["ETag"] == "W/" + plain.headers["ETag"]
+
+
+def test_client_preference_picks_the_encoding(monkeypatch, client, seeded):
+    monkeypatch.setattr(compression, "COMPRESS_MIN_SIZE", 100)
+    monkeypatch.setitem(compression.CODECS, "br", (fake_br, fake_br_stream))
+    plain = get(client, "/character", encoding="identity").get_data()
+
+    response = get(client, "/character", encoding="gzip;q=0.5, br")
+    assert response.headers["Content-Encoding"] == "br"
+    assert response.get_data() == b"br:" + plain
+
+    response = get(client, "/character", encoding="br;q=0.1, gzip")
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+def test_no_accepted_encoding_sends_the_body_as_it_is(monkeypatch, client, seeded):
+    monkeypatch.setattr(compression, "COMPRESS_MIN_SIZE", 100)
+    for encoding in ("identity", "deflate", ""):
+        response = get(client, "/character", encoding=encoding)
+        assert "Content-Encoding" not in response.headers
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert not response.headers["ETag"].startswith("W/")
+        assert len(response.json) > 0
+
+
+def test_small_bodies_are_not_compressed(client, seeded):
+    response = get(client, "/character?limit=1")
+    assert len(response.get_data()) < compression.COMPRESS_MIN_SIZE
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_streamed_list_is_compressed_while_it_is_sent(client, seeded):
+    plain = get(client, "/character?stream=1", encoding="identity")
+    response = get(client, "/character?stream=1")
+
+    # the size is unknown before the generator runs: compressed even under COMPRESS_MIN_SIZE
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert response.headers["ETag"] == "W/" + plain.headers["ETag"]
+    assert gzip.decompress(response.get_data()) == plain.get_data()
+    assert len(json.loads(plain.get_data())) > 0
+
+
+def test_ndjson_stream_is_compressed_line_by_line(client, seeded):
+    plain = get(client, "/planet", encoding="identity", Accept="application/x-ndjson")
+    response = get(client, "/planet", Accept="application/x-ndjson")
+
+    assert response.mimetype == "application/x-ndjson"
+    assert response.headers["Content-Encoding"] == "gzip"
+    lines = gzip.decompress(response.get_data()).decode("utf-8").splitlines()
+    assert lines == plain.get_data(as_text=True).splitlines()
+    assert [json.loads(line)["name"] for line in lines][0] == "Tatooine"
+
+
+def test_weak_etag_still_answers_304(monkeypatch, client, seeded):
+    monkeypatch.setattr(compression, "COMPRESS_MIN_SIZE", 100)
+    etag = get(client, "/character").headers["ETag"]
+    assert etag.startswith("W/")
+
+    response = get(client, "/character", **{"If-None-Match": etag})
+    assert response.status_code == 304
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data() == b""
+    # the strong form, sent by a client that did not ask for gzip, matches too
+    response = get(client, "/character", encoding="identity", **{"If-None-Match": etag[2:]})
+    assert response.status_code == 304
+
+
+def test_compressed_body_is_reused_for_the_same_etag(monkeypatch, client, seeded):
+    monkeypatch.setattr(compression, "COMPRESS_MIN_SIZE", 100)
+    hits = compression.compressor.counts["cache_hits"]
+    first = get(client, "/character").get_data()
+    second = get(client, "/character").get_data()
+    assert first == second
+    assert compression.compressor.counts["cache_hits"] == hits + 1
+
+
+def test_head_requests_are_not_compressed(monkeypatch, client, seeded):
+    monkeypatch.setattr(compression, "COMPRESS_MIN_SIZE", 100)
+    response = client.head("/character", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
@@ -0,0 +1,48 @@
+from conftest import auth
+from test_versions import write_from_another_worker
+from cache import favorites_cache
+from service import Service
+
+
+def names(client, token):
+    response = client.get("/favorite", headers=auth(token))
+    assert response.status_code == 200
+    return [item["name"] for item in response.json]
+
+def add(client, token, item_type, item_id):
+    body = {"item_id": item_id, "item_type": item_type, "user_id": 1}
+    return client.post("/favorite", json=body, headers=auth(token))
+
+
+def test_favorite_added_by_another_worker(client, token):
+    assert add(client, token, "planet", 1).status_code == 200
+    assert names(client, token) == ["Tatooine"]
+
+    write_from_another_worker("INSERT INTO favorite (item_type, character_id, user_id) VALUES ('character', 1, 1)", "favorite")
+    assert names(client, token) == ["Tatooine", "Luke Skywalker"]
+
+def test_favorite_deleted_by_another_worker(client, token):
+    add(client, token, "planet", 1)
+    add(client, token, "character", 1)
+    assert names(client, token) == ["Tatooine", "Luke Skywalker"]
+
+    write_from_another_worker("DELETE FROM favorite WHERE item_type = 'planet'", "favorite")
+    assert names(client, token) == ["Luke Skywalker"]
+
+def test_own_writes_update_the_cached_list(app, client, token):
+    add(client, token, "planet", 1)
+    assert names(client, token) == ["Tatooine"]
+
+    # the list is updated and restamped in place, not rebuilt
+    add(client, token, "character", 1)
+    with app.app_context():
+        stamp = Service.favorites_stamp()
+    items = favorites_cache.get(1, stamp)
+    assert [item["name"] for favorite_id, item in items] == ["Tatooine", "Luke Skywalker"]
+
+    favorite_id = items[0][0]
+    assert client.delete("/favorite/%d" % favorite_id, headers=auth(token)).status_code == 200
+    with app.app_context():
+        stamp = Service.favorites_stamp()
+    assert [item["name"] for favorite_id, item in favorites_cache.get(1, stamp)] == ["Luke Skywalker"]
+    assert names(client, token) == ["Luke Skywalker"]
@@ -0,0 +1,32 @@
+from flask import jsonify
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from models import db
+
+
+def test_failed_statement_leaves_nothing_on_the_connection(app):
+    @app.route("/failing-query")
+    def failing_query():
+        connection = db.session.connection()
+        try:
+            connection.execute(text("SELECT * FROM no_such_table"))
+        except OperationalError:
+            pass
+        connection.execute(text("SELECT 1"))
+        # the pooled connection is reused by the next requests: nothing may pile up on it
+        return jsonify(info=sorted(key for key in connection.info if key.startswith("query")))
+
+    client = app.test_client()
+    for _ in range(3):
+        response = client.get("/failing-query")
+        assert response.json == {"info": []}
+        # only the statement that ran is counted
+        assert 'desc="1 queries"' in response.headers["Server-Timing"]
+
+
+def test_queries_are_counted_per_request(client, seeded):
+    response = client.get("/planet/1")
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    assert 'desc="0 queries"' not in timing
+    assert "db;dur=" in timing and "total;dur=" in timing
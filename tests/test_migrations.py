@@ -0,0 +1,93 @@
+import os
+import pytest
+from flask_migrate import upgrade, downgrade
+from sqlalchemy import text
+from main import create_app
+from models import db
+from conftest import reset_caches
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "migrations")
+FIRST_REVISION = "c721b4c13110"   # the schema of the original starter
+
+LEGACY_ROWS = [
+    "INSERT INTO user (id, username, email, password, is_active) VALUES (1, 'luke', 'luke@example.com', 'plain-1', 1)",
+    "INSERT INTO user (id, username, email, password, is_active) VALUES (2, 'leia', 'leia@example.com', 'plain-2', 1)",
+    "INSERT INTO character (id, name, birth_year, gender, height, eye_color, hair_color, skin_color, item_type)"
+    " VALUES (1, 'Owen Lars', '52BBY', 'male', 178, 'blue', 'Brown, Grey', 'light', 'character')",
+    "INSERT INTO planet (id, name, population, terrain, diameter, climate, rotation_period, item_type)"
+    " VALUES (1, 'Hoth', 5000, 'tundra, ice caves, mountain ranges', 7200, 'frozen', 23, 'planet')",
+    # user 1: the planet twice (duplicate), the character, a deleted planet (dangling)
+    "INSERT INTO favorite (id, item_id, item_type, user_id) VALUES (1, 1, 'planet', 1)",
+    "INSERT INTO favorite (id, item_id, item_type, user_id) VALUES (2, 1, 'planet', 1)",
+    "INSERT INTO favorite (id, item_id, item_type, user_id) VALUES (3, 1, 'character', 1)",
+    "INSERT INTO favorite (id, item_id, item_type, user_id) VALUES (4, 42, 'planet', 1)",
+    "INSERT INTO favorite (id, item_id, item_type, user_id) VALUES (5, 1, 'planet', 2)",
+]
+
+
+@pytest.fixture
+def legacy_app():
+    # an empty database migrated to the first revision and filled like an old deployment
+    app = create_app("all")
+    with app.app_context():
+        db.drop_all()
+        db.session.execute(text("DROP TABLE IF EXISTS alembic_version"))
+        db.session.commit()
+        upgrade(directory=MIGRATIONS, revision=FIRST_REVISION)
+        for statement in LEGACY_ROWS:
+            db.session.execute(text(statement))
+        db.session.commit()
+    reset_caches()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.session.execute(text("DROP TABLE IF EXISTS alembic_version"))
+        db.session.commit()
+
+
+def rows(statement):
+    return [tuple(row) for row in db.session.execute(text(statement)).fetchall()]
+
+
+def test_upgrade_migrates_legacy_data(legacy_app):
+    with legacy_app.app_context():
+        upgrade(directory=MIGRATIONS)
+        db.session.remove()
+
+        # duplicates keep the oldest row, the dangling favorite is gone, item_id became a foreign key
+        assert rows("SELECT id, item_type, character_id, planet_id, user_id FROM favorite ORDER BY id") == [
+            (1, "planet", None, 1, 1),
+            (3, "character", 1, None, 1),
+            (5, "planet", None, 1, 2),
+        ]
+        # passwords are hashed
+        assert all(password.startswith("pbkdf2:") for password, in rows("SELECT password FROM user"))
+        # the comma separated values are in the attribute tables
+        assert rows("SELECT a.kind, a.value FROM attribute a JOIN planet_attribute l ON l.attribute_id = a.id"
+                    " WHERE l.planet_id = 1 ORDER BY a.kind, a.value") == [
+            ("climate", "frozen"), ("terrain", "ice caves"), ("terrain", "mountain ranges"), ("terrain", "tundra"),
+        ]
+        # every versioned table has its row, table_versions.bump() never inserts one
+        assert rows("SELECT name FROM table_version ORDER BY name") == [
+            ("character",), ("favorite",), ("planet",), ("revoked_token",), ("user",),
+        ]
+
+    client = legacy_app.test_client()
+    response = client.post("/token", json={"email": "luke@example.com", "password": "plain-1"})
+    assert response.status_code == 200
+    headers = {"Authorization": "Bearer " + response.json["access_token"]}
+    assert [item["name"] for item in client.get("/favorite", headers=headers).json] == ["Hoth", "Owen Lars"]
+    assert [planet["name"] for planet in client.get("/planet?terrain=ice caves").json] == ["Hoth"]
+    assert [character["name"] for character in client.get("/character?hair_color=grey").json] == ["Owen Lars"]
+
+def test_downgrade_restores_item_id(legacy_app):
+    with legacy_app.app_context():
+        upgrade(directory=MIGRATIONS)
+        downgrade(directory=MIGRATIONS, revision="8d41e6a0f2b9")
+        db.session.remove()
+        assert rows("SELECT id, item_id, item_type, user_id FROM favorite ORDER BY id") == [
+            (1, 1, "planet", 1),
+            (3, 1, "character", 1),
+            (5, 1, "planet", 2),
+        ]
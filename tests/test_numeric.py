@@ -0,0 +1,99 @@
+import pytest
+from models import parse_number
+
+
+def add_planet(client, name, **values):
+    planet = {"name": name, "climate": "temperate", "terrain": "grasslands", "item_type": "planet",
+              "population": "unknown", "diameter": "unknown", "rotation_period": "unknown"}
+    planet.update(values)
+    return client.post("/planet", json=planet)
+
+def names(response):
+    assert response.status_code == 200
+    return [item["name"] for item in response.json]
+
+
+def test_parse_number():
+    assert parse_number("172.0", int, "height") == 172
+    assert parse_number("1,000,000", int, "population") == 1000000
+    assert parse_number(" 12.5 ", float, "diameter") == 12.5
+    for unknown in (None, "unknown", " Unknown ", "n/a", "none", ""):
+        assert parse_number(unknown, float, "height") is None
+    for bad in ("tall", "1.5", True, "nan", "inf", [1]):
+        with pytest.raises(ValueError):
+            parse_number(bad, int, "population")
+
+
+def test_unknown_values_are_stored_as_null(client, seeded):
+    assert add_planet(client, "Kamino", population="1,000,000,000", diameter="19720").status_code == 200
+    kamino = client.get("/planet?name=Kamino").json[0]
+    assert (kamino["population"], kamino["diameter"], kamino["rotation_period"]) == (1000000000, 19720.0, None)
+
+    assert client.put("/character/1", json={"height": "unknown"}).status_code == 200
+    assert client.get("/character/1").json["height"] is None
+
+    response = add_planet(client, "Exegol", population="lots")
+    assert response.status_code == 400
+    assert "'population' must be a number" in response.json["message"]
+
+
+def test_exact_and_unknown_filters(client, seeded):
+    add_planet(client, "Kamino")
+    assert names(client.get("/planet?population=unknown")) == ["Kamino"]
+    assert names(client.get("/planet?rotation_period=23")) == ["Tatooine", "Hoth", "Dagobah"]
+    assert client.get("/planet?population=many").status_code == 400
+
+
+def test_range_filters(client, seeded):
+    add_planet(client, "Kamino")    # NULL: never in a range
+    assert names(client.get("/planet?population_gt=5000")) == ["Tatooine", "Alderaan", "Dagobah", "Bespin"]
+    assert names(client.get("/planet?population_gte=5000")) == ["Tatooine", "Alderaan", "Hoth", "Dagobah", "Bespin"]
+    assert names(client.get("/planet?population_lt=5000")) == ["Yavin IV"]
+    assert names(client.get("/planet?population_lte=5000")) == ["Yavin IV", "Hoth"]
+    assert names(client.get("/planet?population_between=5000,200000")) == ["Tatooine", "Hoth", "Dagobah"]
+    # float bounds on the integer column, several ranges and the other filters together
+    assert names(client.get("/planet?population_gt=1.5e9")) == ["Alderaan"]
+    assert names(client.get("/planet?diameter_lt=11000&rotation_period_gte=24")) == ["Yavin IV"]
+    assert names(client.get("/character?height_between=150,172&gender=male")) == ["Luke Skywalker"]
+
+
+def test_bad_range_filters(client, seeded):
+    for url in ("/planet?population_gt=many", "/planet?diameter_lte=nan", "/planet?population_between=1",
+                "/planet?population_between=1,2,3", "/planet?population_between=1,x"):
+        assert client.get(url).status_code == 400
+
+
+def test_stats(client, seeded):
+    add_planet(client, "Kamino", population="unknown", diameter="19720")
+    stats = client.get("/planet/stats?bins=2").json
+    assert stats["count"] == 7
+    population = stats["fields"]["population"]
+    assert (population["count"], population["unknown"]) == (6, 1)
+    assert (population["min"], population["max"]) == (1000, 2000000000)
+    assert population["histogram"] == [
+        {"from": 1000.0, "to": 1000000500.0, "count": 5},
+        {"from": 1000000500.0, "to": 2000000000, "count": 1},
+    ]
+    # the max is in the last bucket, every known value is in one bucket
+    for field in stats["fields"].values():
+        assert sum(bucket["count"] for bucket in field["histogram"]) == field["count"]
+    assert stats["fields"]["rotation_period"]["avg"] == pytest.approx(21.5)
+
+
+def test_stats_arguments(client, seeded):
+    stats = client.get("/planet/stats?fields=rotation_period&bins=0&rotation_period_gte=23").json
+    assert list(stats["fields"]) == ["rotation_period"]
+    assert stats["count"] == 5
+    assert "histogram" not in stats["fields"]["rotation_period"]
+
+    # a single value: one bucket
+    stats = client.get("/planet/stats?fields=rotation_period&rotation_period=23").json
+    assert stats["fields"]["rotation_period"]["histogram"] == [{"from": 23.0, "to": 23.0, "count": 3}]
+
+    # no row with a value: no histogram
+    stats = client.get("/character/stats?height=unknown").json
+    assert stats["fields"]["height"] == {"count": 0, "unknown": 0, "min": None, "max": None, "avg": None}
+
+    assert client.get("/planet/stats?fields=name").status_code == 400
+    assert client.get("/planet/stats?bins=101").status_code == 400
+    assert client.get("/planet/stats?bins=-1").status_code == 400
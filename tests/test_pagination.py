@@ -0,0 +1,83 @@
+from urllib.parse import urlsplit
+from utils import MAX_PAGE_SIZE
+
+
+def next_link(response):
+    # '<http://localhost/planet?limit=2&after=2>; rel="next"' -> '/planet?limit=2&after=2'
+    link = response.headers.get("Link")
+    if link is None:
+        return None
+    url = urlsplit(link[1:link.index(">")])
+    return url.path + "?" + url.query
+
+
+def test_pages_follow_the_next_link(client, seeded):
+    everything = [planet["name"] for planet in client.get("/planet").json]
+    names = []
+    pages = 0
+    url = "/planet?limit=4&fields=name"
+    while url is not None:
+        response = client.get(url)
+        assert response.status_code == 200
+        names += [planet["name"] for planet in response.json]
+        pages += 1
+        url = next_link(response)
+    assert names == everything
+    assert pages == 2
+
+
+def test_cursor_boundaries(client, seeded):
+    response = client.get("/planet?limit=2")
+    assert [planet["id"] for planet in response.json] == [1, 2]
+    assert response.headers["X-Next-Cursor"] == "2"
+    assert next_link(response) == "/planet?limit=2&after=2"
+
+    # the cursor row itself is not repeated
+    assert [planet["id"] for planet in client.get("/planet?limit=2&after=2").json] == [3, 4]
+    # a last page exactly as long as the limit: no next page
+    response = client.get("/planet?limit=2&after=4")
+    assert [planet["id"] for planet in response.json] == [5, 6]
+    assert "X-Next-Cursor" not in response.headers
+    assert "Link" not in response.headers
+    # past the last row, or a deleted row as the cursor
+    assert client.get("/planet?limit=2&after=6").json == []
+    assert client.get("/planet?after=999").json == []
+    # without a limit the rest of the list is sent in one page
+    assert [planet["id"] for planet in client.get("/planet?after=3").json] == [4, 5, 6]
+
+
+def test_next_link_keeps_the_filters(client, seeded):
+    response = client.get("/character?limit=1&gender=male")
+    first = response.json[0]["id"]
+    assert next_link(response) == "/character?limit=1&gender=male&after=" + str(first)
+    for character in client.get(next_link(response)).json:
+        assert character["gender"] == "male"
+        assert character["id"] > first
+
+
+def test_bad_cursor_and_limit(client, seeded):
+    for url in ("/planet?after=abc", "/planet?after=2.5", "/planet?limit=ten"):
+        response = client.get(url)
+        assert response.status_code == 400
+        assert "must be an integer" in response.json["message"]
+
+    for limit in (0, -1, MAX_PAGE_SIZE + 1):
+        response = client.get("/planet?limit=" + str(limit))
+        assert response.status_code == 400
+        assert str(MAX_PAGE_SIZE) in response.json["message"]
+    assert client.get("/planet?limit=" + str(MAX_PAGE_SIZE)).status_code == 200
+
+
+def test_every_page_has_its_etag(client, seeded):
+    first = client.get("/planet?limit=2")
+    second = client.get(next_link(first))
+    assert first.headers["ETag"] != second.headers["ETag"]
+
+    # each page answers 304 to its own ETag only
+    assert client.get("/planet?limit=2", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert client.get(next_link(first), headers={"If-None-Match": second.headers["ETag"]}).status_code == 304
+    assert client.get(next_link(first), headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
+
+    # a write to the table changes the ETag of every page
+    assert client.put("/planet/6", json={"name": "Cloud City"}).status_code == 200
+    assert client.get("/planet?limit=2", headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
@@ -0,0 +1,32 @@
+from conftest import make_app
+from models import db, User
+from passwords import is_password_hash, hash_password
+
+
+def test_orm_write_stores_a_hash(app):
+    with app.app_context():
+        user = User(username="orm", email="orm@example.com", password="plain")
+        db.session.add(user)
+        db.session.commit()
+        assert is_password_hash(user.password)
+        # a hash (the endpoints hash in the password pool first) is kept as it is
+        stored = hash_password("other")
+        user.password = stored
+        db.session.commit()
+        assert user.password == stored
+
+def test_login_with_wrong_password(client, seeded):
+    assert client.post("/token", json={"email": "user01@example.com", "password": "01"}).status_code == 200
+    assert client.post("/token", json={"email": "user01@example.com", "password": "02"}).status_code == 401
+    assert client.post("/token", json={"email": "nobody@example.com", "password": "01"}).status_code == 401
+
+def test_user_created_in_admin_can_log_in():
+    app = make_app("all")
+    client = app.test_client()
+    response = client.post("/admin/user/new/", data={"username": "admin1", "email": "admin1@example.com",
+                                                    "password": "secret", "is_active": "y"})
+    assert response.status_code == 302
+    with app.app_context():
+        assert is_password_hash(User.query.filter_by(username="admin1").first().password)
+        db.session.remove()
+    assert client.post("/token", json={"email": "admin1@example.com", "password": "secret"}).status_code == 200
@@ -0,0 +1,97 @@
+import pytest
+from conftest import auth
+from ratelimit import RateLimiter, LocalBuckets, parse_costs, FULL_LIST_COST
+
+
+@pytest.fixture
+def limited(app):
+    # the tests run with RATE_LIMIT_ENABLED=0: each test installs its own limiter,
+    # refilling so slowly that nothing comes back during the test
+    def install(**settings):
+        settings.setdefault("rate", 0.001)
+        limiter = RateLimiter(LocalBuckets(), **settings)
+        limiter.init_app(app)
+        return limiter
+    return install
+
+
+def test_empty_bucket_answers_429(limited, client, seeded):
+    limiter = limited(burst=3)
+    remaining = []
+    for _ in range(3):
+        response = client.get("/planet/1")
+        assert response.status_code == 200
+        remaining.append(response.headers["X-RateLimit-Remaining"])
+    assert remaining == ["2", "1", "0"]
+    assert response.headers["X-RateLimit-Limit"] == "3"
+
+    response = client.get("/planet/1")
+    assert response.status_code == 429
+    assert response.json == {"message": "Too many requests"}
+    assert int(response.headers["Retry-After"]) >= 1
+    assert limiter.stats()["rate_limit_rejected"] == 1
+
+    # the metrics are never limited, another client has its own bucket
+    assert client.get("/metrics").status_code == 200
+    assert client.get("/planet/1", environ_base={"REMOTE_ADDR": "10.0.0.2"}).status_code == 200
+
+
+def test_token_owner_has_its_own_bucket(limited, client, token):
+    limited(burst=11)
+    # the /token of the token fixture came before the limiter
+    assert client.post("/token", json={"email": "user02@example.com", "password": "02"}).status_code == 200
+    assert client.get("/planet/1").status_code == 200
+    assert client.get("/planet/1").status_code == 429
+    # same IP, but the user of a valid token is counted on its own
+    assert client.get("/favorite", headers=auth(token)).status_code == 200
+
+
+def test_route_costs(limited, app):
+    limiter = limited(burst=100)
+    expected = {
+        "/planet/1": 1,
+        "/planet": FULL_LIST_COST,                 # the whole table
+        "/planet?limit=50": 1,
+        "/planet?limit=1000": 11,
+        "/planet?limit=5000": FULL_LIST_COST,
+        "/planet?limit=10&stream=1": FULL_LIST_COST,
+        "/planet/stats": 5,
+        "/search?q=hoth": 2,
+    }
+    for url, cost in expected.items():
+        with app.test_request_context(url):
+            assert limiter.cost() == cost, url
+    with app.test_request_context("/token", method="POST"):
+        assert limiter.cost() == 10
+
+    assert parse_costs("create_token=20, populate=100,bad") == {"create_token": 20.0, "populate": 100.0}
+
+
+def test_costly_routes_empty_the_bucket_sooner(limited, client, seeded):
+    limited(burst=25)
+    assert client.get("/planet").status_code == 200            # 20 tokens
+    assert client.get("/planet/stats").status_code == 200      # 5 tokens
+    assert client.get("/planet/1").status_code == 429
+
+def test_cost_over_the_burst_can_still_be_paid(limited, client, seeded):
+    limited(burst=10)
+    # a full list costs 20: it takes the whole bucket instead of never passing
+    assert client.get("/planet").status_code == 200
+    assert client.get("/planet?limit=1").status_code == 429
+
+
+def test_no_free_slot_answers_503(limited, client, seeded):
+    limiter = limited(burst=100, max_concurrent=1, queue_timeout=0.05)
+    # another request is running in this worker
+    assert limiter.slots.acquire(blocking=False)
+    response = client.get("/planet/1")
+    assert response.status_code == 503
+    assert response.json == {"message": "Server busy"}
+    assert response.headers["Retry-After"] == "1"
+    assert limiter.stats()["rate_limit_shed"] == 1
+    limiter.slots.release()
+
+    # the slot is given back after every request, also when the endpoint fails
+    assert client.get("/planet/999").status_code == 404
+    assert client.get("/planet/1").status_code == 200
+    assert limiter.stats()["rate_limit_in_flight"] == 0
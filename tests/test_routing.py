@@ -0,0 +1,83 @@
+import os
+import pytest
+from flask import jsonify
+from sqlalchemy import create_engine, text
+from conftest import DATA_DIR, make_app
+from models import db, Planet
+from loader import load_seed_data
+from versions import table_versions
+
+REPLICA_URL = "sqlite:///" + os.path.join(DATA_DIR, "replica.sqlite")
+
+
+def planet_names(url):
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        names = [name for name, in connection.execute(text("SELECT name FROM planet ORDER BY name"))]
+    engine.dispose()
+    return names
+
+def table_version(url, table):
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        version = connection.execute(text("SELECT version FROM table_version WHERE name = :name"), {"name": table}).scalar()
+    engine.dispose()
+    return version
+
+
+@pytest.fixture
+def routed_app(monkeypatch):
+    # a primary and a replica that does not replicate: what is read tells where it was read
+    monkeypatch.setenv("DB_REPLICA_CONNECTION_STRINGS", REPLICA_URL)
+    app = make_app()
+
+    # a GET endpoint that writes, like /populate
+    @app.route("/write-during-get")
+    def write_during_get():
+        table_versions.bump(Planet)
+        db.session.execute(Planet.__table__.insert().values(name="Core insert", terrain="rock", climate="arid", item_type="planet"))
+        db.session.add(Planet(name="ORM insert", terrain="rock", climate="arid", item_type="planet"))
+        db.session.flush()
+        written = Planet.query.filter(Planet.name.in_(["Core insert", "ORM insert"])).count()
+        db.session.commit()
+        after_commit = Planet.query.filter(Planet.name.in_(["Core insert", "ORM insert"])).count()
+        return jsonify(written=written, after_commit=after_commit)
+
+    with app.app_context():
+        replica = db.get_engine(app, bind="replica_0")
+        db.Model.metadata.drop_all(replica)
+        db.Model.metadata.create_all(replica)
+        load_seed_data()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.Model.metadata.drop_all(db.get_engine(app, bind="replica_0"))
+
+
+def test_get_reads_from_the_replica(routed_app):
+    client = routed_app.test_client()
+    assert client.get("/planet").json == []
+    assert planet_names(os.environ["DB_CONNECTION_STRING"]) != []
+
+
+def test_writes_of_a_get_go_to_the_primary(routed_app):
+    client = routed_app.test_client()
+    version = table_version(os.environ["DB_CONNECTION_STRING"], "planet")
+    response = client.get("/write-during-get")
+    # the statements after the writes read them on the primary, the next transaction reads the replica
+    assert response.json == {"written": 2, "after_commit": 0}
+    assert {"Core insert", "ORM insert"} <= set(planet_names(os.environ["DB_CONNECTION_STRING"]))
+    assert table_version(os.environ["DB_CONNECTION_STRING"], "planet") == version + 1
+    assert planet_names(REPLICA_URL) == []
+    assert table_version(REPLICA_URL, "planet") is None
+
+
+def test_populate_writes_to_the_primary(routed_app):
+    client = routed_app.test_client()
+    with routed_app.app_context():
+        db.drop_all()
+        db.create_all()
+    # still a GET for the existing clients: its writes go to the primary
+    assert client.get("/populate").status_code == 200
+    assert planet_names(os.environ["DB_CONNECTION_STRING"]) != []
+    assert planet_names(REPLICA_URL) == []
@@ -0,0 +1,78 @@
+import search as search_module
+from models import Planet
+from search import SearchIndex
+from test_versions import write_from_another_worker
+
+
+def planet_index(names):
+    index = SearchIndex(Planet)
+    for id, name in enumerate(names, 1):
+        index.add(id, name, {"climate": "arid", "terrain": "desert"})
+    return index
+
+
+def test_prefix_expansion_is_capped(monkeypatch):
+    monkeypatch.setattr(search_module, "SEARCH_MAX_EXPANSIONS", 3)
+    index = planet_index(["Kamino", "Kashyyyk", "Kessel", "Kef Bir", "Kalee", "Kamino Prime", "Kathol"])
+
+    total, hits, facets, approximate = index.search(["ka"], {}, 20, False)
+    # kalee, kamino, kashyyyk: the first three words in alphabetical order
+    assert approximate
+    assert total == 4
+    assert sorted(id for rank, id in hits) == [1, 2, 5, 6]
+    assert facets["climate"] == {"arid": 4}
+
+    # the word itself is always expanded first
+    total, hits, facets, approximate = index.search(["kamino"], {}, 20, False)
+    assert (total, approximate) == (2, False)
+    assert hits == [(0, 1), (0, 6)]
+
+
+def test_search_response_says_approximate(monkeypatch, client, seeded):
+    monkeypatch.setattr(search_module, "SEARCH_MAX_EXPANSIONS", 1)
+    # "d" starts d2, darth, ... and dagobah, dantooine: one word per index is counted
+    response = client.get("/search?q=d")
+    assert response.json["approximate"] is True
+    assert [result["name"] for result in response.json["results"]] == ["R2-D2", "Dagobah"]
+    assert "approximate" not in client.get("/search?q=dagobah").json
+
+
+def search_names(client, query):
+    return [result["name"] for result in client.get("/search?q=" + query).json["results"]]
+
+def test_bulk_created_rows_are_indexed_without_rebuild(app, client, seeded):
+    assert search_names(client, "kamino") == []
+    index = search_module.search.get("planet")
+    generation = index.generation
+    planets = [{"name": "Kamino", "climate": "temperate", "terrain": "ocean", "diameter": 19720,
+                "population": 1000000000, "rotation_period": 27, "item_type": "planet"}]
+    assert client.post("/planet/bulk", json=planets).status_code == 200
+    assert search_names(client, "kamino") == ["Kamino"]
+    # one document added (a rebuild moves the generation once per document)
+    assert index.generation == generation + 1
+    with app.app_context():
+        assert index.rebuilding is None and not index.is_stale()
+
+def test_write_from_another_worker_rebuilds_in_background(app, client, seeded):
+    assert search_names(client, "tatooine") == ["Tatooine"]
+    write_from_another_worker("UPDATE planet SET name = 'Jakku' WHERE name = 'Tatooine'", "planet")
+
+    # the current index answers while the new one is built
+    index = search_module.search.get("planet")
+    search_names(client, "jakku")
+    rebuilding = index.rebuilding
+    if rebuilding is not None:
+        rebuilding.join(10)
+    assert search_names(client, "jakku") == ["Jakku"]
+    assert search_names(client, "tatooine") == []
+    with app.app_context():
+        assert not index.is_stale()
+
+
+def test_typos_only_when_nothing_matches():
+    index = planet_index(["Kamino", "Kamina"])
+    # "kamino" matches: its one-typo neighbour "kamina" is not looked up
+    assert index.search(["kamino"], {}, 20, True)[1] == [(0, 1)]
+    assert index.search(["kamin"], {}, 20, True)[1] == [(1, 1), (1, 2)]
+    # no word starts with "kamine": both are one typo away
+    assert index.search(["kamine"], {}, 20, True)[1] == [(1, 1), (1, 2)]
@@ -0,0 +1,51 @@
+import json
+
+NDJSON = {"Accept": "application/x-ndjson"}
+
+
+def test_ndjson_is_one_object_per_line(client, seeded):
+    everything = client.get("/planet").json
+    response = client.get("/planet", headers=NDJSON)
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    body = response.get_data(as_text=True)
+    assert body.endswith("\n")
+    assert [json.loads(line) for line in body.splitlines()] == everything
+    assert response.headers["ETag"] != client.get("/planet").headers["ETag"]
+
+
+def test_stream_param_sends_a_json_array(client, seeded):
+    everything = client.get("/character").json
+    response = client.get("/character?stream=1")
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    assert json.loads(response.get_data()) == everything
+
+
+def test_stream_takes_the_list_arguments(client, seeded):
+    response = client.get("/planet?fields=name&limit=2&after=1", headers=NDJSON)
+    assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == [
+        {"name": "Alderaan"}, {"name": "Yavin IV"},
+    ]
+    response = client.get("/character?stream=1&fields=name&gender=female")
+    assert json.loads(response.get_data()) == [{"name": "Leia Organa"}]
+
+    # bad arguments are answered before the stream starts
+    response = client.get("/planet?limit=0", headers=NDJSON)
+    assert response.status_code == 400
+    assert response.mimetype == "application/json"
+
+
+def test_empty_stream(client, seeded):
+    assert client.get("/planet?stream=1&after=999").get_data() == b"[]"
+    response = client.get("/planet?after=999", headers=NDJSON)
+    assert response.mimetype == "application/x-ndjson"
+    assert response.get_data() == b""
+
+
+def test_json_preferred_over_ndjson_is_a_plain_list(client, seeded):
+    response = client.get("/planet", headers={"Accept": "application/json, application/x-ndjson;q=0.5"})
+    assert response.mimetype == "application/json"
+    assert response.json == client.get("/planet").json
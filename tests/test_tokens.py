@@ -0,0 +1,76 @@
+import json
+import asyncio
+import pytest
+from flask_jwt_extended import create_refresh_token
+from conftest import auth
+from models import db, User
+from versions import table_versions
+import asgi
+
+
+def asgi_get(path, headers):
+    # one request to the Starlette app, without an HTTP client
+    async def run():
+        messages = []
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+            "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            "client": ("127.0.0.1", 5000), "server": ("testserver", 80),
+        }
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+        async def send(message):
+            messages.append(message)
+        await asgi.app(scope, receive, send)
+        await asgi.engine.dispose()   # its connections belong to this event loop
+        return messages
+    messages = asyncio.run(run())
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return messages[0]["status"], json.loads(body)
+
+def wsgi_get(client, path, headers):
+    response = client.get(path, headers=headers)
+    return response.status_code, response.json
+
+PATHS = [pytest.param(wsgi_get, id="wsgi"), pytest.param(None, id="asgi")]
+
+def get(how, client, headers):
+    if how is None:
+        return asgi_get("/favorite", headers)
+    return how(client, "/favorite", headers)
+
+
+@pytest.mark.parametrize("how", PATHS)
+def test_access_token_works(how, client, token):
+    status, body = get(how, client, auth(token))
+    assert status == 200
+    assert isinstance(body, list)
+
+@pytest.mark.parametrize("how", PATHS)
+def test_missing_token(how, client, seeded):
+    assert get(how, client, {})[0] == 401
+
+@pytest.mark.parametrize("how", PATHS)
+def test_revoked_token(how, client, token):
+    assert client.delete("/token", headers=auth(token)).status_code == 200
+    status, body = get(how, client, auth(token))
+    assert (status, body["msg"]) == (401, "Token has been revoked")
+
+@pytest.mark.parametrize("how", PATHS)
+def test_refresh_token_is_rejected(how, app, client, seeded):
+    with app.app_context():
+        refresh_token = create_refresh_token(identity=1)
+    status, body = get(how, client, auth(refresh_token))
+    assert (status, body["msg"]) == (422, "Only non-refresh tokens are allowed")
+
+@pytest.mark.parametrize("how", PATHS)
+def test_inactive_user(how, app, client, token):
+    with app.app_context():
+        user = User.query.filter_by(email="user01@example.com").first()
+        user.is_active = False
+        table_versions.bump(User)
+        db.session.commit()
+    status, body = get(how, client, auth(token))
+    assert status == 401
+    assert body["msg"].startswith("Error loading the user")
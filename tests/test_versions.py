@@ -0,0 +1,60 @@
+import os
+from sqlalchemy import create_engine, text
+from models import db, RevokedToken
+from versions import table_versions
+
+
+def write_from_another_worker(statement, table):
+    # another gunicorn worker: its own connection, the caches of this process know nothing
+    engine = create_engine(os.environ["DB_CONNECTION_STRING"])
+    with engine.begin() as connection:
+        connection.execute(text(statement))
+        connection.execute(text("UPDATE table_version SET version = version + 1 WHERE name = :name"), {"name": table})
+    engine.dispose()
+
+
+def test_etag_and_304(client, seeded):
+    response = client.get("/planet")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert client.get("/planet", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/planet?limit=2", headers={"If-None-Match": etag}).status_code == 200
+
+def test_write_changes_etag(client, seeded):
+    etag = client.get("/character/1").headers["ETag"]
+    assert client.put("/character/1", json={"name": "Luke"}).status_code == 200
+    response = client.get("/character/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["name"] == "Luke"
+
+def test_detail_after_write_from_another_worker(client, seeded):
+    first = client.get("/planet/1")
+    etag = first.headers["ETag"]
+    assert first.json["name"] == "Tatooine"
+    assert client.get("/planet/1", headers={"If-None-Match": etag}).status_code == 304
+
+    write_from_another_worker("UPDATE planet SET name = 'Tatooine II' WHERE id = 1", "planet")
+
+    # the cached body of this worker is not served under the new ETag
+    second = client.get("/planet/1", headers={"If-None-Match": etag})
+    assert second.status_code == 200
+    assert second.json["name"] == "Tatooine II"
+    assert second.headers["ETag"] != etag
+    assert client.get("/planet/1", headers={"If-None-Match": second.headers["ETag"]}).status_code == 304
+    assert client.get("/planet/1").json["name"] == "Tatooine II"
+
+def test_first_bump_races_another_worker(monkeypatch, app):
+    increment = table_versions.increment
+
+    def row_missing_then_inserted(name):
+        # our UPDATE found no row, then another worker inserted it before our INSERT
+        write_from_another_worker("INSERT INTO table_version (name, version) VALUES ('revoked_token', 0)", "revoked_token")
+        monkeypatch.setattr(table_versions, "increment", increment)
+        return 0
+
+    with app.app_context():
+        monkeypatch.setattr(table_versions, "increment", row_missing_then_inserted)
+        table_versions.bump(RevokedToken)
+        db.session.commit()
+        # the other worker's version 1, then ours
+        assert table_versions.get(RevokedToken) == 2